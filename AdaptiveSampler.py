@@ -0,0 +1,193 @@
+import heapq
+import logging
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+
+class _Entry:
+    __slots__ = ("key", "target", "desired", "effective", "measured", "last_completed", "last_values", "last_time",
+                 "change_rate", "next_due", "generation", "running")
+
+    def __init__(self, key, target, interval, now):
+        self.key = key
+        self.target = target
+        self.desired = interval
+        self.effective = interval
+        self.measured = None  # Seconds between the last two sample completions
+        self.last_completed = None
+        self.last_values = None
+        self.last_time = None
+        self.change_rate = None  # Smoothed signal change per second
+        self.next_due = now
+        self.generation = 0
+        self.running = False
+
+
+class AdaptiveSampler:
+    """
+    Schedules samples of many targets (containers) on a worker pool, each at its own interval.
+
+    After every sample the change rate of the target's signals is smoothed with an EWMA and
+    the interval is set so that consecutive samples differ by about `target_change` (e.g.
+    5 CPU percentage points): volatile targets approach `min_interval`, flat ones back off
+    to `max_interval`, at most doubling per sample. If the desired intervals add up to more
+    than the sample rate the sampler can sustain, all of them are stretched by the same factor.
+
+    sample_fn may block (docker's stats(stream=False) takes 1-2 s), so the number of samples
+    run at once follows budget x the measured call latency, up to `workers`; the sustainable
+    rate is the smaller of `budget` and that concurrency over the latency.
+
+    sample_fn(target) returns a dict of numeric signals, or None; `on_interval(key, seconds)`
+    is called after each sample with the interval measured since the target's previous one.
+    It runs under the sampler's lock while the target is still registered, so it is never
+    called for a key after remove(key).
+    """
+
+    def __init__(self, sample_fn, min_interval=1.0, max_interval=60.0, budget=50.0, target_change=5.0,
+                 smoothing=0.3, workers=64, on_interval=None):
+        self.sample_fn = sample_fn
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.budget = budget
+        self.target_change = target_change
+        self.smoothing = smoothing
+        self.on_interval = on_interval
+
+        self.entries = {}
+        self.heap = []  # (next_due, generation, key)
+        self.desired_rate = 0.0  # Sum of 1 / desired interval over all targets
+        self.workers = workers
+        self.latency = None  # Smoothed seconds per sample_fn call
+        self.in_flight = 0
+        self.condition = threading.Condition()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="adaptive-sampler")
+
+    def add(self, key, target):
+        with self.condition:
+            if key in self.entries:
+                return
+            entry = self.entries[key] = _Entry(key, target, self.min_interval, time.monotonic())
+            self.desired_rate += 1.0 / entry.desired
+            heapq.heappush(self.heap, (entry.next_due, entry.generation, key))
+            self.condition.notify()
+
+    def remove(self, key):
+        with self.condition:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.desired_rate -= 1.0 / entry.desired  # Its heap item is skipped when popped
+
+    def keys(self):
+        with self.condition:
+            return set(self.entries)
+
+    def concurrency(self):
+        """
+        Samples run at once: enough to reach the budget at the measured call latency.
+        """
+        if not self.budget:
+            return self.workers
+        return max(1, min(self.workers, math.ceil(self.budget * (self.latency or 1.0))))
+
+    def capacity(self):
+        """
+        Samples per second the sampler can sustain: the budget, or less if the workers can't keep up.
+        """
+        if not self.latency:
+            return self.budget or math.inf
+        rate = self.concurrency() / self.latency
+        return min(self.budget, rate) if self.budget else rate
+
+    def stretch(self):
+        """
+        Factor applied to every desired interval to stay within capacity (1.0 if under it).
+        """
+        return max(1.0, self.desired_rate / self.capacity())
+
+    def effective_rate(self):
+        """
+        Samples per second actually achieved, from the measured intervals.
+        """
+        with self.condition:
+            return sum(1.0 / (entry.measured or entry.effective) for entry in self.entries.values())
+
+    def _update_interval(self, entry, values, now):
+        if values and entry.last_values is not None and now > entry.last_time:
+            change = sum(abs(value - entry.last_values[field]) for field, value in values.items()
+                         if field in entry.last_values)
+            rate = change / (now - entry.last_time)
+            entry.change_rate = rate if entry.change_rate is None else \
+                self.smoothing * rate + (1 - self.smoothing) * entry.change_rate
+
+        if entry.change_rate is not None:
+            desired = self.target_change / entry.change_rate if entry.change_rate > 0 else self.max_interval
+            desired = min(max(desired, self.min_interval), self.max_interval, entry.desired * 2)
+            self.desired_rate += 1.0 / desired - 1.0 / entry.desired
+            entry.desired = desired
+        if values:
+            entry.last_values, entry.last_time = values, now
+
+    def _complete(self, entry, started, values):
+        now = time.monotonic()
+        with self.condition:
+            entry.running = False
+            self.in_flight -= 1
+            elapsed = now - started
+            self.latency = elapsed if self.latency is None else \
+                self.smoothing * elapsed + (1 - self.smoothing) * self.latency
+            self.condition.notify()
+            if self.entries.get(entry.key) is not entry:
+                return  # Removed while sampling
+            self._update_interval(entry, values, now)
+            entry.effective = entry.desired * self.stretch()
+            # Keep the cadence anchored at the sample start, but never schedule in the past
+            entry.next_due = max(started + entry.effective, now)
+            entry.generation += 1
+            heapq.heappush(self.heap, (entry.next_due, entry.generation, entry.key))
+            if entry.last_completed is not None:
+                entry.measured = now - entry.last_completed
+                if self.on_interval is not None:
+                    self.on_interval(entry.key, entry.measured)
+            entry.last_completed = now
+
+    def _run_sample(self, entry):
+        started = time.monotonic()
+        values = None
+        try:
+            values = self.sample_fn(entry.target)
+        except Exception as e:
+            logging.error(f"Error sampling {entry.key}: {e}")
+        self._complete(entry, started, values)
+
+    def run(self, stop_event=None):
+        """
+        Dispatch due samples until stop_event is set.
+        """
+        stop_event = stop_event or threading.Event()
+        logging.info("Adaptive sampler started")
+        while not stop_event.is_set():
+            due = []
+            with self.condition:
+                now = time.monotonic()
+                slots = self.concurrency() - self.in_flight
+                while self.heap and self.heap[0][0] <= now and len(due) < slots:
+                    _, generation, key = heapq.heappop(self.heap)
+                    entry = self.entries.get(key)
+                    if entry is None or entry.generation != generation or entry.running:
+                        continue
+                    entry.running = True
+                    due.append(entry)
+                self.in_flight += len(due)
+                if not due:
+                    # With every slot busy, a completing sample notifies the condition
+                    timeout = self.heap[0][0] - now if self.heap and slots > 0 else 1.0
+                    self.condition.wait(min(timeout, 1.0))
+                    continue
+            for entry in due:
+                self.executor.submit(self._run_sample, entry)
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,359 @@
+import logging
+import re
+import threading
+import time
+from collections import deque
+import yaml
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+# Subset of PromQL used in alert.rules.yml:
+#   [rate(]metric{label op "value", ...}[[5m])] <comparison> <number>
+_EXPR_RE = re.compile(
+    r'^\s*(?:(?P<func>rate)\(\s*)?'
+    r'(?P<metric>[a-zA-Z_:][a-zA-Z0-9_:]*)\s*'
+    r'(?:\{(?P<matchers>[^}]*)\})?\s*'
+    r'(?:\[(?P<window>\d+[smhd])\]\s*)?'
+    r'(?(func)\)\s*)'
+    r'(?P<op>==|!=|>=|<=|>|<)\s*'
+    r'(?P<threshold>[-+]?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?)\s*$'
+)
+_MATCHER_RE = re.compile(r'\s*([a-zA-Z_][a-zA-Z0-9_]*)\s*(=~|!~|!=|=)\s*"((?:[^"\\]|\\.)*)"\s*,?')
+_TEMPLATE_RE = re.compile(r'\{\{\s*\$(labels\.([a-zA-Z_][a-zA-Z0-9_]*)|value)\s*\}\}')
+
+_DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+_COMPARATORS = {
+    ">": lambda a, b: a > b,
+    "<": lambda a, b: a < b,
+    ">=": lambda a, b: a >= b,
+    "<=": lambda a, b: a <= b,
+    "==": lambda a, b: a == b,
+    "!=": lambda a, b: a != b,
+}
+
+
+def parse_duration(text):
+    """
+    Convert a Prometheus duration such as '30s', '2m' or '1h' to seconds.
+    """
+    if not text:
+        return 0
+    return int(text[:-1]) * _DURATION_UNITS[text[-1]]
+
+
+def _parse_matchers(text):
+    matchers = []
+    if not text:
+        return matchers
+    position = 0
+    while position < len(text):
+        match = _MATCHER_RE.match(text, position)
+        if not match:
+            raise ValueError(f"Unsupported label matcher: {text[position:]!r}")
+        name, op, value = match.group(1), match.group(2), match.group(3).replace('\\"', '"')
+        # Prometheus regex matchers are fully anchored
+        pattern = re.compile(f"^(?:{value})$") if op in ("=~", "!~") else None
+        matchers.append((name, op, value, pattern))
+        position = match.end()
+    return matchers
+
+
+class AlertRule:
+    """
+    One alerting rule from alert.rules.yml, compiled into a selector plus a threshold comparison.
+    """
+
+    def __init__(self, definition, group_name=""):
+        self.name = definition['alert']
+        self.group = group_name
+        self.expr = definition['expr'].strip()
+        self.hold = parse_duration(definition.get('for'))
+        self.labels = {k: str(v) for k, v in (definition.get('labels') or {}).items()}
+        self.annotations = definition.get('annotations') or {}
+
+        match = _EXPR_RE.match(self.expr)
+        if not match:
+            raise ValueError(f"Unsupported expression in rule {self.name}: {self.expr}")
+        self.func = match.group('func')
+        self.metric = match.group('metric')
+        self.matchers = _parse_matchers(match.group('matchers'))
+        self.window = parse_duration(match.group('window'))
+        self.compare = _COMPARATORS[match.group('op')]
+        self.threshold = float(match.group('threshold'))
+        if self.func == "rate" and not self.window:
+            raise ValueError(f"rate() without a range window in rule {self.name}")
+
+    def matches(self, labels):
+        for name, op, value, pattern in self.matchers:
+            actual = labels.get(name, "")
+            if op == "=" and actual != value:
+                return False
+            if op == "!=" and actual == value:
+                return False
+            if op == "=~" and not pattern.match(actual):
+                return False
+            if op == "!~" and pattern.match(actual):
+                return False
+        return True
+
+    def render(self, template, labels, value):
+        def substitute(match):
+            if match.group(1) == "value":
+                return f"{value:g}"
+            return labels.get(match.group(2), "")
+        return _TEMPLATE_RE.sub(substitute, str(template))
+
+
+class _SeriesWindow:
+    """
+    Sliding window of one series. Counter resets are folded into a running offset so
+    rate() over the window is a single subtraction on the oldest and newest points.
+    """
+    __slots__ = ("labels", "points", "offset", "last_raw")
+
+    def __init__(self, labels):
+        self.labels = labels
+        self.points = deque()  # (timestamp, reset-adjusted value)
+        self.offset = 0.0
+        self.last_raw = None
+
+    def append(self, timestamp, value, keep_seconds):
+        if self.last_raw is not None and value < self.last_raw:
+            self.offset += self.last_raw  # Counter reset
+        self.last_raw = value
+        self.points.append((timestamp, value + self.offset))
+        horizon = timestamp - keep_seconds
+        while len(self.points) > 1 and self.points[0][0] < horizon:
+            self.points.popleft()
+
+    def latest(self):
+        return self.last_raw
+
+    def rate(self):
+        if len(self.points) < 2:
+            return None
+        (t0, v0), (t1, v1) = self.points[0], self.points[-1]
+        return (v1 - v0) / (t1 - t0) if t1 > t0 else None
+
+
+class AlertRuleEvaluator:
+    """
+    Evaluates alert.rules.yml in-process against live collector samples with the same
+    pending/firing `for` semantics as Prometheus, and calls `on_fire` / `on_resolve`
+    with alert dictionaries shaped like app.fetch_prometheus_alerts() entries.
+    """
+
+    def __init__(self, rules, on_fire=None, on_resolve=None, stale_after=300):
+        self.rules = rules
+        self.on_fire = on_fire
+        self.on_resolve = on_resolve
+        self.stale_after = stale_after  # Same 5 minute staleness as Prometheus
+
+        self.rules_by_metric = {}
+        self.window_by_metric = {}
+        self.rate_metrics = set()  # Metrics some rule takes rate() of; their value moves as the window slides
+        for rule in rules:
+            self.rules_by_metric.setdefault(rule.metric, []).append(rule)
+            self.window_by_metric[rule.metric] = max(self.window_by_metric.get(rule.metric, 0), rule.window)
+            if rule.func == "rate":
+                self.rate_metrics.add(rule.metric)
+
+        self.series = {}  # (metric, sorted label items) -> _SeriesWindow
+        self.last_seen = {}  # series key -> timestamp of the last sample
+        self.series_rules = {}  # series key -> rules whose selector matches it
+        self.dirty = set()  # series keys whose rule inputs changed since the last evaluation
+        self.active = {}  # (rule name, rule group, series key) -> alert dict
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_file(cls, path, **kwargs):
+        with open(path) as f:
+            document = yaml.safe_load(f) or {}
+        rules = []
+        for group in document.get('groups', []):
+            for definition in group.get('rules', []):
+                if 'alert' not in definition:
+                    continue  # Recording rules are not evaluated here
+                try:
+                    rules.append(AlertRule(definition, group.get('name', "")))
+                except ValueError as e:
+                    logging.warning(f"Skipping alert rule: {e}")
+        logging.info(f"Loaded {len(rules)} alert rules from {path}")
+        return cls(rules, **kwargs)
+
+    def observe(self, samples, timestamp=None):
+        """
+        Feed (metric_name, labels, value) samples. Samples of metrics no rule refers to are dropped.
+        """
+        timestamp = timestamp if timestamp is not None else time.time()
+        with self.lock:
+            for name, labels, value in samples:
+                keep = self.window_by_metric.get(name)
+                if keep is None:
+                    continue
+                key = (name, tuple(sorted(labels.items())))
+                window = self.series.get(key)
+                if window is None:
+                    window = self.series[key] = _SeriesWindow(dict(labels))
+                    self.series_rules[key] = [rule for rule in self.rules_by_metric[name] if rule.matches(labels)]
+                    previous = None
+                else:
+                    previous = window.latest()
+                value = float(value)
+                window.append(timestamp, value, keep)
+                self.last_seen[key] = timestamp
+                # An unchanged gauge cannot change its rules' outcome; pending/firing alerts are re-checked anyway
+                if previous is None or value != previous or name in self.rate_metrics:
+                    self.dirty.add(key)
+
+    def evaluable(self, metric_names):
+        """
+        Split the rules into (evaluable, missing) by whether their metric is among `metric_names`.
+        """
+        evaluable = [rule for rule in self.rules if rule.metric in metric_names]
+        missing = [rule for rule in self.rules if rule.metric not in metric_names]
+        return evaluable, missing
+
+    def evaluate(self, now=None):
+        """
+        Evaluate only the series updated since the last tick plus every pending or
+        firing alert. Returns the list of currently firing alerts.
+        """
+        now = now if now is not None else time.time()
+        fired, resolved = [], []
+
+        with self.lock:
+            dirty, self.dirty = self.dirty, set()
+
+            # Drop series that stopped reporting; their alerts resolve below
+            for key in [key for key, seen in self.last_seen.items() if now - seen > self.stale_after]:
+                del self.last_seen[key]
+                del self.series[key]
+                del self.series_rules[key]
+                dirty.discard(key)
+
+            candidates = set()
+            for key in dirty:
+                for rule in self.series_rules[key]:
+                    candidates.add((rule, key))
+            for alert_key, alert in self.active.items():
+                candidates.add((alert['_rule'], alert_key[2]))
+
+            for rule, key in candidates:
+                alert_key = (rule.name, rule.group, key)
+                window = self.series.get(key)
+                value = None
+                if window is not None:
+                    value = window.rate() if rule.func == "rate" else window.latest()
+                condition = value is not None and rule.compare(value, rule.threshold)
+                alert = self.active.get(alert_key)
+
+                if not condition:
+                    if alert is not None:
+                        del self.active[alert_key]
+                        if alert['state'] == "firing":
+                            alert['state'] = "resolved"
+                            resolved.append(alert)
+                    continue
+
+                if alert is None:
+                    labels = dict(window.labels)
+                    labels.update(rule.labels)
+                    labels['alertname'] = rule.name
+                    alert = self.active[alert_key] = {"_rule": rule, "labels": labels,
+                                                      "active_at": now, "state": "pending"}
+                alert['value'] = value
+                if alert['state'] == "pending" and now - alert['active_at'] >= rule.hold:
+                    alert['state'] = "firing"
+                    fired.append(alert)
+
+            firing = [self._public(alert) for alert in self.active.values() if alert['state'] == "firing"]
+
+        for alert in fired:
+            self._notify(self.on_fire, alert)
+        for alert in resolved:
+            self._notify(self.on_resolve, alert)
+        return firing
+
+    def _public(self, alert):
+        rule, labels = alert['_rule'], alert['labels']
+        service = labels.get('service') or labels.get('container_name') or labels.get('job') or \
+            labels.get('instance', 'No instance provided').split(':')[0]
+        return {
+            "alertname": rule.name,
+            "severity": labels.get('severity', 'No severity provided'),
+            "service": service,
+            "description": rule.render(rule.annotations.get('description', 'No description provided'),
+                                       labels, alert['value']),
+            "state": alert['state'],
+            "source": labels.get('source', 'No source provided'),
+            "value": alert['value'],
+            "active_at": alert['active_at'],
+        }
+
+    def _notify(self, callback, alert):
+        if callback is None:
+            return
+        try:
+            callback(self._public(alert))
+        except Exception as e:
+            logging.error(f"Error handling alert {alert['labels']['alertname']}: {e}")
+
+
+def samples_from_registry(registry):
+    """
+    Flatten a prometheus_client registry into (metric_name, labels, value) samples.
+    """
+    for family in registry.collect():
+        for sample in family.samples:
+            yield sample.name, sample.labels, sample.value
+
+
+def metric_names(registries):
+    """
+    Names of the metrics the registries expose, counters with and without their _total suffix.
+    """
+    names = set()
+    for registry in registries:
+        for family in registry.collect():
+            names.add(family.name)
+            names.update(sample.name for sample in family.samples)
+            if family.type == "counter":
+                names.add(family.name + "_total")
+    return names
+
+
+def log_evaluable_rules(evaluator, registries):
+    """
+    Log which rules the in-process registries can feed. The others (cAdvisor, `up` and process
+    metrics, which only Prometheus scrapes) never fire here and stay with Prometheus/Alertmanager.
+    """
+    evaluable, missing = evaluator.evaluable(metric_names(registries))
+    logging.info(f"Evaluating {len(evaluable)} alert rules in-process: "
+                 f"{', '.join(f'{rule.group}/{rule.name}' for rule in evaluable) or 'none'}")
+    for rule in missing:
+        logging.warning(f"Alert rule {rule.group}/{rule.name} is skipped in-process: "
+                        f"{rule.metric} is not collected by this process")
+    return evaluable, missing
+
+
+def run_evaluator(evaluator, registries, interval=1.0, stop_event=None):
+    """
+    Evaluate on every tick against the live samples of the given collector registries.
+    """
+    stop_event = stop_event or threading.Event()
+    logged = False
+    while not stop_event.is_set():
+        try:
+            now = time.time()
+            if not logged:
+                log_evaluable_rules(evaluator, registries)
+                logged = True
+            for registry in registries:
+                evaluator.observe(samples_from_registry(registry), now)
+            evaluator.evaluate(now)
+        except Exception as e:
+            logging.error(f"Error evaluating alert rules: {e}")
+        stop_event.wait(interval)
@@ -0,0 +1,274 @@
+"""
+Streaming anomaly detection over every container, service and app series.
+
+Each series gets one row in preallocated NumPy arrays: an EWMA mean and variance of
+its residual, plus a seasonal baseline (an offset per time-of-period bin, learned once
+per pass through the bin so a level change is not absorbed as seasonality). One tick
+updates every observed series with a handful of vectorized operations and scores
+each one as |value - baseline| / residual standard deviation. Memory is fixed by
+`capacity`: idle series expire and, when the table is full, the least recently seen
+rows are recycled.
+
+The top-K scores are exported as metrics, and the highest score per app/service is
+added to the status entries (see app.evaluate_utilization).
+"""
+import logging
+import threading
+import time
+
+import numpy as np
+from prometheus_client import CollectorRegistry, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+
+from AlertRuleEvaluator import samples_from_registry
+from SelfMetrics import pipeline_metrics
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+# Labels whose value names the app/service a series belongs to, for the status page
+STATUS_LABELS = ("app", "service")
+
+
+class _AnomalyCollector:
+    def __init__(self, detector):
+        self.detector = detector
+
+    def collect(self):
+        return self.detector.metric_families()
+
+
+class AnomalyDetector:
+    """
+    `alpha` smooths the level, `slow_alpha` the residual variance, `drift_alpha` the
+    long-term level, `season_alpha` the seasonal offsets (`season_bins` bins over `season_period` seconds).
+    A bin's offset moves once per visit, by `season_alpha` times the mean deviation seen
+    during the visit. A series scores the larger of its point deviation
+    |value - baseline| / std and its drift |raw level - raw long-term level| / std, so
+    slow leaks are caught as well as spikes.
+    Series score 0 until they have `warmup` observations. The standard deviation is
+    floored at `relative_floor` of the baseline (and `min_std`) so flat series do not
+    alarm on tiny wiggles.
+    """
+
+    def __init__(self, capacity=100000, alpha=0.05, slow_alpha=0.005, drift_alpha=0.002, season_period=86400.0,
+                 season_bins=24, season_alpha=0.1, warmup=20, threshold=5.0, top_k=20, idle_expiry=3600.0,
+                 relative_floor=0.05, min_std=1e-3):
+        self.capacity = capacity
+        self.alpha = alpha
+        self.slow_alpha = slow_alpha
+        self.drift_alpha = drift_alpha
+        self.season_period = season_period
+        self.season_bins = season_bins
+        self.season_alpha = season_alpha
+        self.warmup = warmup
+        self.threshold = threshold
+        self.top_k = top_k
+        self.idle_expiry = idle_expiry
+        self.relative_floor = relative_floor
+        self.min_std = min_std
+
+        self.rows = {}  # (metric name, labels tuple) -> row
+        self.row_keys = [None] * capacity
+        self.free = list(range(capacity - 1, -1, -1))
+        self.count = np.zeros(capacity, dtype=np.int32)
+        self.mean = np.zeros(capacity, dtype=np.float32)  # Deseasonalized level
+        self.level = np.zeros(capacity, dtype=np.float32)  # Raw level, for drift
+        self.slow_mean = np.zeros(capacity, dtype=np.float32)  # Raw long-term level
+        self.var = np.zeros(capacity, dtype=np.float32)
+        self.seasonal = np.zeros((capacity, season_bins), dtype=np.float32)
+        # Deviations from the level during the current visit of `self.slot`, folded in when it ends
+        self.visit_sum = np.zeros(capacity, dtype=np.float32)
+        self.visit_count = np.zeros(capacity, dtype=np.int32)
+        self.slot = None
+        self.value = np.zeros(capacity, dtype=np.float32)
+        self.baseline = np.zeros(capacity, dtype=np.float32)
+        self.score = np.zeros(capacity, dtype=np.float32)
+        self.last_seen = np.zeros(capacity, dtype=np.float64)
+        self.evicted = 0
+        self.lock = threading.Lock()
+
+        self.registry = CollectorRegistry()
+        self.registry.register(_AnomalyCollector(self))
+
+    def _release(self, rows):
+        for row in rows:
+            del self.rows[self.row_keys[row]]
+            self.row_keys[row] = None
+            self.free.append(row)
+        self.count[rows] = self.visit_count[rows] = 0
+        self.mean[rows] = self.level[rows] = self.slow_mean[rows] = self.var[rows] = self.score[rows] = 0.0
+        self.visit_sum[rows] = 0.0
+        self.seasonal[rows] = 0.0
+
+    def _make_room(self, needed, now, keep):
+        """
+        Free rows for `needed` new series, never releasing the rows in `keep` (those of
+        series already seen in the current tick).
+        """
+        candidates = self.count > 0
+        candidates[keep] = False
+        expired = np.flatnonzero(candidates & (self.last_seen < now - self.idle_expiry))
+        self._release(expired)
+        candidates[expired] = False
+        if len(self.free) < needed:
+            # Still full: recycle the least recently seen rows, a batch at a time
+            used = np.flatnonzero(candidates)
+            batch = min(len(used), max(needed - len(self.free), self.capacity // 100))
+            if batch:
+                oldest = used[np.argpartition(self.last_seen[used], batch - 1)[:batch]]
+                self._release(oldest)
+                self.evicted += len(oldest)
+
+    def _row_indices(self, keys, now):
+        rows = self.rows
+        indices = np.empty(len(keys), dtype=np.int64)
+        missing = []
+        for position, key in enumerate(keys):
+            row = rows.get(key)
+            if row is None:
+                missing.append(position)
+                row = -1
+            indices[position] = row
+        if missing:
+            if len(self.free) < len(missing):
+                self._make_room(len(missing), now, indices[indices >= 0])
+            for position in missing[:len(self.free)]:
+                row = self.free.pop()
+                rows[keys[position]] = row
+                self.row_keys[row] = keys[position]
+                indices[position] = row
+        return indices
+
+    def update(self, keys, values, now=None):
+        """
+        One tick: fold `values[i]` of series `keys[i]` into the state of all series at once.
+        """
+        now = time.time() if now is None else now
+        x = np.asarray(values, dtype=np.float32)
+        with self.lock:
+            rows = self._row_indices(keys, now)
+            usable = (rows >= 0) & np.isfinite(x)
+            rows, x = rows[usable], x[usable]
+
+            slot = int((now % self.season_period) / self.season_period * self.season_bins)
+            if slot != self.slot:
+                self._end_visit()
+                self.slot = slot
+
+            fresh = self.count[rows] == 0
+            self.mean[rows[fresh]] = self.level[rows[fresh]] = self.slow_mean[rows[fresh]] = x[fresh]
+            offset = self.seasonal[rows, slot]
+            mean = self.mean[rows]
+            level = self.level[rows]
+            slow_mean = self.slow_mean[rows]
+            var = self.var[rows]
+
+            baseline = mean + offset
+            residual = x - baseline
+            floor = np.maximum(np.abs(baseline) * self.relative_floor, self.min_std)
+            std = np.sqrt(var + floor * floor)
+            score = np.maximum(np.abs(residual), np.abs(level - slow_mean)) / std
+            score[self.count[rows] < self.warmup] = 0.0
+
+            mean = mean + self.alpha * (x - offset - mean)
+            self.mean[rows] = mean
+            self.level[rows] = level + self.alpha * (x - level)
+            self.slow_mean[rows] = slow_mean + self.drift_alpha * (x - slow_mean)
+            # Slow and held while the point deviation is anomalous, so an ongoing anomaly is not
+            # learned as normal noise
+            normal = np.abs(residual) < self.threshold * std
+            self.var[rows] = np.where(normal, (1 - self.slow_alpha) * (var + self.slow_alpha * residual * residual), var)
+            self.visit_sum[rows] += x - mean
+            self.visit_count[rows] += 1
+            self.count[rows] += 1
+            self.value[rows] = x
+            self.baseline[rows] = baseline
+            self.score[rows] = score
+            self.last_seen[rows] = now
+        return len(rows)
+
+    def _end_visit(self):
+        """
+        Move the offsets of the bin just left towards the mean deviation seen during the visit.
+        """
+        if self.slot is None:
+            return
+        rows = np.flatnonzero(self.visit_count > 0)
+        deviation = self.visit_sum[rows] / self.visit_count[rows]
+        offset = self.seasonal[rows, self.slot]
+        self.seasonal[rows, self.slot] = offset + self.season_alpha * (deviation - offset)
+        self.visit_sum[rows] = 0.0
+        self.visit_count[rows] = 0
+
+    def observe_registries(self, registries, now=None):
+        """
+        Update from the current samples of prometheus_client registries.
+        """
+        keys, values = [], []
+        for registry in registries:
+            for name, labels, value in samples_from_registry(registry):
+                keys.append((name, tuple(sorted(labels.items()))))
+                values.append(value)
+        with pipeline_metrics.time_stage("anomaly", "update"):
+            return self.update(keys, values, now)
+
+    def top(self, k=None):
+        """
+        The `k` highest scoring series as dicts, highest first.
+        """
+        k = self.top_k if k is None else k
+        with self.lock:
+            used = np.flatnonzero(self.score > 0)
+            if len(used) > k:
+                used = used[np.argpartition(self.score[used], -k)[-k:]]
+            used = used[np.argsort(-self.score[used])]
+            return [{"metric": self.row_keys[row][0], "labels": dict(self.row_keys[row][1]),
+                     "score": float(self.score[row]), "value": float(self.value[row]),
+                     "baseline": float(self.baseline[row])} for row in used]
+
+    def scores_by_name(self, labels=STATUS_LABELS, minimum=1.0):
+        """
+        {app/service name: highest score among its series}, for series scoring at least `minimum`.
+        """
+        scores = {}
+        with self.lock:
+            for row in np.flatnonzero(self.score >= minimum):
+                score = float(self.score[row])
+                for label, value in self.row_keys[row][1]:
+                    if label in labels and score > scores.get(value, 0.0):
+                        scores[value] = score
+        return scores
+
+    def metric_families(self):
+        score = GaugeMetricFamily("anomaly_score", "Anomaly score of the highest scoring series",
+                                  labels=["metric", "series"])
+        for entry in self.top():
+            series = ",".join(f"{label}={value}" for label, value in sorted(entry["labels"].items()))
+            score.add_metric([entry["metric"], series], entry["score"])
+        with self.lock:
+            tracked = len(self.rows)
+            above = int(np.count_nonzero(self.score >= self.threshold))
+        tracked_family = GaugeMetricFamily("anomaly_series_tracked", "Series with detector state")
+        tracked_family.add_metric([], tracked)
+        above_family = GaugeMetricFamily("anomaly_series_above_threshold", "Series scoring at or above the threshold")
+        above_family.add_metric([], above)
+        evicted_family = GaugeMetricFamily("anomaly_series_evicted", "Series recycled because the table was full")
+        evicted_family.add_metric([], self.evicted)
+        return [score, tracked_family, above_family, evicted_family]
+
+    def get_metrics(self):
+        return generate_latest(self.registry).decode("utf-8")
+
+
+def run_detector(detector, registries, interval=15.0, stop_event=None):
+    """
+    Feed the detector from the given collector registries on every tick.
+    """
+    stop_event = stop_event or threading.Event()
+    while not stop_event.is_set():
+        try:
+            detector.observe_registries(registries)
+        except Exception as e:
+            logging.error(f"Error updating anomaly detector: {e}")
+        stop_event.wait(interval)
@@ -0,0 +1,215 @@
+"""
+Bulk scale and resource-limit changes for Docker services.
+
+A batch is validated against one services.list() snapshot, then applied concurrently
+with at most `max_in_flight` updates outstanding. Every call to a daemon (update or
+reload) takes a token from that daemon's TokenBucket, so batches, retries and several
+updaters pointed at the same daemon share one rate limit. An update that loses a
+race with another writer ("update out of sequence") is retried on a freshly reloaded
+service, with relative changes recomputed from the new spec.
+
+    POST /bulk_update {"items": [{"service": "web", "replicas": 4},
+                                 {"service": "worker", "scale_by": -1, "cpu_limit": "0.5", "mem_limit": "256M"}]}
+"""
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from docker.errors import APIError
+from docker.types import Resources
+
+from ResolveAlert import ResolveAlert
+from SelfMetrics import pipeline_metrics
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+CHANGE_FIELDS = ("replicas", "scale_by", "cpu_limit", "mem_limit")
+
+
+class TokenBucket:
+    """
+    `rate` tokens per second, at most `burst` saved up. acquire() blocks until a token is free.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def bucket_for(daemon, rate, burst):
+    """
+    The shared TokenBucket of a daemon URL, created with `rate` and `burst` on first use.
+    """
+    with _buckets_lock:
+        if daemon not in _buckets:
+            _buckets[daemon] = TokenBucket(rate, burst)
+        return _buckets[daemon]
+
+
+def is_version_conflict(error):
+    return isinstance(error, APIError) and (error.status_code == 409 or "out of sequence" in str(error))
+
+
+def current_replicas(service):
+    return service.attrs['Spec']['Mode'].get('Replicated', {}).get('Replicas', 1)
+
+
+class BulkUpdater:
+    """
+    Applies batches of service changes through `client`. Each item names a `service`
+    (without the stack prefix, like /scale_up) and any of: `replicas` (absolute),
+    `scale_by` (relative, floored at 0), `cpu_limit` (CPUs) and `mem_limit` ("256M", "1G").
+    """
+
+    def __init__(self, client, daemon="default", max_in_flight=8, rate=10.0, burst=20, max_retries=3,
+                 retry_backoff=0.1):
+        self.client = client
+        self.bucket = bucket_for(daemon, rate, burst)
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="bulk-update")
+
+    def validate(self, items, stack_name="my_thesis_"):
+        """
+        Check every item against one snapshot of the service list. Returns (plans, results):
+        a plan per valid item and a result per item, invalid ones already final.
+        """
+        with pipeline_metrics.time_backend("docker", "services.list"):
+            snapshot = {service.name: service for service in self.client.services.list()}
+        plans, results, seen = [], [], set()
+        for index, item in enumerate(items):
+            result = {"index": index, "service": item.get("service") if isinstance(item, dict) else None}
+            results.append(result)
+            error = self._check(item, snapshot, stack_name, seen)
+            if error:
+                result.update(status="invalid", message=error)
+                continue
+            seen.add(item["service"])
+            result["status"] = "valid"
+            plans.append((snapshot[stack_name + item["service"]], item, result))
+        return plans, results
+
+    def _check(self, item, snapshot, stack_name, seen):
+        if not isinstance(item, dict) or not item.get("service"):
+            return "Missing service"
+        if item["service"] in seen:
+            return "Service appears more than once in the batch"
+        service = snapshot.get(stack_name + item["service"])
+        if service is None:
+            return "Service not found"
+        if not any(field in item for field in CHANGE_FIELDS):
+            return f"Nothing to change; expected one of {', '.join(CHANGE_FIELDS)}"
+        if "replicas" in item and "scale_by" in item:
+            return "Use either replicas or scale_by, not both"
+        try:
+            if "replicas" in item or "scale_by" in item:
+                if 'Replicated' not in service.attrs['Spec']['Mode']:
+                    return "Only replicated services can be scaled"
+                if int(item.get("replicas", 0)) < 0:
+                    return "replicas must not be negative"
+                int(item.get("scale_by", 0))
+            if "cpu_limit" in item and float(item["cpu_limit"]) <= 0:
+                return "cpu_limit must be positive"
+            if "mem_limit" in item:
+                ResolveAlert.convert_to_bytes(str(item["mem_limit"]))
+        except (TypeError, ValueError) as e:
+            return f"Invalid value: {e}"
+        return None
+
+    def _changes(self, service, item):
+        """
+        update() keyword arguments that bring `service` to what `item` asks for (empty if it already is).
+        """
+        changes = {}
+        if "replicas" in item or "scale_by" in item:
+            replicas = int(item["replicas"]) if "replicas" in item else \
+                max(0, current_replicas(service) + int(item["scale_by"]))
+            if replicas != current_replicas(service):
+                changes["mode"] = {"Replicated": {"Replicas": replicas}}
+
+        if "cpu_limit" in item or "mem_limit" in item:
+            resources = service.attrs['Spec'].get('TaskTemplate', {}).get('Resources', {})
+            limits = dict(resources.get('Limits', {}))
+            reservations = resources.get('Reservations', {})
+            if "cpu_limit" in item:
+                limits['NanoCPUs'] = int(float(item["cpu_limit"]) * 1e9)
+            if "mem_limit" in item:
+                limits['MemoryBytes'] = ResolveAlert.convert_to_bytes(str(item["mem_limit"]))
+            if limits != resources.get('Limits', {}):
+                # Resources replaces the whole section, so the other limits and reservations are carried over
+                changes["resources"] = Resources(cpu_limit=limits.get('NanoCPUs'), mem_limit=limits.get('MemoryBytes'),
+                                                 cpu_reservation=reservations.get('NanoCPUs'),
+                                                 mem_reservation=reservations.get('MemoryBytes'))
+        return changes
+
+    def _apply(self, plan):
+        service, item, result = plan
+        attempts = 0
+        try:
+            while True:
+                changes = self._changes(service, item)
+                if not changes:
+                    result.update(status="unchanged", message="Already at the requested state")
+                    break
+                attempts += 1
+                try:
+                    self.bucket.acquire()
+                    with pipeline_metrics.time_backend("docker", "services.update"):
+                        service.update(**changes)
+                    result.update(status="applied", message=f"Updated {', '.join(sorted(changes))}")
+                    if "mode" in changes:
+                        result["replicas"] = changes["mode"]["Replicated"]["Replicas"]
+                    break
+                except APIError as e:
+                    if not is_version_conflict(e) or attempts > self.max_retries:
+                        raise
+                    logging.info(f"Version conflict updating {service.name}, retrying ({attempts}/{self.max_retries})")
+                    time.sleep(self.retry_backoff * 2 ** (attempts - 1) * random.uniform(0.5, 1.0))
+                    self.bucket.acquire()
+                    service.reload()
+        except Exception as e:
+            logging.error(f"Error updating service {service.name}: {e}")
+            pipeline_metrics.drop("bulk_update", "update_failed")
+            result.update(status="failed", message=str(e))
+        result["attempts"] = attempts
+        if "replicas" not in result and "Replicated" in service.attrs['Spec']['Mode']:
+            result["replicas"] = current_replicas(service)
+        return result
+
+    def run(self, items, stack_name="my_thesis_", dry_run=False):
+        """
+        Validate and apply a batch. Returns {"results": [...], "summary": {status: count}},
+        results in the order of `items`.
+        """
+        plans, results = self.validate(items, stack_name)
+        if not dry_run:
+            list(self.executor.map(self._apply, plans))
+        summary = {}
+        for result in results:
+            summary[result["status"]] = summary.get(result["status"], 0) + 1
+        return {"results": results, "summary": summary}
+
+    def close(self):
+        self.executor.shutdown(wait=False)
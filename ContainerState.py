@@ -0,0 +1,202 @@
+"""
+Columnar per-container state for api.DockerMetricsMonitor.
+
+Every container gets a slot (row) in a set of NumPy arrays, one array per counter,
+with freed slots reused through a free-list as containers come and go. Samplers
+write the raw counters of a stats frame into the container's row under one lock
+acquisition; the network/disk deltas against the container's previous frame are
+taken right there with a few scalar stores, so they stay per sampling interval no
+matter how often the registry is read. CPU % and memory %, which depend on the
+latest frame only, are derived for every container written since the last pass in
+one vectorized step, and the collector publishes the result as a single snapshot
+at scrape time.
+"""
+import threading
+
+import numpy as np
+from prometheus_client.core import GaugeMetricFamily
+
+# Raw counters as written from stats frames, and the previous network/disk counters
+COUNTERS = ("cpu_total", "precpu_total", "system", "presystem", "num_cpus", "mem_usage", "mem_limit",
+            "net_tx", "net_rx", "blk_read", "blk_write", "prev_net_tx", "prev_net_rx", "prev_blk_read",
+            "prev_blk_write")
+# Values derived by write() (deltas) and compute() (percentages)
+DERIVED = ("cpu_percent", "memory_percent", "network_sent", "network_recv", "disk_read", "disk_write")
+FLAGS = ("used", "pending", "computed", "has_prev", "io_valid")
+
+# (metric name, help, derived column, needs a previous frame)
+METRICS = (
+    ("docker_container_cpu_usage_percent", "CPU usage percent for Docker containers", "cpu_percent", False),
+    ("docker_container_memory_usage_percent", "Memory usage percent for Docker containers", "memory_percent", False),
+    ("docker_container_network_sent_bytes", "Network transmitted bytes per sampling interval", "network_sent", True),
+    ("docker_container_network_recv_bytes", "Network received bytes per sampling interval", "network_recv", True),
+    ("docker_container_disk_read_bytes", "Disk read bytes per sampling interval", "disk_read", True),
+    ("docker_container_disk_write_bytes", "Disk write bytes per sampling interval", "disk_write", True),
+)
+
+
+def frame_counters(stats):
+    """
+    The raw counters of a decoded Docker stats frame, in the order of COUNTERS[:11].
+    """
+    cpu_stats = stats["cpu_stats"]
+    precpu_stats = stats["precpu_stats"]
+    memory_stats = stats["memory_stats"]
+    net_tx = net_rx = 0
+    for interface in (stats.get("networks") or {}).values():
+        net_tx += interface.get("tx_bytes", 0)
+        net_rx += interface.get("rx_bytes", 0)
+    read = write = 0
+    for entry in (stats.get("blkio_stats") or {}).get("io_service_bytes_recursive") or []:
+        op = entry.get("op", "").lower()
+        if op == "read":
+            read += entry.get("value", 0)
+        elif op == "write":
+            write += entry.get("value", 0)
+    return (cpu_stats["cpu_usage"]["total_usage"], precpu_stats["cpu_usage"]["total_usage"],
+            cpu_stats["system_cpu_usage"], precpu_stats["system_cpu_usage"],
+            len(cpu_stats["cpu_usage"].get("percpu_usage", [])), memory_stats.get("usage", 0),
+            memory_stats.get("limit", 1), net_tx, net_rx, read, write)
+
+
+class ContainerStateTable:
+    """
+    Grows by doubling from `capacity` slots. Counters are int64 (Docker's nanosecond
+    CPU counters would lose precision as float64 on long-running hosts), derived values float64.
+    """
+
+    def __init__(self, capacity=1024):
+        self.capacity = capacity
+        self.columns = {name: np.zeros(capacity, dtype=np.int64) for name in COUNTERS}
+        self.columns.update({name: np.zeros(capacity, dtype=np.float64) for name in DERIVED})
+        self.columns.update({name: np.zeros(capacity, dtype=bool) for name in FLAGS})
+        self.slots = {}  # container name -> slot
+        self.names = [None] * capacity
+        self.free = list(range(capacity - 1, -1, -1))
+        self.lock = threading.Lock()
+
+    def _grow(self):
+        old = self.capacity
+        self.capacity *= 2
+        for name, column in self.columns.items():
+            grown = np.zeros(self.capacity, dtype=column.dtype)
+            grown[:old] = column
+            self.columns[name] = grown
+        self.names.extend([None] * old)
+        self.free.extend(range(self.capacity - 1, old - 1, -1))
+
+    def _slot(self, name):
+        slot = self.slots.get(name)
+        if slot is None:
+            if not self.free:
+                self._grow()
+            slot = self.slots[name] = self.free.pop()
+            self.names[slot] = name
+            self.columns["used"][slot] = True
+        return slot
+
+    def write(self, name, counters):
+        """
+        Store the raw counters (see frame_counters) of one container's latest frame and the
+        network/disk deltas since its previous frame.
+        """
+        net_tx, net_rx, blk_read, blk_write = counters[7:11]
+        with self.lock:
+            slot = self._slot(name)
+            c = self.columns
+            for column, value in zip(COUNTERS, counters):
+                c[column][slot] = value
+            if c["has_prev"][slot]:
+                c["network_sent"][slot] = net_tx - int(c["prev_net_tx"][slot])
+                c["network_recv"][slot] = net_rx - int(c["prev_net_rx"][slot])
+                c["disk_read"][slot] = blk_read - int(c["prev_blk_read"][slot])
+                c["disk_write"][slot] = blk_write - int(c["prev_blk_write"][slot])
+                c["io_valid"][slot] = True
+            c["prev_net_tx"][slot] = net_tx
+            c["prev_net_rx"][slot] = net_rx
+            c["prev_blk_read"][slot] = blk_read
+            c["prev_blk_write"][slot] = blk_write
+            c["has_prev"][slot] = True
+            c["pending"][slot] = True
+
+    def write_frame(self, name, stats):
+        self.write(name, frame_counters(stats))
+
+    def remove(self, name):
+        with self.lock:
+            slot = self.slots.pop(name, None)
+            if slot is None:
+                return
+            self.names[slot] = None
+            for flag in FLAGS:
+                self.columns[flag][slot] = False
+            self.free.append(slot)
+
+    def __len__(self):
+        return len(self.slots)
+
+    def compute(self):
+        """
+        Derive CPU % and memory % of every container written since the previous pass.
+        Returns the number of containers updated.
+        """
+        with self.lock:
+            c = self.columns
+            rows = np.flatnonzero(c["pending"])
+            if not len(rows):
+                return 0
+            system_delta = c["system"][rows] - c["presystem"][rows]
+            cpu_delta = c["cpu_total"][rows] - c["precpu_total"][rows]
+            ok = system_delta > 0
+            c["cpu_percent"][rows] = np.where(ok, cpu_delta / np.where(ok, system_delta, 1) * c["num_cpus"][rows] * 100.0,
+                                              0.0)
+            limit = c["mem_limit"][rows]
+            c["memory_percent"][rows] = c["mem_usage"][rows] / np.where(limit == 0, 1, limit) * 100.0
+            c["computed"][rows] = True
+            c["pending"][rows] = False
+            return len(rows)
+
+    def snapshot(self):
+        """
+        Compute pending rows, then copy out (names, {derived column: values}, io_valid) of
+        every container with at least one computed frame.
+        """
+        self.compute()
+        with self.lock:
+            c = self.columns
+            rows = np.flatnonzero(c["used"] & c["computed"])
+            names = [self.names[row] for row in rows]
+            values = {name: c[name][rows] for name in DERIVED}
+            io_valid = c["io_valid"][rows]
+        return names, values, io_valid
+
+    def register(self, registry):
+        registry.register(_ContainerStateCollector(self))
+
+
+class _ContainerStateCollector:
+    """
+    Publishes the table as the docker_container_* gauges, one snapshot per scrape.
+    """
+
+    def __init__(self, table):
+        self.table = table
+
+    def collect(self):
+        names, values, io_valid = self.table.snapshot()
+        for metric, documentation, column, needs_prev in METRICS:
+            family = GaugeMetricFamily(metric, documentation, labels=["container"])
+            column_values = values[column].tolist()
+            if needs_prev:
+                for name, value, valid in zip(names, column_values, io_valid.tolist()):
+                    if valid:
+                        family.add_metric([name], value)
+            else:
+                for name, value in zip(names, column_values):
+                    family.add_metric([name], value)
+            yield family
+
+    def describe(self):
+        # Registering must not trigger a scrape-time pass
+        return [GaugeMetricFamily(metric, documentation, labels=["container"])
+                for metric, documentation, _, _ in METRICS]
@@ -2,9 +2,12 @@ import psutil
 import logging
 import time
 from prometheus_client import CollectorRegistry, Gauge, generate_latest
+from SelfMetrics import pipeline_metrics
 
 class CustomAppMetricsMonitor:
-    def __init__(self, app_names):
+    def __init__(self, app_names, self_metrics=None, recorder=None, start_time=None):
+        self.self_metrics = self_metrics or pipeline_metrics
+        self.recorder = recorder  # Optional SampleRecorder that keeps the raw psutil readings
         self.registry = CollectorRegistry()
         self.cpu_usage = Gauge('cpu_usage', 'CPU usage percentage', ['app'], registry=self.registry)
         self.memory_usage = Gauge('memory_usage', 'Memory usage in MB', ['app'], registry=self.registry)
@@ -14,33 +17,55 @@ class CustomAppMetricsMonitor:
         self.energy_usage = Gauge('energy_used_joules', 'Estimated energy consumption in Joules', ['app'], registry=self.registry)
         
         self.app_names = app_names
-        self.last_time = time.time()  # Store the last timestamp for energy calculation
+        self.last_time = start_time or time.time()  # Store the last timestamp for energy calculation
+
+    def read_host(self):
+        """
+        One raw psutil reading of the host, shared by every app of a collection round.
+        """
+        disk_io = psutil.disk_io_counters()
+        net_io = psutil.net_io_counters()
+        return {
+            "cpu_percent": psutil.cpu_percent(interval=0),  # Non-blocking call
+            "memory_used": psutil.virtual_memory().used,
+            "disk_read_bytes": disk_io.read_bytes,
+            "disk_write_bytes": disk_io.write_bytes,
+            "net_bytes_sent": net_io.bytes_sent,
+            "net_bytes_recv": net_io.bytes_recv,
+        }
 
     def collect_app_metrics(self):
         """
         Collect metrics for each app, including estimated energy consumption.
         """
         current_time = time.time()
+        reading = self.read_host()
+        if self.recorder is not None:
+            self.recorder.record("psutil", None, reading, current_time)
+        self.record_host(reading, current_time)
+
+    def record_host(self, reading, current_time):
+        """
+        Update the gauges of every app from a psutil reading taken at `current_time`.
+        """
         elapsed_time = current_time - self.last_time  # Time interval in seconds
 
         for app in self.app_names:
             # CPU Usage
-            cpu_value = round(psutil.cpu_percent(interval=0), 2)  # Non-blocking call
+            cpu_value = round(reading["cpu_percent"], 2)
             cpu_power = round(cpu_value * 0.5, 2)  # 0.5W per 1% CPU usage
             
             # Memory Usage
-            mem_value = round(psutil.virtual_memory().used / (1024 * 1024), 2)  # Convert bytes to MB
+            mem_value = round(reading["memory_used"] / (1024 * 1024), 2)  # Convert bytes to MB
             mem_power = round((mem_value / 1024) * 0.3, 2)  # 0.3W per 1GB RAM usage
 
             # Disk Usage
-            disk_io = psutil.disk_io_counters()
-            disk_usage = round((disk_io.read_bytes + disk_io.write_bytes) / (1024 * 1024), 2)  # Convert to MB
+            disk_usage = round((reading["disk_read_bytes"] + reading["disk_write_bytes"]) / (1024 * 1024), 2)  # Convert to MB
             disk_power = round(disk_usage * 0.2, 2)  # 0.2W per MB read/write
 
             # Network Usage
-            net_io = psutil.net_io_counters()
-            net_sent = round(net_io.bytes_sent / (1024 * 1024), 2)  # Convert to MB
-            net_recv = round(net_io.bytes_recv / (1024 * 1024), 2)  # Convert to MB
+            net_sent = round(reading["net_bytes_sent"] / (1024 * 1024), 2)  # Convert to MB
+            net_recv = round(reading["net_bytes_recv"] / (1024 * 1024), 2)  # Convert to MB
             net_power = round((net_sent + net_recv) * 0.1, 2)  # 0.1W per MB sent/received
 
             # Calculate estimated energy in Joules
@@ -63,6 +88,8 @@ class CustomAppMetricsMonitor:
         """
         Collect and return application metrics in Prometheus format.
         """
-        self.collect_app_metrics()
-        prometheus_output = generate_latest(self.registry)
+        with self.self_metrics.time_stage("custom_app", "collect"):
+            self.collect_app_metrics()
+        with self.self_metrics.time_stage("custom_app", "render"):
+            prometheus_output = generate_latest(self.registry)
         return prometheus_output.decode('utf-8')
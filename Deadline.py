@@ -0,0 +1,290 @@
+"""
+Deadline-bounded backend calls with per-backend circuit breakers and stale fallback.
+
+A page (or any unit of work) runs inside `deadline_scope(seconds)`. Each backend call
+made through `backend_guard.call()` gets a timeout carved out of what is left of that
+budget: the remaining time split evenly over the calls still planned, capped by the
+backend's own maximum. A call that fails, times out or finds the budget already
+spent returns the last good result for the same key (if not older than `stale_after`)
+instead of stalling the page. Consecutive failures open the backend's circuit breaker;
+while open, calls fail fast, and after `reset_timeout` a single trial call decides
+whether it closes again.
+
+Calls to libraries without per-call timeouts (docker-py) can be run on a worker
+thread so the caller stops waiting at the deadline even if the call itself hangs. The
+abandoned call keeps running, so a write that raises CallTimeout may still take effect.
+"""
+import logging
+import os
+import socket
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from contextlib import contextmanager
+
+import requests
+from prometheus_client import Counter, Gauge
+
+from SelfMetrics import pipeline_metrics
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+_RAISE = object()
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class CallTimeout(DeadlineExceeded):
+    """
+    The caller stopped waiting for a call that had already started and may still complete.
+    """
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class Deadline:
+    """
+    `budget` seconds from creation. plan(n) announces n more calls, so each call's
+    slice leaves time for the ones after it.
+    """
+
+    def __init__(self, budget, scope="request"):
+        self.budget = budget
+        self.scope = scope
+        self.started = time.monotonic()
+        self.planned = 0
+        self.calls = 0
+        self.overrun = False
+
+    def remaining(self):
+        return self.budget - (time.monotonic() - self.started)
+
+    def plan(self, calls):
+        self.planned += calls
+
+    def slice(self, minimum=0.0):
+        """
+        Timeout for the next call, at least `minimum`. One `minimum` is held back for the
+        last planned call, so earlier calls are skipped (DeadlineExceeded) before it is.
+        """
+        calls_left = max(1, self.planned - self.calls)
+        self.calls += 1
+        remaining = self.remaining()
+        if calls_left > 1:
+            remaining -= minimum
+        if remaining < max(minimum, 1e-3):
+            self.overrun = True
+            raise DeadlineExceeded(f"{self.scope} deadline of {self.budget}s spent")
+        return max(remaining / calls_left, minimum)
+
+
+_local = threading.local()
+
+
+def current_deadline():
+    return getattr(_local, "deadline", None)
+
+
+@contextmanager
+def deadline_scope(budget, scope="request"):
+    """
+    Run the block under a Deadline of `budget` seconds (no deadline if budget is None).
+    Scopes nest: an inner scope never extends an outer one.
+    """
+    outer = current_deadline()
+    if budget is None:
+        yield outer
+        return
+    if outer is not None:
+        budget = min(budget, max(0.0, outer.remaining()))
+    deadline = _local.deadline = Deadline(budget, scope)
+    try:
+        yield deadline
+    finally:
+        _local.deadline = outer
+        if deadline.overrun or deadline.remaining() < 0:
+            backend_guard.overruns.labels(scope=scope).inc()
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures; after `reset_timeout` seconds
+    one call is let through (half-open) and closes the breaker again if it succeeds.
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0, on_change=None):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.on_change = on_change
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_running = False
+        self.lock = threading.Lock()
+
+    def _set(self, state):
+        if state != self.state:
+            self.state = state
+            logging.warning(f"Circuit breaker for {self.name} is now {state}")
+            if self.on_change is not None:
+                self.on_change(self.name, state)
+
+    def allow(self):
+        with self.lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self._set(HALF_OPEN)
+            if self.state == HALF_OPEN and not self.trial_running:
+                self.trial_running = True
+                return True
+            return False
+
+    def release(self):
+        """
+        Give back a half-open trial that was allowed but never made.
+        """
+        with self.lock:
+            self.trial_running = False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.trial_running = False
+            self._set(CLOSED)
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_running = False
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                self._set(OPEN)
+
+
+class BackendGuard:
+    """
+    Breakers, timeouts and stale results for each named backend. `max_timeout` caps a
+    single call ({backend: seconds}, `default_timeout` otherwise), also outside any deadline.
+    """
+
+    def __init__(self, registry=None, max_timeout=None, default_timeout=10.0, min_timeout=0.05,
+                 failure_threshold=5, reset_timeout=30.0, stale_after=300.0, max_stale_entries=10000,
+                 thread_workers=8):
+        registry = registry or pipeline_metrics.registry
+        self.max_timeout = dict(max_timeout or {})
+        self.default_timeout = default_timeout
+        self.min_timeout = min_timeout
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.stale_after = stale_after
+        self.max_stale_entries = max_stale_entries
+        self.breakers = {}
+        self.stale = {}  # backend -> OrderedDict key -> (timestamp, value)
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=thread_workers, thread_name_prefix="backend-call")
+
+        self.circuit_state = Gauge("monitor_circuit_state", "Circuit breaker state (0 closed, 1 half-open, 2 open)",
+                                   ["backend"], registry=registry)
+        self.transitions = Counter("monitor_circuit_transitions_total", "Circuit breaker state changes",
+                                   ["backend", "state"], registry=registry)
+        self.fallbacks = Counter("monitor_backend_fallbacks_total",
+                                 "Backend calls answered without the backend, by reason and result",
+                                 ["backend", "reason", "result"], registry=registry)
+        self.overruns = Counter("monitor_deadline_overruns_total", "Scopes that ran out of their latency budget",
+                                ["scope"], registry=registry)
+
+    def breaker(self, backend):
+        with self.lock:
+            breaker = self.breakers.get(backend)
+            if breaker is None:
+                breaker = self.breakers[backend] = CircuitBreaker(backend, self.failure_threshold, self.reset_timeout,
+                                                                  on_change=self._on_change)
+                self.circuit_state.labels(backend=backend).set(0)
+            return breaker
+
+    def _on_change(self, backend, state):
+        self.circuit_state.labels(backend=backend).set(STATE_VALUES[state])
+        self.transitions.labels(backend=backend, state=state).inc()
+
+    def _remember(self, backend, key, value):
+        with self.lock:
+            entries = self.stale.setdefault(backend, OrderedDict())
+            entries[key] = (time.monotonic(), value)
+            entries.move_to_end(key)
+            while len(entries) > self.max_stale_entries:
+                entries.popitem(last=False)
+
+    def _fallback(self, backend, key, reason, default, error):
+        if default is _RAISE:
+            raise error
+        with self.lock:
+            entry = self.stale.get(backend, {}).get(key)
+        if entry is not None and time.monotonic() - entry[0] <= self.stale_after:
+            self.fallbacks.labels(backend=backend, reason=reason, result="stale").inc()
+            return entry[1]
+        self.fallbacks.labels(backend=backend, reason=reason, result="default").inc()
+        return default
+
+    def timeout_for(self, backend):
+        cap = self.max_timeout.get(backend, self.default_timeout)
+        deadline = current_deadline()
+        if deadline is None:
+            return cap
+        return min(cap, deadline.slice(self.min_timeout))
+
+    def call(self, backend, key, function, default=None, in_thread=False, fallback=True):
+        """
+        function(timeout) under the backend's breaker and the current deadline. On failure
+        the last result for `key` is returned if fresh enough, else `default`; with
+        fallback=False (writes) the error is raised instead.
+        """
+        default = default if fallback else _RAISE
+        breaker = self.breaker(backend)
+        if not breaker.allow():
+            return self._fallback(backend, key, "circuit_open", default,
+                                  CircuitOpenError(f"Circuit breaker for {backend} is open"))
+        try:
+            timeout = self.timeout_for(backend)
+        except DeadlineExceeded as e:
+            breaker.release()
+            return self._fallback(backend, key, "deadline", default, e)
+        try:
+            if in_thread:
+                value = self.executor.submit(function, timeout).result(timeout)
+            else:
+                value = function(timeout)
+        except FutureTimeout:
+            breaker.record_failure()
+            return self._fallback(backend, key, "timeout", default,
+                                  CallTimeout(f"{backend} call {key} took longer than {timeout:.2f}s"))
+        except (requests.Timeout, socket.timeout) as e:
+            breaker.record_failure()
+            return self._fallback(backend, key, "timeout", default, e)
+        except Exception as e:
+            logging.warning(f"{backend} call {key} failed: {e}")
+            breaker.record_failure()
+            return self._fallback(backend, key, "error", default, e)
+        breaker.record_success()
+        if fallback:
+            self._remember(backend, key, value)
+        return value
+
+
+# Shared instance; its metrics are served with the other pipeline metrics on /internal/metrics
+backend_guard = BackendGuard(
+    max_timeout={"prometheus": float(os.getenv('PROMETHEUS_TIMEOUT', 5)),
+                 "alertmanager": float(os.getenv('ALERTMANAGER_TIMEOUT', 5)),
+                 "docker": float(os.getenv('DOCKER_TIMEOUT', 10))},
+    failure_threshold=int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', 5)),
+    reset_timeout=float(os.getenv('CIRCUIT_RESET_TIMEOUT', 30)),
+    stale_after=float(os.getenv('STALE_RESULT_MAX_AGE', 300)))
@@ -1,24 +1,77 @@
 import logging
-import time
 import threading
+import time
 import os
 from prometheus_client import Gauge, CollectorRegistry, generate_latest
 import docker
+from Deadline import CallTimeout, backend_guard
+from SelfMetrics import pipeline_metrics
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
+
+def connect_docker(docker_url, client_factory=None, timeout=None):
+    """
+    Create a Docker client, either through the injected factory or from the URL.
+    `timeout` (seconds) bounds each API request; leave it unset for clients that hold stats streams.
+    """
+    try:
+        if client_factory:
+            client = client_factory()
+        elif timeout is not None:
+            client = docker.DockerClient(base_url=docker_url, timeout=timeout)
+        else:
+            client = docker.DockerClient(base_url=docker_url)
+        logging.info("Connected to Docker daemon at %s", docker_url)
+        return client
+    except Exception as e:
+        logging.error("Failed to connect to Docker daemon: %s", e)
+        raise
+
+
+def update_docker_service(service, **changes):
+    """
+    service.update() under the docker circuit breaker, waiting at most the docker timeout.
+    docker-py can't cancel the request, so after a timeout the service is re-read: if its
+    version moved the update is taken as applied (another writer could also have moved it),
+    otherwise the CallTimeout says the update may still land, so callers don't retry blindly.
+    """
+    version = service.attrs.get('Version', {}).get('Index')
+
+    def update(timeout):
+        with pipeline_metrics.time_backend("docker", "services.update"):
+            return service.update(**changes)
+
+    try:
+        return backend_guard.call("docker", f"update {service.name}", update, in_thread=True, fallback=False)
+    except CallTimeout as e:
+        try:
+            backend_guard.call("docker", f"get {service.name}", lambda timeout: service.reload(), in_thread=True,
+                               fallback=False)
+        except Exception as check_error:
+            raise CallTimeout(f"{e}; the update may still be applied (re-reading {service.name} failed: "
+                              f"{check_error}), check the service before retrying") from e
+        new_version = service.attrs.get('Version', {}).get('Index')
+        if new_version != version:
+            logging.warning(f"Update of {service.name} timed out but its version moved from {version} to "
+                            f"{new_version}; treating it as applied")
+            return True
+        raise CallTimeout(f"{e}; {service.name} is still at version {version} but the update may still be applied, "
+                          f"check the service before retrying") from e
+
 class DockerMetricsMonitor:
-    def __init__(self, docker_url=os.getenv('DOCKER_URL', 'tcp://localhost:2375'), registry=None):
+    def __init__(self, docker_url=os.getenv('DOCKER_URL', 'tcp://localhost:2375'), registry=None, client_factory=None, self_metrics=None, recorder=None):
         logging.info("Initializing DockerMetricsMonitor...")
+        self.self_metrics = self_metrics or pipeline_metrics
+        self.recorder = recorder  # Optional SampleRecorder that keeps the raw stats frames
 
-        # Connect to Docker daemon
-        try:
-            self.client = docker.DockerClient(base_url=docker_url)
-            logging.info("Connected to Docker daemon at %s", docker_url)
-        except Exception as e:
-            logging.error("Failed to connect to Docker daemon: %s", e)
-            raise
+        # The Docker daemon is only contacted on first use of self.client
+        self.docker_url = docker_url
+        self.client_factory = client_factory
+        self._client = None
+        self._client_lock = threading.Lock()
+        self.stop_event = threading.Event()
 
         # Use the provided registry or create a new one
         self.registry = registry or CollectorRegistry()
@@ -37,78 +90,139 @@ class DockerMetricsMonitor:
 
         self.source = "docker"
 
+    @property
+    def client(self):
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    self._client = connect_docker(self.docker_url, self.client_factory)
+        return self._client
+
+    def stop(self):
+        """
+        Ask all monitoring threads to exit after their current sample.
+        """
+        self.stop_event.set()
+
     def monitor_service(self, service):
         service_name = service.name
         logging.info(f"Starting monitoring for service: {service_name}")
         
-        prev_net_io = {}
-        prev_blk_io = {}
+        # Network/disk counters of the previous round
+        prev = {"net_io": {}, "blk_io": []}
+        # Containers of the service with a last-sample timestamp in the self-metrics
+        sampled = set()
 
-        while True:
+        while not self.stop_event.is_set():
             try:
                 # Get the containers associated with the service
-                containers = self.client.containers.list(filters={"label": f"com.docker.swarm.service.name={service_name}"})
+                with self.self_metrics.time_backend("docker", "containers.list"):
+                    containers = self.client.containers.list(filters={"label": f"com.docker.swarm.service.name={service_name}"})
                 self.source = service_name
+                self._forget_gone(sampled, {container.name for container in containers})
 
-                # Initialize metrics to aggregate service-level stats
-                total_cpu_percent = 0
-                total_mem_percent = 0
-                total_network_sent = 0
-                total_network_recv = 0
-                total_disk_read = 0
-                total_disk_write = 0
-                total_cpu_energy = 0
-                total_memory_energy = 0
-                num_containers = len(containers)
-
-                if num_containers == 0:
+                if not containers:
                     logging.warning(f"No containers found for service {service_name}. Skipping.")
-                    time.sleep(5)
+                    self.self_metrics.drop("docker_service", "no_containers")
+                    self.stop_event.wait(5)
                     continue
 
-                # Aggregate metrics across containers
+                frames = {}
                 for container in containers:
                     # Get container stats
-                    container_stats = container.stats(stream=False)
-                    total_cpu_percent += self._collect_cpu_metrics(container_stats)
-                    total_mem_percent += self._collect_memory_metrics(container_stats)
-                    network_sent, network_recv = self._collect_network_metrics(container_stats, prev_net_io)  # Unpack the tuple
-                    total_network_sent += network_sent
-                    total_network_recv += network_recv
-                    disk_read, disk_write = self._collect_disk_metrics(container_stats, prev_blk_io)  # Unpack the tuple
-                    total_disk_read += disk_read
-                    total_disk_write += disk_write
-                    total_cpu_energy += self._estimate_energy_consumption(container_stats, "cpu")
-                    total_memory_energy += self._estimate_energy_consumption(container_stats, "memory")
-
-                # Average the metrics across containers for service-level stats
-                self.cpu_usage.labels(service=service_name).set(total_cpu_percent / num_containers)
-                self.memory_usage.labels(service=service_name).set(total_mem_percent / num_containers)
-                self.network_sent.labels(service=service_name).set(total_network_sent)
-                self.network_recv.labels(service=service_name).set(total_network_recv)
-                self.disk_read.labels(service=service_name).set(total_disk_read)
-                self.disk_write.labels(service=service_name).set(total_disk_write)
-                self.cpu_energy_consumption.labels(service=service_name).set(total_cpu_energy / num_containers)
-                self.memory_energy_consumption.labels(service=service_name).set(total_memory_energy / num_containers)
-
-                logging.info(f"{service_name} - CPU Usage: {total_cpu_percent / num_containers:.2f}%, "
-                             f"Memory Usage: {total_mem_percent / num_containers:.2f}%, "
-                             f"Network Sent: {total_network_sent} bytes, "
-                             f"Network Recv: {total_network_recv} bytes, "
-                             f"Disk Read: {total_disk_read} bytes, "
-                             f"Disk Write: {total_disk_write} bytes")
-
-                # Update previous stats
-                prev_net_io = container_stats.get("networks", {})
-                prev_blk_io = container_stats.get("blkio_stats", {}).get("io_service_bytes_recursive", [])
+                    with self.self_metrics.time_backend("docker", "stats"):
+                        frames[container.name] = container.stats(stream=False)
+                    self.self_metrics.mark_sample("docker_service", container.name)
+                    sampled.add(container.name)
+                if self.recorder is not None:
+                    self.recorder.record("docker_service", service_name, frames)
+                self.record_service(service_name, frames, prev)
 
             except Exception as e:
                 logging.error(f"Error monitoring service {service_name}: {e}")
+                self.self_metrics.drop("docker_service", "error")
 
-            time.sleep(5)  # Adjust the sample rate
+            self.stop_event.wait(5)  # Adjust the sample rate
 
-    def monitor_all_services(self):
-        services = self.client.services.list()
+        self._forget_gone(sampled, set())
+
+    def _forget_gone(self, sampled, current):
+        """
+        Drop the sample timestamps of containers no longer listed for the service, so
+        replaced task containers don't show up as stale forever.
+        """
+        for name in sampled - current:
+            self.self_metrics.forget("docker_service", name)
+        sampled &= current
+
+    def record_service(self, service_name, frames, prev):
+        """
+        Aggregate one round of container stats frames ({container name: stats}) of a service into its
+        gauges and return the totals. `prev` carries the previous round's counters between calls.
+        """
+        # Initialize metrics to aggregate service-level stats
+        total_cpu_percent = 0
+        total_mem_percent = 0
+        total_network_sent = 0
+        total_network_recv = 0
+        total_disk_read = 0
+        total_disk_write = 0
+        total_cpu_energy = 0
+        total_memory_energy = 0
+        num_containers = len(frames)
+
+        # Aggregate metrics across containers
+        for container_stats in frames.values():
+            total_cpu_percent += self._collect_cpu_metrics(container_stats)
+            total_mem_percent += self._collect_memory_metrics(container_stats)
+            network_sent, network_recv = self._collect_network_metrics(container_stats, prev["net_io"])  # Unpack the tuple
+            total_network_sent += network_sent
+            total_network_recv += network_recv
+            disk_read, disk_write = self._collect_disk_metrics(container_stats, prev["blk_io"])  # Unpack the tuple
+            total_disk_read += disk_read
+            total_disk_write += disk_write
+            total_cpu_energy += self._estimate_energy_consumption(container_stats, "cpu")
+            total_memory_energy += self._estimate_energy_consumption(container_stats, "memory")
+
+        # Average the metrics across containers for service-level stats
+        publish_started = time.perf_counter()
+        self.cpu_usage.labels(service=service_name).set(total_cpu_percent / num_containers)
+        self.memory_usage.labels(service=service_name).set(total_mem_percent / num_containers)
+        self.network_sent.labels(service=service_name).set(total_network_sent)
+        self.network_recv.labels(service=service_name).set(total_network_recv)
+        self.disk_read.labels(service=service_name).set(total_disk_read)
+        self.disk_write.labels(service=service_name).set(total_disk_write)
+        self.cpu_energy_consumption.labels(service=service_name).set(total_cpu_energy / num_containers)
+        self.memory_energy_consumption.labels(service=service_name).set(total_memory_energy / num_containers)
+        self.self_metrics.observe_stage("docker_service", "publish", time.perf_counter() - publish_started)
+
+        logging.info(f"{service_name} - CPU Usage: {total_cpu_percent / num_containers:.2f}%, "
+                     f"Memory Usage: {total_mem_percent / num_containers:.2f}%, "
+                     f"Network Sent: {total_network_sent} bytes, "
+                     f"Network Recv: {total_network_recv} bytes, "
+                     f"Disk Read: {total_disk_read} bytes, "
+                     f"Disk Write: {total_disk_write} bytes")
+
+        # Update previous stats
+        prev["net_io"] = container_stats.get("networks", {})
+        prev["blk_io"] = container_stats.get("blkio_stats", {}).get("io_service_bytes_recursive", [])
+        return {"cpu_percent": total_cpu_percent / num_containers, "memory_percent": total_mem_percent / num_containers,
+                "cpu_energy": total_cpu_energy / num_containers, "memory_energy": total_memory_energy / num_containers}
+
+    def monitor_all_services(self, retry_interval=5, max_retry_interval=60):
+        self.stop_event.clear()
+        # Keep retrying while the daemon is unreachable instead of letting the thread die
+        while True:
+            try:
+                with self.self_metrics.time_backend("docker", "services.list"):
+                    services = self.client.services.list()
+                break
+            except Exception as e:
+                logging.error(f"Error listing Docker services, retrying in {retry_interval}s: {e}")
+                self.self_metrics.drop("docker_service", "error")
+                if self.stop_event.wait(retry_interval):
+                    return
+                retry_interval = min(retry_interval * 2, max_retry_interval)
         logging.info(f"Started monitoring {len(services)} services")
 
         if not services:
@@ -187,5 +301,6 @@ class DockerMetricsMonitor:
         """
         Collect and return Docker service metrics in Prometheus format.
         """
-        prometheus_output = generate_latest(self.registry)
+        with self.self_metrics.time_stage("docker_service", "render"):
+            prometheus_output = generate_latest(self.registry)
         return prometheus_output.decode('utf-8')
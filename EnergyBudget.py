@@ -0,0 +1,347 @@
+"""
+Closed-loop energy budgets per Docker service, enforced through CPU quotas.
+
+Each interval the controller compares the power attributed to a service with its
+budget and moves the service's per-task CPU limit (NanoCPUs) with a PI controller:
+relative error (budget - watts) / budget in, quota as a fraction of `max_cpu` out.
+The integral term uses back-calculation anti-windup, so time spent clamped at
+`min_cpu`/`max_cpu` does not build up a correction that later overshoots. A
+service is updated at most once per `min_update_interval` and only for quota
+changes of at least `min_step` (relative), because every update is a Swarm
+rolling restart of its tasks.
+
+Budgets are watts or joules per hour, e.g. ENERGY_BUDGETS="my_thesis_web=40W,my_thesis_worker=90kJ/h".
+The controller can be run against a simulated plant to tune it offline:
+
+    python EnergyBudget.py --duration 21600 --budget 40 --services 5
+"""
+import argparse
+import json
+import logging
+import math
+import random
+import re
+import threading
+import time
+
+from prometheus_client import CollectorRegistry, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+from SelfMetrics import pipeline_metrics
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+BUDGET_PATTERN = re.compile(r"^\s*([\d.]+)\s*(W|J/h|kJ/h)\s*$", re.IGNORECASE)
+
+
+def parse_budget(value):
+    """
+    "40W", "36000J/h" or "90kJ/h" -> watts.
+    """
+    match = BUDGET_PATTERN.match(value)
+    if match is None:
+        raise ValueError(f"Invalid energy budget: {value}")
+    amount, unit = float(match.group(1)), match.group(2).lower()
+    if unit == "w":
+        return amount
+    return amount * (1000 if unit == "kj/h" else 1) / 3600.0
+
+
+def parse_budgets(spec):
+    """
+    "service=40W,other=90kJ/h" -> {"service": 40.0, "other": 25.0}
+    """
+    budgets = {}
+    for entry in spec.split(","):
+        if entry.strip():
+            service, _, budget = entry.partition("=")
+            budgets[service.strip()] = parse_budget(budget)
+    return budgets
+
+
+class _ServiceState:
+    __slots__ = ("integral", "last_time", "last_update", "intervals", "within", "throttled", "updates",
+                 "energy", "budget_energy", "watts", "quota")
+
+    def __init__(self):
+        self.integral = None  # Output of the integral term, as a fraction of max_cpu
+        self.last_time = None
+        self.last_update = None
+        self.intervals = 0
+        self.within = 0
+        self.throttled = 0
+        self.updates = 0
+        self.energy = 0.0
+        self.budget_energy = 0.0
+        self.watts = 0.0
+        self.quota = None
+
+
+class _EnergyBudgetCollector:
+    def __init__(self, controller):
+        self.controller = controller
+
+    def collect(self):
+        return self.controller.metric_families()
+
+
+class EnergyBudgetController:
+    """
+    `kp` is the quota change (fraction of `max_cpu`) per unit of relative error and
+    `integral_time` the seconds the integral term takes to add as much again;
+    `tracking_time` sets how fast the integral unwinds while the quota is clamped.
+    An interval counts as within budget up to `tolerance` over it, and as throttled
+    when the tasks use at least `throttle_ratio` of their quota.
+    """
+
+    def __init__(self, budgets, min_cpu=0.1, max_cpu=2.0, kp=0.3, integral_time=120.0, tracking_time=60.0,
+                 min_update_interval=120.0, min_step=0.1, tolerance=0.05, throttle_ratio=0.95):
+        self.budgets = dict(budgets)
+        self.min_cpu = min_cpu
+        self.max_cpu = max_cpu
+        self.kp = kp
+        self.integral_time = integral_time
+        self.tracking_time = tracking_time
+        self.min_update_interval = min_update_interval
+        self.min_step = min_step
+        self.tolerance = tolerance
+        self.throttle_ratio = throttle_ratio
+        self.states = {service: _ServiceState() for service in self.budgets}
+        self.lock = threading.Lock()
+
+        self.registry = CollectorRegistry()
+        self.registry.register(_EnergyBudgetCollector(self))
+
+    def step(self, service, watts, quota, now, usage=None):
+        """
+        Feed one measurement: `watts` attributed to `service` over the last interval while
+        its tasks had `quota` cores each (None if unlimited) and used `usage` cores each.
+        Returns the new per-task quota to apply, or None to leave the service alone.
+        """
+        budget = self.budgets[service]
+        limited = quota is not None
+        quota = self.max_cpu if quota is None else quota
+        with self.lock:
+            state = self.states[service]
+            dt = 0.0 if state.last_time is None else now - state.last_time
+            state.last_time = now
+            if state.integral is None:
+                state.integral = quota / self.max_cpu  # Bumpless start from the quota in place
+
+            error = (budget - watts) / budget
+            desired = self.kp * error + state.integral
+            target = min(max(desired * self.max_cpu, self.min_cpu), self.max_cpu)
+
+            due = state.last_update is None or now - state.last_update >= self.min_update_interval
+            change = None
+            if due and abs(target - quota) >= self.min_step * max(quota, self.min_cpu):
+                change = round(target, 3)
+                state.last_update = now
+                state.updates += 1
+            applied = change if change is not None else quota
+
+            # Back-calculation: while the output is clamped, pull the integral back toward the
+            # limit. Deadband and rate-limit holds are not tracked; the held change is still wanted.
+            state.integral += dt * (self.kp * error / self.integral_time +
+                                    (target / self.max_cpu - desired) / self.tracking_time)
+
+            state.intervals += 1
+            state.within += watts <= budget * (1 + self.tolerance)
+            if limited and usage is not None and usage >= self.throttle_ratio * quota:
+                state.throttled += 1
+            state.energy += watts * dt
+            state.budget_energy += budget * dt
+            state.watts = watts
+            state.quota = applied
+        return change
+
+    def report(self):
+        """
+        Per service: budget adherence (fraction of intervals within budget), energy used
+        against the budget, the fraction of intervals spent throttled and update count.
+        """
+        with self.lock:
+            return {service: {
+                "budget_watts": round(self.budgets[service], 3),
+                "watts": round(state.watts, 3),
+                "quota_cores": state.quota,
+                "adherence": round(state.within / state.intervals, 4) if state.intervals else None,
+                "energy_joules": round(state.energy, 1),
+                "budget_joules": round(state.budget_energy, 1),
+                "throttled_fraction": round(state.throttled / state.intervals, 4) if state.intervals else None,
+                "updates": state.updates,
+            } for service, state in self.states.items()}
+
+    def metric_families(self):
+        families = {
+            "budget": GaugeMetricFamily("energy_budget_watts", "Power budget per service", labels=["service"]),
+            "watts": GaugeMetricFamily("energy_budget_measured_watts", "Power attributed to the service in the last interval",
+                                       labels=["service"]),
+            "quota": GaugeMetricFamily("energy_budget_cpu_quota_cores", "Per-task CPU limit set by the controller",
+                                       labels=["service"]),
+            "adherence": GaugeMetricFamily("energy_budget_adherence_ratio", "Fraction of intervals within budget",
+                                           labels=["service"]),
+            "throttled": GaugeMetricFamily("energy_budget_throttled_ratio",
+                                           "Fraction of intervals with the tasks using their whole quota",
+                                           labels=["service"]),
+            "updates": CounterMetricFamily("energy_budget_updates", "CPU quota updates applied by the controller",
+                                           labels=["service"]),
+        }
+        for service, entry in self.report().items():
+            families["budget"].add_metric([service], entry["budget_watts"])
+            families["watts"].add_metric([service], entry["watts"])
+            if entry["quota_cores"] is not None:
+                families["quota"].add_metric([service], entry["quota_cores"])
+            if entry["adherence"] is not None:
+                families["adherence"].add_metric([service], entry["adherence"])
+                families["throttled"].add_metric([service], entry["throttled_fraction"])
+            families["updates"].add_metric([service], entry["updates"])
+        return list(families.values())
+
+    def get_metrics(self):
+        return generate_latest(self.registry).decode("utf-8")
+
+
+def service_quota(service):
+    """
+    Per-task CPU limit of a Swarm service in cores, None if it has none.
+    """
+    limits = service.attrs['Spec'].get('TaskTemplate', {}).get('Resources', {}).get('Limits', {})
+    return limits['NanoCPUs'] / 1e9 if limits.get('NanoCPUs') else None
+
+
+def run_controller(controller, client, updater, registry, watts_per_core=10.0, interval=15.0, stop_event=None):
+    """
+    Enforce the budgets live. Power is attributed from DockerMetrics' per-service CPU gauge
+    (average percent of a core per task) times replicas times `watts_per_core`; quota
+    changes go through `updater` (a BulkUpdate.BulkUpdater), which rate limits the daemon.
+    """
+    stop_event = stop_event or threading.Event()
+    logging.info(f"Energy budget controller started for {', '.join(controller.budgets)}")
+    while not stop_event.wait(interval):
+        try:
+            with pipeline_metrics.time_stage("energy_budget", "step"):
+                items = []
+                now = time.time()
+                for service in client.services.list():
+                    if service.name not in controller.budgets:
+                        continue
+                    cpu_percent = registry.get_sample_value("docker_service_cpu_usage_percent",
+                                                            {"service": service.name})
+                    if cpu_percent is None:
+                        continue  # Not sampled yet
+                    replicas = service.attrs['Spec']['Mode'].get('Replicated', {}).get('Replicas', 1)
+                    usage = cpu_percent / 100.0
+                    quota = controller.step(service.name, usage * replicas * watts_per_core, service_quota(service),
+                                            now, usage=usage)
+                    if quota is not None:
+                        items.append({"service": service.name, "cpu_limit": quota})
+            if items:
+                report = updater.run(items, stack_name="")
+                for result in report["results"]:
+                    logging.info(f"Energy budget: {result['service']} CPU limit -> {result['status']}: "
+                                 f"{result.get('message', '')}")
+        except Exception as e:
+            logging.error(f"Error enforcing energy budgets: {e}")
+
+
+class SimulatedService:
+    """
+    Plant model of one service: `replicas` tasks each demanding `demand(t)` cores and
+    drawing `idle_watts` plus `watts_per_core` per core actually served (demand capped
+    by the quota), with multiplicative measurement noise. A new quota takes effect
+    `apply_delay` seconds after it is set, like a rolling update.
+    """
+
+    def __init__(self, demand, replicas=2, watts_per_core=10.0, idle_watts=2.0, quota=None, apply_delay=30.0,
+                 noise=0.03, seed=0):
+        self.demand = demand
+        self.replicas = replicas
+        self.watts_per_core = watts_per_core
+        self.idle_watts = idle_watts
+        self.quota = quota
+        self.apply_delay = apply_delay
+        self.noise = noise
+        self.pending = None
+        self.rng = random.Random(seed)
+        self.demanded = 0.0  # Core-seconds asked for and served, for the throughput cost
+        self.served = 0.0
+
+    def set_quota(self, quota, now):
+        self.pending = (now + self.apply_delay, quota)
+
+    def advance(self, now, dt):
+        """
+        Run `dt` seconds up to `now`; returns (measured watts, cores used per task).
+        """
+        if self.pending is not None and now >= self.pending[0]:
+            self.quota, self.pending = self.pending[1], None
+        demand = self.demand(now)
+        used = demand if self.quota is None else min(demand, self.quota)
+        self.demanded += demand * self.replicas * dt
+        self.served += used * self.replicas * dt
+        watts = self.replicas * (self.idle_watts + self.watts_per_core * used)
+        return watts * (1 + self.rng.gauss(0, self.noise)), used
+
+
+def simulate(controller, plants, duration, interval=15.0):
+    """
+    Drive `controller` against {service: SimulatedService} for `duration` seconds. Returns
+    the controller's report with the throughput cost (fraction of demanded CPU work not
+    served) added per service.
+    """
+    for now in range(int(interval), int(duration) + 1, int(interval)):
+        for service, plant in plants.items():
+            watts, used = plant.advance(now, interval)
+            quota = controller.step(service, watts, plant.quota, now, usage=used)
+            if quota is not None:
+                plant.set_quota(quota, now)
+    report = controller.report()
+    for service, plant in plants.items():
+        report[service]["throughput_cost"] = round(1 - plant.served / plant.demanded, 4) if plant.demanded else 0.0
+    return report
+
+
+def daily_demand(base, amplitude, period=86400.0, phase=0.0, spikes=(), seed=0):
+    """
+    Per-task demand in cores: a sine around `base` plus (start, end, extra cores) spikes.
+    """
+    rng = random.Random(seed)
+    jitter = [rng.uniform(-0.05, 0.05) for _ in range(97)]
+
+    def demand(now):
+        level = base + amplitude * math.sin(2 * math.pi * (now / period + phase))
+        level += sum(extra for start, end, extra in spikes if start <= now < end)
+        return max(0.0, level + jitter[int(now) % len(jitter)])
+    return demand
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the energy budget controller against simulated services")
+    parser.add_argument("--services", type=int, default=5)
+    parser.add_argument("--duration", type=float, default=6 * 3600)
+    parser.add_argument("--interval", type=float, default=15.0)
+    parser.add_argument("--budget", type=float, default=30.0, help="Budget per service in watts")
+    parser.add_argument("--kp", type=float, default=0.3)
+    parser.add_argument("--integral-time", type=float, default=120.0)
+    parser.add_argument("--min-update-interval", type=float, default=120.0)
+    parser.add_argument("--apply-delay", type=float, default=30.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    plants = {}
+    for i in range(args.services):
+        spike_start = rng.uniform(0, args.duration)
+        demand = daily_demand(base=rng.uniform(0.8, 1.6), amplitude=rng.uniform(0.2, 0.6), period=args.duration,
+                              phase=rng.random(), spikes=[(spike_start, spike_start + 600, 1.0)], seed=args.seed + i)
+        plants[f"service-{i}"] = SimulatedService(demand, apply_delay=args.apply_delay, seed=args.seed + i)
+    controller = EnergyBudgetController({service: args.budget for service in plants}, kp=args.kp,
+                                        integral_time=args.integral_time,
+                                        min_update_interval=args.min_update_interval)
+    print(json.dumps(simulate(controller, plants, args.duration, args.interval), indent=2))
+
+
+if __name__ == "__main__":
+    main()
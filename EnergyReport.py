@@ -0,0 +1,354 @@
+"""
+Offline per-service energy, utilization, over-provisioning and cost report.
+
+Reads exported series (Prometheus query_range JSON exports or CSV with
+timestamp,metric,value,series columns, optionally gzipped), parses the files and then
+computes each service's aggregates on a process pool, services partitioned across the
+workers. All per-service arithmetic is vectorized over the service's NumPy arrays.
+
+Power comes from an exported energy_budget_measured_watts series where there is one,
+otherwise from CPU usage times replicas (--watts-per-core, as EnergyBudget's controller
+estimates it). docker_service_cpu_usage_percent is the average per task, so the replica
+count comes from the replicas column of --limits, else --replicas.
+docker_service_memory_usage_mb carries a percentage of the memory limit despite its name,
+so it is reported as memory percent and not used for power. Cost uses the
+hourly spot prices of the same provider api1.get_data reads (a saved price file or
+--fetch-prices), or a flat --price.
+
+    python EnergyReport.py exports/*.json.gz --prices prices.json --html report.html --csv report.csv
+    python EnergyReport.py cpu.csv memory.csv --price 0.12 --cpu-limit 1 --replicas 2 --limits limits.csv
+"""
+import argparse
+import csv
+import gzip
+import html
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import requests
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+# Exported metric -> series kind
+SERIES = {
+    "docker_service_cpu_usage_percent": "cpu",
+    "docker_service_memory_usage_mb": "memory",
+    "energy_budget_measured_watts": "power",
+    "energy_budget_cpu_quota_cores": "quota",
+}
+PERCENTILES = (50, 95, 99)
+SPOT_PRICE_URL = os.getenv('SPOT_PRICE_URL', 'https://api.spot-hinta.fi/TodayAndDayForward')
+
+FIELDS = (["service", "samples", "start", "end", "hours", "cpu_mean"] + [f"cpu_p{p}" for p in PERCENTILES] +
+          ["memory_mean"] + [f"memory_p{p}" for p in PERCENTILES] +
+          ["mean_watts", "energy_kwh", "power_source", "replicas", "allocated_cores", "overprovisioning_ratio",
+           "cost"])
+
+
+def _open(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", newline="", encoding="utf-8")
+    return open(path, newline="", encoding="utf-8")
+
+
+def _timestamp(text):
+    """
+    Epoch seconds, or an ISO 8601 date as the spot price feed uses.
+    """
+    try:
+        return float(text)
+    except ValueError:
+        return datetime.fromisoformat(text).timestamp()
+
+
+def parse_series_file(path):
+    """
+    {(kind, service): (timestamps, values)} of the known metrics in one export file.
+    """
+    with _open(path) as f:
+        head = f.read(1)
+        f.seek(0)
+        if head == "{":
+            series = _parse_prometheus_json(json.load(f))
+        else:
+            series = _parse_csv(f)
+    logging.info(f"Read {sum(len(t) for t, _ in series.values())} points of {len(series)} series from {path}")
+    return series
+
+
+def _parse_prometheus_json(document):
+    series = {}
+    for result in document.get("data", {}).get("result", []):
+        metric = result.get("metric", {})
+        kind = SERIES.get(metric.get("__name__"))
+        service = metric.get("service")
+        values = result.get("values", [])
+        if kind is None or service is None or not values:
+            continue
+        timestamps = np.fromiter((point[0] for point in values), dtype=np.float64, count=len(values))
+        series[(kind, service)] = (timestamps, np.array([point[1] for point in values], dtype=np.float64))
+    return series
+
+
+def _parse_csv(f):
+    points = {}
+    for row in csv.DictReader(f):
+        kind = SERIES.get(row.get("metric"))
+        if kind is None or not row.get("series"):
+            continue
+        timestamps, values = points.setdefault((kind, row["series"]), ([], []))
+        timestamps.append(_timestamp(row["timestamp"]))
+        values.append(float(row["value"]))
+    return {key: (np.array(timestamps), np.array(values)) for key, (timestamps, values) in points.items()}
+
+
+def load_prices(path=None, url=None, field="PriceWithTax"):
+    """
+    (hour start timestamps, price per kWh), sorted. Accepts the spot price feed's JSON
+    ([{"DateTime": ..., "PriceWithTax": ...}]) or a CSV with timestamp,price columns.
+    """
+    if url:
+        response = requests.get(url, timeout=30)
+        response.raise_for_status()
+        rows = [(entry["DateTime"], entry[field]) for entry in response.json()]
+    else:
+        with _open(path) as f:
+            head = f.read(1)
+            f.seek(0)
+            if head == "[":
+                rows = [(entry["DateTime"], entry[field]) for entry in json.load(f)]
+            else:
+                rows = [(row["timestamp"], row["price"]) for row in csv.DictReader(f)]
+    timestamps = np.array([_timestamp(str(t)) for t, _ in rows])
+    prices = np.array([float(p) for _, p in rows])
+    order = np.argsort(timestamps)
+    return timestamps[order], prices[order]
+
+
+def _sorted_unique(timestamps, values):
+    order = np.argsort(timestamps, kind="stable")
+    timestamps, values = timestamps[order], values[order]
+    keep = np.ones(len(timestamps), dtype=bool)
+    keep[1:] = np.diff(timestamps) > 0
+    return timestamps[keep], values[keep]
+
+
+def _on_grid(timestamps, series):
+    """
+    `series` (timestamps, values) sampled at `timestamps`, holding the last value before each.
+    """
+    source_t, source_v = series
+    index = np.searchsorted(source_t, timestamps, side="right") - 1
+    return source_v[np.clip(index, 0, len(source_v) - 1)]
+
+
+def service_report(service, series, options, prices=None):
+    """
+    Aggregates of one service from its {kind: (timestamps, values)} series.
+    """
+    series = {kind: _sorted_unique(*points) for kind, points in series.items()}
+    cpu = series.get("cpu")
+    memory = series.get("memory")
+    grid = series.get("power") or cpu or memory
+    timestamps = grid[0]
+
+    # Each sample holds until the next one; gaps longer than max_gap steps count as missing data
+    dt = np.diff(timestamps)
+    if len(dt):
+        dt = np.minimum(dt, np.median(dt) * options["max_gap"])
+    dt = np.append(dt, 0.0)
+
+    # CPU percent is per task; measured watts already cover the whole service
+    replicas = options["replicas"].get(service, options["default_replicas"])
+    if "power" in series:
+        watts, source = series["power"][1], "measured"
+    elif cpu:
+        watts, source = _on_grid(timestamps, cpu) / 100.0 * replicas * options["watts_per_core"], "model"
+    else:
+        watts, source = np.zeros(len(timestamps)), "none"
+    kwh = watts * dt / 3.6e6
+    seconds = dt.sum()
+
+    report = {"service": service, "samples": len(timestamps), "start": float(timestamps[0]),
+              "end": float(timestamps[-1]), "hours": seconds / 3600.0, "power_source": source, "replicas": replicas,
+              "energy_kwh": float(kwh.sum()), "mean_watts": float((watts * dt).sum() / seconds) if seconds else None}
+    for name, values in (("cpu", cpu and cpu[1]), ("memory", memory and memory[1])):
+        if values is None:
+            report.update({f"{name}_mean": None, **{f"{name}_p{p}": None for p in PERCENTILES}})
+            continue
+        report[f"{name}_mean"] = float(values.mean())
+        report.update({f"{name}_p{p}": float(v) for p, v in zip(PERCENTILES, np.percentile(values, PERCENTILES))})
+
+    # Allocated cores of all replicas: the exported per-task CPU quota over the period, else the configured limit
+    allocated = options["limits"].get(service, options["cpu_limit"])
+    if "quota" in series:
+        allocated = float(series["quota"][1].mean())
+    allocated = allocated * replicas if allocated is not None else None
+    report["allocated_cores"] = allocated
+    used = (report["cpu_p95"] or 0.0) / 100.0 * replicas
+    report["overprovisioning_ratio"] = allocated / used if allocated and used > 0 else None
+
+    if prices is not None:
+        price = _on_grid(timestamps, prices)
+        report["cost"] = float((kwh * price).sum())
+    elif options["price"] is not None:
+        report["cost"] = report["energy_kwh"] * options["price"]
+    else:
+        report["cost"] = None
+    return report
+
+
+def _report_chunk(chunk, options, prices):
+    return [service_report(service, series, options, prices) for service, series in chunk]
+
+
+def build_report(paths, options, prices=None, workers=None):
+    """
+    Parse `paths` and compute every service's aggregates, both on a pool of `workers` processes.
+    """
+    started = time.perf_counter()
+    by_service = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for series in pool.map(parse_series_file, paths):
+            for (kind, service), (timestamps, values) in series.items():
+                kinds = by_service.setdefault(service, {})
+                if kind in kinds:
+                    timestamps = np.concatenate([kinds[kind][0], timestamps])
+                    values = np.concatenate([kinds[kind][1], values])
+                kinds[kind] = (timestamps, values)
+
+        services = [(service, series) for service, series in sorted(by_service.items())
+                    if "cpu" in series or "memory" in series or "power" in series]
+        # A few chunks per worker keeps the pool busy without pickling one task per service
+        chunk_count = max(1, min(len(services), (workers or os.cpu_count() or 1) * 4))
+        chunks = [services[i::chunk_count] for i in range(chunk_count)]
+        rows = []
+        for chunk_rows in pool.map(_report_chunk, chunks, [options] * len(chunks), [prices] * len(chunks)):
+            rows.extend(chunk_rows)
+
+    rows.sort(key=lambda row: row["energy_kwh"], reverse=True)
+    costs = [row["cost"] for row in rows if row["cost"] is not None]
+    totals = {
+        "services": len(rows),
+        "energy_kwh": sum(row["energy_kwh"] for row in rows),
+        "cost": sum(costs) if costs else None,
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+    logging.info(f"Reported {len(rows)} services in {totals['seconds']}s")
+    return {"services": rows, "totals": totals}
+
+
+def _format(value, digits=3):
+    if value is None:
+        return ""
+    if isinstance(value, float):
+        return f"{value:.{digits}f}"
+    return str(value)
+
+
+def write_csv(report, path):
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDS)
+        writer.writeheader()
+        for row in report["services"]:
+            writer.writerow({field: _format(row[field], 6) for field in FIELDS})
+
+
+def write_html(report, path, title="Energy and utilization report"):
+    def day(timestamp):
+        return datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M")
+
+    rows = report["services"]
+    totals = report["totals"]
+    period = f"{day(min(r['start'] for r in rows))} – {day(max(r['end'] for r in rows))}" if rows else "no data"
+    header = "".join(f"<th>{html.escape(field)}</th>" for field in FIELDS if field not in ("start", "end"))
+    body = []
+    for row in rows:
+        cells = "".join(f"<td>{html.escape(_format(row[field]))}</td>" for field in FIELDS
+                        if field not in ("start", "end"))
+        body.append(f"<tr>{cells}</tr>")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>{html.escape(title)}</title>
+<style>
+body {{ font-family: sans-serif; margin: 2em; }}
+table {{ border-collapse: collapse; font-size: 0.85em; }}
+th, td {{ border: 1px solid #ccc; padding: 4px 8px; text-align: right; }}
+th {{ background: #f0f0f0; }} td:first-child {{ text-align: left; }}
+</style></head><body>
+<h1>{html.escape(title)}</h1>
+<p>{html.escape(period)} &middot; {totals['services']} services &middot;
+{_format(totals['energy_kwh'])} kWh &middot; cost {html.escape(_format(totals['cost'], 2)) or 'n/a'}</p>
+<table><thead><tr>{header}</tr></thead><tbody>
+{chr(10).join(body)}
+</tbody></table></body></html>
+""")
+
+
+def parse_limits(path):
+    """
+    ({service: cores per replica}, {service: replicas}) from a CSV with service, cpu_limit
+    and replicas columns; either of the last two may be left empty or omitted.
+    """
+    limits, replicas = {}, {}
+    with _open(path) as f:
+        for row in csv.DictReader(f):
+            if row.get("cpu_limit"):
+                limits[row["service"]] = float(row["cpu_limit"])
+            if row.get("replicas"):
+                replicas[row["service"]] = int(row["replicas"])
+    return limits, replicas
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("series", nargs="+", help="Series exports (Prometheus query_range JSON or CSV, .gz ok)")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: one per CPU)")
+    parser.add_argument("--watts-per-core", type=float, default=float(os.getenv('ENERGY_WATTS_PER_CORE', 10)),
+                        help="Power model when no measured watts are exported")
+    parser.add_argument("--cpu-limit", type=float, default=None,
+                        help="Cores allocated per replica when no quota series or --limits entry exists")
+    parser.add_argument("--replicas", type=int, default=1, help="Replicas per service without a --limits entry")
+    parser.add_argument("--limits", help="CSV with service,cpu_limit,replicas columns")
+    parser.add_argument("--max-gap", type=float, default=3.0,
+                        help="Longest gap, in median sample intervals, counted as covered")
+    parser.add_argument("--prices", help="Spot price export (the feed's JSON, or CSV timestamp,price per kWh)")
+    parser.add_argument("--fetch-prices", action="store_true", help=f"Fetch prices from {SPOT_PRICE_URL}")
+    parser.add_argument("--price-field", default="PriceWithTax", help="Price field of the feed's JSON")
+    parser.add_argument("--price", type=float, default=None, help="Flat price per kWh when no spot prices are given")
+    parser.add_argument("--output", help="Write the JSON report to this file instead of stdout")
+    parser.add_argument("--csv", help="Also write the per-service table as CSV")
+    parser.add_argument("--html", help="Also write an HTML report")
+    args = parser.parse_args(argv)
+
+    prices = None
+    if args.prices or args.fetch_prices:
+        prices = load_prices(args.prices, SPOT_PRICE_URL if args.fetch_prices else None, args.price_field)
+    limits, replicas = parse_limits(args.limits) if args.limits else ({}, {})
+    options = {"watts_per_core": args.watts_per_core, "cpu_limit": args.cpu_limit, "limits": limits,
+               "replicas": replicas, "default_replicas": args.replicas,
+               "max_gap": args.max_gap, "price": args.price}
+    report = build_report(args.series, options, prices, args.workers)
+
+    if args.csv:
+        write_csv(report, args.csv)
+    if args.html:
+        write_html(report, args.html)
+    document = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(document)
+        logging.info(f"Report written to {args.output}")
+    elif not (args.csv or args.html):
+        sys.stdout.write(document + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,297 @@
+"""
+Federation of replica /metrics endpoints into one merged view.
+
+FederationScraper scrapes N targets (e.g. the api1/custom_app replicas behind nginx)
+concurrently over keep-alive sessions with gzip, parses each response with
+ExpositionParser and merges the results into one array per series (one slot per
+target), reduced with a per-metric aggregation. The central app serves the merged
+view on /federate when FEDERATION_TARGETS is set.
+
+    python Federation.py http://replica-1:8000/metrics http://replica-2:8000/metrics --aggregate cpu_usage=max
+"""
+import argparse
+import logging
+import math
+import re
+import sys
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from prometheus_client.utils import floatToGoString
+
+from SelfMetrics import pipeline_metrics
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+LABEL_PATTERN = re.compile(r'\s*([a-zA-Z_][a-zA-Z0-9_]*)\s*=\s*"((?:[^"\\]|\\.)*)"\s*,?')
+ESCAPES = {"\\\\": "\\", '\\"': '"', "\\n": "\n"}
+# Sample name suffixes that belong to the family without them
+FAMILY_SUFFIXES = ("_total", "_bucket", "_count", "_sum", "_created", "_gcount", "_gsum", "_info")
+
+AGGREGATIONS = ("sum", "max", "min", "avg", "none")
+# Used when a metric has no explicit aggregation: counts add up over replicas, levels average
+DEFAULT_AGGREGATION = {"counter": "sum", "histogram": "sum", "gaugehistogram": "sum", "summary": "sum",
+                       "gauge": "avg", "untyped": "sum", "unknown": "sum", "info": "max", "stateset": "max"}
+
+
+def _unescape(value):
+    return re.sub(r'\\[\\"n]', lambda match: ESCAPES[match.group(0)], value)
+
+
+class ExpositionParser:
+    """
+    Streaming parser for the Prometheus text format. Samples are returned as
+    {(name, ((label, value), ...)): value} with labels sorted by name. Every series key
+    is built once: the raw `name{labels}` text of a line maps to its interned key, so a
+    later scrape of the same series costs one dict lookup and a float(). Timestamps are
+    ignored. `# TYPE` lines are remembered in `types` (family name -> type).
+    """
+
+    def __init__(self, max_series=1000000):
+        self.max_series = max_series
+        self.series = {}  # raw "name{labels}" -> interned (name, labels) key
+        self.names = {}
+        self.label_sets = {}
+        self.types = {}
+
+    def _intern(self, raw):
+        brace = raw.find("{")
+        if brace == -1:
+            name, labels = raw.strip(), ()
+        else:
+            name = raw[:brace].strip()
+            end = raw.rfind("}")
+            if end < brace:
+                raise ValueError(f"Unterminated label set: {raw}")
+            body = raw[brace + 1:end]
+            pairs = []
+            position = 0
+            while position < len(body):
+                match = LABEL_PATTERN.match(body, position)
+                if match is None:
+                    if body[position:].strip(" ,"):
+                        raise ValueError(f"Invalid label set: {raw}")
+                    break
+                label, value = match.groups()
+                pairs.append((label, _unescape(value) if "\\" in value else value))
+                position = match.end()
+            labels = tuple(sorted(pairs))
+            labels = self.label_sets.setdefault(labels, labels)
+        name = self.names.setdefault(name, name)
+        return (name, labels)
+
+    def parse(self, text):
+        samples = {}
+        series = self.series
+        for line in text.splitlines():
+            if not line:
+                continue
+            if line[0] == "#":
+                parts = line.split(None, 3)
+                if len(parts) == 4 and parts[1] == "TYPE":
+                    self.types[parts[2]] = parts[3].strip()
+                continue
+            end = line.rfind("}")
+            if end == -1:
+                raw, _, rest = line.partition(" ")
+            else:
+                # Label values may contain spaces and braces; the value part never has a "}"
+                raw, rest = line[:end + 1], line[end + 1:]
+            key = series.get(raw)
+            if key is None:
+                if len(series) >= self.max_series:
+                    # Unbounded label churn; start over rather than grow forever
+                    series.clear()
+                    self.names.clear()
+                    self.label_sets.clear()
+                key = series[raw] = self._intern(raw)
+            fields = rest.split()
+            if not fields:
+                raise ValueError(f"Sample without a value: {line}")
+            samples[key] = float(fields[0])
+        return samples
+
+    def family(self, name):
+        """
+        The `# TYPE` family a sample name belongs to (the name itself if none is known).
+        """
+        if name in self.types:
+            return name
+        for suffix in FAMILY_SUFFIXES:
+            if name.endswith(suffix) and name[:-len(suffix)] in self.types:
+                return name[:-len(suffix)]
+        return name
+
+    def family_type(self, name):
+        return self.types.get(self.family(name), "untyped")
+
+
+def _aggregate(values, how):
+    present = [value for value in values if not math.isnan(value)]
+    if not present:
+        return None
+    if how == "sum":
+        return math.fsum(present)
+    if how == "max":
+        return max(present)
+    if how == "min":
+        return min(present)
+    return math.fsum(present) / len(present)
+
+
+class FederationScraper:
+    """
+    Scrapes `targets` concurrently and merges them. `aggregation` maps a metric (sample
+    or family) name to one of AGGREGATIONS; others follow DEFAULT_AGGREGATION for their
+    type, except quantiles and creation timestamps (max and min). "none" keeps one series per target with
+    an `instance_label` label instead of merging, replacing any such label the target already set.
+    """
+
+    def __init__(self, targets, aggregation=None, timeout=5.0, max_workers=16, instance_label="instance"):
+        for metric, how in (aggregation or {}).items():
+            if how not in AGGREGATIONS:
+                raise ValueError(f"Unknown aggregation for {metric}: {how}")
+        self.targets = list(targets)
+        self.aggregation = dict(aggregation or {})
+        self.timeout = timeout
+        self.instance_label = instance_label
+        self.parser = ExpositionParser()
+        # One session per target keeps its connection alive between scrapes
+        self.sessions = [requests.Session() for _ in self.targets]
+        for session in self.sessions:
+            session.headers["Accept-Encoding"] = "gzip"
+        self.executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(self.targets))),
+                                           thread_name_prefix="federation")
+        self.series = {}  # series key -> array of values, one slot per target (NaN if missing)
+        self.up = [0] * len(self.targets)
+        self.scrape_seconds = [0.0] * len(self.targets)
+
+    def _scrape(self, index):
+        target = self.targets[index]
+        started = time.perf_counter()
+        try:
+            with pipeline_metrics.time_backend("federation", "scrape"):
+                response = self.sessions[index].get(target, timeout=self.timeout)
+                response.raise_for_status()
+            # requests has already inflated a gzip body; parsing happens on this worker thread
+            return self.parser.parse(response.text)
+        except (requests.RequestException, ValueError) as e:
+            logging.error(f"Error scraping {target}: {e}")
+            pipeline_metrics.drop("federation", "scrape_error")
+            return None
+        finally:
+            self.scrape_seconds[index] = time.perf_counter() - started
+
+    def scrape(self):
+        """
+        Scrape every target once and rebuild the per-series arrays.
+        """
+        results = list(self.executor.map(self._scrape, range(len(self.targets))))
+        width = len(self.targets)
+        series = {}
+        for index, samples in enumerate(results):
+            self.up[index] = int(samples is not None)
+            for key, value in (samples or {}).items():
+                values = series.get(key)
+                if values is None:
+                    values = series[key] = array("d", [math.nan]) * width
+                values[index] = value
+        self.series = series
+        return series
+
+    def aggregation_for(self, name, labels):
+        how = self.aggregation.get(name)
+        if how is not None:
+            return how
+        for suffix in FAMILY_SUFFIXES:
+            if name.endswith(suffix) and name[:-len(suffix)] in self.aggregation:
+                return self.aggregation[name[:-len(suffix)]]
+        if any(label == "quantile" for label, _ in labels):
+            return "max"  # Quantiles of different replicas cannot be added up
+        if name.endswith("_created"):
+            return "min"  # Creation timestamps: the earliest replica
+        return DEFAULT_AGGREGATION.get(self.parser.family_type(name), "sum")
+
+    def merged(self):
+        """
+        {(name, labels): value} of the last scrape, reduced per series.
+        """
+        merged = {}
+        for (name, labels), values in self.series.items():
+            how = self.aggregation_for(name, labels)
+            if how == "none":
+                own = tuple(pair for pair in labels if pair[0] != self.instance_label)
+                for index, value in enumerate(values):
+                    if not math.isnan(value):
+                        instance = ((self.instance_label, self.targets[index]),)
+                        merged[(name, tuple(sorted(own + instance)))] = value
+                continue
+            value = _aggregate(values, how)
+            if value is not None:
+                merged[(name, labels)] = value
+        return merged
+
+    def render(self):
+        """
+        The merged view in the Prometheus text format, plus per-target up/scrape duration.
+        """
+        lines = []
+        typed = set()
+        # Samples of a family stay together, after its TYPE line
+        ordered = sorted((self.parser.family(name), name, labels, value)
+                         for (name, labels), value in self.merged().items())
+        for family, name, labels, value in ordered:
+            if family not in typed and family in self.parser.types:
+                typed.add(family)
+                lines.append(f"# TYPE {family} {self.parser.types[family]}")
+            rendered = ",".join(f'{label}="{_escape(label_value)}"' for label, label_value in labels)
+            lines.append(f"{name}{{{rendered}}} {floatToGoString(value)}" if rendered else
+                         f"{name} {floatToGoString(value)}")
+        lines.append("# TYPE federation_target_up gauge")
+        lines.extend(f'federation_target_up{{target="{_escape(target)}"}} {up}'
+                     for target, up in zip(self.targets, self.up))
+        lines.append("# TYPE federation_target_scrape_seconds gauge")
+        lines.extend(f'federation_target_scrape_seconds{{target="{_escape(target)}"}} {seconds}'
+                     for target, seconds in zip(self.targets, self.scrape_seconds))
+        return "\n".join(lines) + "\n"
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        for session in self.sessions:
+            session.close()
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def parse_aggregation(specs):
+    """
+    ["metric=max", ...] -> {"metric": "max", ...}
+    """
+    aggregation = {}
+    for spec in specs:
+        metric, _, how = spec.partition("=")
+        aggregation[metric] = how
+    return aggregation
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Scrape several /metrics endpoints and print the merged view")
+    parser.add_argument("targets", nargs="+", help="Full /metrics URLs of the replicas")
+    parser.add_argument("--aggregate", action="append", default=[],
+                        help=f"METRIC=HOW with HOW one of {', '.join(AGGREGATIONS)}")
+    parser.add_argument("--timeout", type=float, default=5.0)
+    args = parser.parse_args(argv)
+
+    scraper = FederationScraper(args.targets, parse_aggregation(args.aggregate), timeout=args.timeout)
+    scraper.scrape()
+    sys.stdout.write(scraper.render())
+    scraper.close()
+
+
+if __name__ == "__main__":
+    main()
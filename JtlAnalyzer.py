@@ -0,0 +1,489 @@
+"""
+Streaming analysis of JMeter result files (JTL, CSV or XML) joined with resource series.
+
+Samples are folded into per-label, per-time-bucket LatencyHistograms as they are read,
+so memory depends on the number of buckets and labels, not on the number of rows.
+The buckets are then joined with CPU/memory/power/energy series (Prometheus query_range
+exports, CSV exports or a live Prometheus) to give joules per request and
+latency-vs-utilization curves for each run:
+
+    python JtlAnalyzer.py docker/jmeter-test-plans/tests/results.jtl --prometheus http://localhost:9090
+    python JtlAnalyzer.py run1.jtl run2.jtl.gz --resources cpu.json --series cpu=docker_service_cpu_usage_percent
+"""
+import argparse
+import csv
+import gzip
+import json
+import logging
+import math
+import os
+import sys
+import xml.etree.ElementTree as ElementTree
+from datetime import datetime
+
+import requests
+
+from LatencyHistogram import LatencyHistogram
+from NodeConsolidation import node_power
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+ALL_LABELS = None  # Bucket key of the all-labels totals; None can't be a sampler label
+ALL_LABELS_NAME = "ALL"
+PERCENTILES = (50, 90, 95, 99, 99.9)
+
+# Default JMeter CSV columns, used when a file was saved without a header line
+JTL_CSV_FIELDS = ["timeStamp", "elapsed", "label", "responseCode", "responseMessage", "threadName", "dataType",
+                  "success", "failureMessage", "bytes", "sentBytes", "grpThreads", "allThreads", "URL",
+                  "Latency", "IdleTime", "Connect"]
+TIMESTAMP_FORMATS = ("%Y/%m/%d %H:%M:%S.%f", "%Y-%m-%d %H:%M:%S.%f", "%Y-%m-%dT%H:%M:%S.%f", "%Y/%m/%d %H:%M:%S")
+
+# Resource kinds and the collector metrics that feed them by default (override with --series).
+# Service CPU only: the container gauges cover the same tasks, and the series of a kind are summed
+DEFAULT_SERIES = {
+    "cpu": ["docker_service_cpu_usage_percent"],
+    "memory": ["docker_service_memory_usage_mb"],
+    "power": [],   # Watts, averaged over a bucket
+    "energy": [],  # Cumulative joules, differenced over a bucket
+}
+
+
+def _open(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", newline="", encoding="utf-8")
+    return open(path, newline="", encoding="utf-8")
+
+
+def _parse_timestamp(text):
+    """
+    JTL timestamps are epoch milliseconds unless jmeter.save.saveservice.timestamp_format was set.
+    """
+    try:
+        return int(text) / 1000.0
+    except ValueError:
+        pass
+    for timestamp_format in TIMESTAMP_FORMATS:
+        try:
+            return datetime.strptime(text, timestamp_format).timestamp()
+        except ValueError:
+            continue
+    raise ValueError(f"Unrecognised JTL timestamp: {text!r}")
+
+
+def _iter_csv(f):
+    reader = csv.reader(f)
+    first = next(reader, None)
+    if first is None:
+        return
+    if first and first[0] == "timeStamp":
+        fields = first
+    else:
+        fields = JTL_CSV_FIELDS
+        reader = _prepend(first, reader)
+    column = {name: index for index, name in enumerate(fields)}
+    ts, elapsed, label, success = column["timeStamp"], column["elapsed"], column["label"], column["success"]
+    size = column.get("bytes")
+    threads = column.get("allThreads")
+
+    for row in reader:
+        if len(row) < len(fields):
+            continue  # Truncated last line of a file still being written
+        yield (_parse_timestamp(row[ts]), int(row[elapsed]), row[label], row[success] == "true",
+               int(row[size]) if size is not None and row[size] else 0,
+               int(row[threads]) if threads is not None and row[threads] else 0)
+
+
+def _prepend(first, rows):
+    yield first
+    yield from rows
+
+
+def _iter_xml(f):
+    """
+    Top-level <httpSample>/<sample> elements only; nested ones are sub-results (redirects,
+    embedded resources) already included in their parent's time.
+    """
+    depth = 0
+    root = None
+    for event, element in ElementTree.iterparse(f, events=("start", "end")):
+        if event == "start":
+            if root is None:
+                root = element
+            elif element.tag in ("httpSample", "sample"):
+                depth += 1
+            continue
+        if element.tag not in ("httpSample", "sample"):
+            continue
+        depth -= 1
+        if depth == 0:
+            attributes = element.attrib
+            yield (int(attributes.get("ts", 0)) / 1000.0, int(attributes.get("t", 0)), attributes.get("lb", ""),
+                   attributes.get("s") == "true", int(attributes.get("by", 0) or 0), int(attributes.get("na", 0) or 0))
+            root.clear()  # Constant memory: drop the parsed samples
+
+
+def iter_jtl(path):
+    """
+    Yield (timestamp seconds, elapsed ms, label, success, bytes, active threads) for every
+    sample of a CSV or XML JTL file (optionally gzipped), reading it as a stream.
+    """
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rb") as f:
+        is_xml = f.read(1024).lstrip().startswith(b"<")
+    if is_xml:
+        with opener(path, "rb") as f:
+            yield from _iter_xml(f)
+    else:
+        with _open(path) as f:
+            yield from _iter_csv(f)
+
+
+class _BucketStats:
+    __slots__ = ("count", "errors", "bytes", "threads", "histogram")
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.bytes = 0
+        self.threads = 0
+        self.histogram = LatencyHistogram()
+
+    def merge(self, other):
+        self.count += other.count
+        self.errors += other.errors
+        self.bytes += other.bytes
+        self.threads = max(self.threads, other.threads)
+        self.histogram.merge(other.histogram)
+
+
+class JtlAnalyzer:
+    """
+    Per-label and per-bucket request statistics of one run. Analyzers of parts of a run
+    (e.g. one JTL file per load generator) can be merged.
+    """
+
+    def __init__(self, bucket_seconds=10, name=None):
+        self.bucket_seconds = bucket_seconds
+        self.name = name
+        self.buckets = {}  # (bucket start, label) -> _BucketStats
+        self.start = None
+        self.end = None
+        self.rows = 0
+
+    def add(self, timestamp, elapsed_ms, label, success, size=0, threads=0):
+        bucket = math.floor(timestamp / self.bucket_seconds) * self.bucket_seconds
+        for key in ((bucket, label), (bucket, ALL_LABELS)):
+            stats = self.buckets.get(key)
+            if stats is None:
+                stats = self.buckets[key] = _BucketStats()
+            stats.count += 1
+            stats.errors += not success
+            stats.bytes += size
+            if threads > stats.threads:
+                stats.threads = threads
+            stats.histogram.record(elapsed_ms * 1000)  # Microseconds
+        finished = timestamp + elapsed_ms / 1000.0
+        if self.start is None or timestamp < self.start:
+            self.start = timestamp
+        if self.end is None or finished > self.end:
+            self.end = finished
+        self.rows += 1
+
+    def analyze(self, path):
+        for sample in iter_jtl(path):
+            self.add(*sample)
+        logging.info(f"Read {self.rows} samples from {path}")
+        return self
+
+    def merge(self, other):
+        for key, stats in other.buckets.items():
+            if key not in self.buckets:
+                self.buckets[key] = _BucketStats()
+            self.buckets[key].merge(stats)
+        for attribute, pick in (("start", min), ("end", max)):
+            values = [v for v in (getattr(self, attribute), getattr(other, attribute)) if v is not None]
+            setattr(self, attribute, pick(values) if values else None)
+        self.rows += other.rows
+        return self
+
+    def labels(self):
+        """
+        Whole-run statistics per label, from merged bucket histograms.
+        """
+        merged = {}
+        for (_, label), stats in self.buckets.items():
+            if label not in merged:
+                merged[label] = _BucketStats()
+            merged[label].merge(stats)
+        duration = max(self.end - self.start, 1e-9) if self.start is not None else 1.0
+        total = merged.pop(ALL_LABELS, None)
+        result = {label: dict(_summary(stats), throughput=round(stats.count / duration, 3))
+                  for label, stats in sorted(merged.items())}
+        if total is not None:
+            # Rendered as "ALL" unless a sampler already has that name
+            name = ALL_LABELS_NAME if ALL_LABELS_NAME not in result else f"{ALL_LABELS_NAME} (all labels)"
+            result[name] = dict(_summary(total), throughput=round(total.count / duration, 3))
+        return result
+
+    def bucket_rows(self, label=ALL_LABELS):
+        return sorted(((bucket, stats) for (bucket, bucket_label), stats in self.buckets.items()
+                       if bucket_label == label), key=lambda row: row[0])
+
+
+def _summary(stats):
+    percentiles = stats.histogram.percentiles(PERCENTILES)
+    return {
+        "count": stats.count,
+        "errors": stats.errors,
+        "error_rate": round(stats.errors / stats.count, 4) if stats.count else 0.0,
+        "mean_ms": round(stats.histogram.mean() / 1000.0, 3),
+        "max_ms": round(stats.histogram.max / 1000.0, 3),
+        **{f"p{p:g}_ms".replace(".", "_"): round(percentiles[p] / 1000.0, 3) for p in PERCENTILES},
+    }
+
+
+class ResourceSeries:
+    """
+    Time series grouped by kind (cpu, memory, power, energy). Series of the same kind but
+    different labels (services, containers) are summed per bucket.
+    """
+
+    def __init__(self, series_map=None):
+        self.series_map = {kind: list(names) for kind, names in (series_map or DEFAULT_SERIES).items()}
+        self.series = {}  # (kind, series id) -> [(timestamp, value)]
+
+    def kind_of(self, metric_name):
+        for kind, names in self.series_map.items():
+            if metric_name in names:
+                return kind
+        return None
+
+    def add(self, kind, series_id, points):
+        self.series.setdefault((kind, series_id), []).extend(points)
+
+    def load(self, path, kind=None):
+        """
+        Load a Prometheus query_range JSON export or a CSV with timestamp,metric,value[,series] columns.
+        """
+        with _open(path) as f:
+            head = f.read(1)
+            f.seek(0)
+            if head == "{":
+                self._load_prometheus_json(json.load(f), kind)
+            else:
+                self._load_csv(f, kind)
+        return self
+
+    def _load_prometheus_json(self, document, kind=None):
+        for result in document.get("data", {}).get("result", []):
+            metric = result.get("metric", {})
+            series_kind = kind or self.kind_of(metric.get("__name__", ""))
+            if series_kind is None:
+                continue
+            series_id = json.dumps(metric, sort_keys=True)
+            self.add(series_kind, series_id, [(float(t), float(v)) for t, v in result.get("values", [])])
+
+    def _load_csv(self, f, kind=None):
+        reader = csv.DictReader(f)
+        for row in reader:
+            series_kind = kind or self.kind_of(row.get("metric", ""))
+            if series_kind is None:
+                continue
+            series_id = f"{row.get('metric', '')}|{row.get('series', '')}"
+            self.add(series_kind, series_id, [(_resource_timestamp(row["timestamp"]), float(row["value"]))])
+
+    def fetch(self, prometheus_url, start, end, step=5):
+        """
+        Pull every configured metric from Prometheus' query_range API for the run's time span.
+        """
+        for kind, names in self.series_map.items():
+            for name in names:
+                try:
+                    response = requests.get(f"{prometheus_url}/api/v1/query_range",
+                                            params={"query": name, "start": start, "end": end, "step": step},
+                                            timeout=30)
+                    response.raise_for_status()
+                    self._load_prometheus_json(response.json(), kind)
+                except Exception as e:
+                    logging.error(f"Error fetching {name} from Prometheus: {e}")
+        return self
+
+    def bucket_values(self, kind, bucket_seconds):
+        """
+        {bucket start: value} summed over series. Gauges (cpu, memory, power) are averaged within
+        a bucket; energy counters are differenced across it, counter resets excluded.
+        """
+        totals = {}
+        for (series_kind, _), points in self.series.items():
+            if series_kind != kind:
+                continue
+            per_bucket = {}
+            previous = None
+            for timestamp, value in sorted(points):
+                bucket = math.floor(timestamp / bucket_seconds) * bucket_seconds
+                if kind == "energy":
+                    if previous is not None and value >= previous:
+                        per_bucket[bucket] = per_bucket.get(bucket, 0.0) + value - previous
+                    previous = value
+                else:
+                    total, count = per_bucket.get(bucket, (0.0, 0))
+                    per_bucket[bucket] = (total + value, count + 1)
+            for bucket, value in per_bucket.items():
+                if kind != "energy":
+                    value = value[0] / value[1]
+                totals[bucket] = totals.get(bucket, 0.0) + value
+        return totals
+
+
+def _resource_timestamp(text):
+    """
+    Resource exports use epoch seconds (as Prometheus does) or one of the JTL date formats.
+    """
+    try:
+        return float(text)
+    except ValueError:
+        return _parse_timestamp(text)
+
+
+def correlate(analyzer, resources, cpu_capacity=100.0, node=None, curve_bin=10.0):
+    """
+    Join the request buckets with the resource buckets. Energy per bucket comes from an
+    energy counter if present, else from mean power, else from CPU utilization through
+    NodeConsolidation.node_power.
+    """
+    width = analyzer.bucket_seconds
+    cpu = resources.bucket_values("cpu", width)
+    memory = resources.bucket_values("memory", width)
+    power = resources.bucket_values("power", width)
+    energy = resources.bucket_values("energy", width)
+    node = node or {"cpu": cpu_capacity}
+
+    rows, curves = [], {}
+    total_requests, total_joules = 0, 0.0
+    for bucket, stats in analyzer.bucket_rows():
+        joules, source = None, None
+        if bucket in energy:
+            joules, source = energy[bucket], "energy"
+        elif bucket in power:
+            joules, source = power[bucket] * width, "power"
+        elif bucket in cpu:
+            joules, source = node_power(node, cpu[bucket]) * width, "cpu_model"
+
+        row = dict(_summary(stats), start=bucket, rps=round(stats.count / width, 3), threads=stats.threads,
+                   cpu_percent=_round(cpu.get(bucket)), memory=_round(memory.get(bucket)),
+                   energy_joules=_round(joules), energy_source=source,
+                   joules_per_request=_round(joules / stats.count if joules is not None and stats.count else None))
+        rows.append(row)
+
+        if joules is not None:
+            total_requests += stats.count
+            total_joules += joules
+        if bucket in cpu:
+            low = math.floor(cpu[bucket] / curve_bin) * curve_bin
+            curve = curves.get(low)
+            if curve is None:
+                curve = curves[low] = {"buckets": 0, "stats": _BucketStats(), "joules": 0.0, "energy_buckets": 0}
+            curve["buckets"] += 1
+            curve["stats"].merge(stats)
+            if joules is not None:
+                curve["joules"] += joules
+                curve["energy_buckets"] += 1
+
+    latency_vs_utilization = []
+    for low, curve in sorted(curves.items()):
+        stats = curve["stats"]
+        latency_vs_utilization.append(dict(
+            _summary(stats), cpu_from=low, cpu_to=low + curve_bin, buckets=curve["buckets"],
+            rps=round(stats.count / (curve["buckets"] * width), 3),
+            joules_per_request=_round(curve["joules"] / stats.count if curve["energy_buckets"] and stats.count else None)))
+
+    return {
+        "run": analyzer.name,
+        "start": analyzer.start,
+        "end": analyzer.end,
+        "bucket_seconds": width,
+        "samples": analyzer.rows,
+        "labels": analyzer.labels(),
+        "buckets": rows,
+        "latency_vs_utilization": latency_vs_utilization,
+        "totals": {
+            "requests_with_energy": total_requests,
+            "energy_joules": round(total_joules, 3),
+            "joules_per_request": _round(total_joules / total_requests if total_requests else None),
+        },
+    }
+
+
+def _round(value, digits=4):
+    return None if value is None else round(value, digits)
+
+
+def write_curves_csv(reports, path):
+    fields = ["run", "cpu_from", "cpu_to", "buckets", "count", "rps", "error_rate", "mean_ms",
+              "p50_ms", "p90_ms", "p95_ms", "p99_ms", "p99_9_ms", "max_ms", "joules_per_request"]
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fields, extrasaction="ignore")
+        writer.writeheader()
+        for report in reports:
+            for point in report["latency_vs_utilization"]:
+                writer.writerow(dict(point, run=report["run"]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("jtl", nargs="+", help="JTL files; each one is reported as a separate run")
+    parser.add_argument("--bucket", type=float, default=10.0, help="Bucket width in seconds")
+    parser.add_argument("--resources", action="append", default=[],
+                        help="Resource export (Prometheus query_range JSON or CSV); KIND=PATH forces the kind")
+    parser.add_argument("--series", action="append", default=[],
+                        help="KIND=METRIC maps a metric to cpu, memory, power or energy (replaces the defaults of KIND)")
+    parser.add_argument("--prometheus", help="Fetch the series for each run's time span from this Prometheus")
+    parser.add_argument("--step", type=float, default=5.0, help="query_range step for --prometheus")
+    parser.add_argument("--cpu-capacity", type=float, default=100.0,
+                        help="CPU percent that counts as full utilization in the power model")
+    parser.add_argument("--curve-bin", type=float, default=10.0, help="CPU percent per latency-vs-utilization point")
+    parser.add_argument("--output", help="Write the JSON report to this file instead of stdout")
+    parser.add_argument("--csv", help="Also write the latency-vs-utilization curves as CSV")
+    args = parser.parse_args(argv)
+
+    series_map = dict(DEFAULT_SERIES)
+    overrides = {}
+    for mapping in args.series:
+        kind, _, metric = mapping.partition("=")
+        if kind not in series_map:
+            parser.error(f"Unknown series kind: {kind}")
+        overrides.setdefault(kind, []).append(metric)
+    series_map.update(overrides)
+
+    exported = ResourceSeries(series_map)
+    for spec in args.resources:
+        kind, separator, path = spec.partition("=")
+        if separator and kind in series_map:
+            exported.load(path, kind)
+        else:
+            exported.load(spec)
+
+    reports = []
+    for path in args.jtl:
+        analyzer = JtlAnalyzer(args.bucket, name=os.path.basename(path)).analyze(path)
+        resources = exported
+        if args.prometheus and analyzer.start is not None:
+            resources = ResourceSeries(series_map)
+            resources.series.update(exported.series)
+            resources.fetch(args.prometheus, analyzer.start, analyzer.end, args.step)
+        reports.append(correlate(analyzer, resources, args.cpu_capacity, curve_bin=args.curve_bin))
+
+    document = json.dumps({"runs": reports}, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(document)
+        logging.info(f"Report written to {args.output}")
+    else:
+        sys.stdout.write(document + "\n")
+    if args.csv:
+        write_curves_csv(reports, args.csv)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+import math
+
+
+class LatencyHistogram:
+    """
+    Log-linear histogram in the style of HdrHistogram: values below 2**precision_bits are
+    counted exactly, larger values fall into buckets at most 1/2**(precision_bits - 1) of
+    the value wide (1/64, about 1.6%, with the default 7 bits). Buckets are a sparse dict,
+    so memory depends only on the value range, and histograms merge by adding counts.
+
+    Values are non-negative integers in whatever unit the caller chooses (microseconds
+    in JtlAnalyzer and LoadGenerator).
+    """
+
+    def __init__(self, precision_bits=7):
+        self.precision_bits = precision_bits
+        self._half = 1 << (precision_bits - 1)
+        self._exact = 1 << precision_bits
+        self.counts = {}  # bucket index -> count
+        self.total_count = 0
+        self.min = None
+        self.max = 0
+        self._sum = 0
+        self._sum_squares = 0
+
+    def _index(self, value):
+        if value < self._exact:
+            return value
+        shift = value.bit_length() - self.precision_bits
+        return shift * self._half + (value >> shift)
+
+    def _bounds(self, index):
+        """
+        Lowest and highest value counted in a bucket.
+        """
+        if index < self._exact:
+            return index, index
+        shift = (index >> (self.precision_bits - 1)) - 1
+        lowest = (index - shift * self._half) << shift
+        return lowest, lowest + (1 << shift) - 1
+
+    def record(self, value, count=1):
+        value = max(0, int(value))
+        index = self._index(value)
+        self.counts[index] = self.counts.get(index, 0) + count
+        self.total_count += count
+        self._sum += value * count
+        self._sum_squares += value * value * count
+        if self.min is None or value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def record_corrected(self, value, expected_interval):
+        """
+        Record a value from a closed-loop client with coordinated-omission correction: a
+        stall longer than the expected interval also accounts for the requests that would
+        have been issued (and delayed) during it.
+        """
+        self.record(value)
+        if expected_interval <= 0:
+            return
+        missing = value - expected_interval
+        while missing >= expected_interval:
+            self.record(missing)
+            missing -= expected_interval
+
+    def merge(self, other):
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.total_count += other.total_count
+        self._sum += other._sum
+        self._sum_squares += other._sum_squares
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        self.max = max(self.max, other.max)
+        return self
+
+    def copy(self):
+        return LatencyHistogram(self.precision_bits).merge(self)
+
+    def mean(self):
+        return self._sum / self.total_count if self.total_count else 0.0
+
+    def stddev(self):
+        if not self.total_count:
+            return 0.0
+        mean = self.mean()
+        return math.sqrt(max(0.0, self._sum_squares / self.total_count - mean * mean))
+
+    def value_at_percentile(self, percentile):
+        """
+        Highest value equivalent to the given percentile (0-100), like HdrHistogram.
+        """
+        if not self.total_count:
+            return 0
+        target = max(1, math.ceil(self.total_count * percentile / 100.0))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= target:
+                return min(self._bounds(index)[1], self.max)
+        return self.max
+
+    def percentiles(self, percentiles=(50, 90, 99, 99.9)):
+        """
+        Several percentiles in one pass over the buckets.
+        """
+        result = {}
+        if not self.total_count:
+            return {p: 0 for p in percentiles}
+        targets = sorted((max(1, math.ceil(self.total_count * p / 100.0)), p) for p in percentiles)
+        seen, position = 0, 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            while position < len(targets) and seen >= targets[position][0]:
+                result[targets[position][1]] = min(self._bounds(index)[1], self.max)
+                position += 1
+            if position == len(targets):
+                break
+        for _, p in targets[position:]:
+            result[p] = self.max
+        return result
+
+    def to_dict(self):
+        return {"precision_bits": self.precision_bits, "counts": {str(k): v for k, v in self.counts.items()},
+                "total_count": self.total_count, "min": self.min, "max": self.max,
+                "sum": self._sum, "sum_squares": self._sum_squares}
+
+    @classmethod
+    def from_dict(cls, data):
+        histogram = cls(data["precision_bits"])
+        histogram.counts = {int(k): v for k, v in data["counts"].items()}
+        histogram.total_count = data["total_count"]
+        histogram.min = data["min"]
+        histogram.max = data["max"]
+        histogram._sum = data["sum"]
+        histogram._sum_squares = data["sum_squares"]
+        return histogram
+
+    def percentile_distribution(self, ticks_per_half_distance=5, scale=1000.0):
+        """
+        Text in HdrHistogram's .hgrm layout (readable by the HdrHistogram plotter);
+        values are divided by `scale`, e.g. microseconds shown as milliseconds.
+        """
+        lines = [f"{'Value':>12} {'Percentile':>14} {'TotalCount':>10} {'1/(1-Percentile)':>14}", ""]
+        if self.total_count:
+            ordered = sorted(self.counts)
+            cumulative, seen = [], 0
+            for index in ordered:
+                seen += self.counts[index]
+                cumulative.append(seen)
+
+            position, percentile = 0, 0.0
+            while True:
+                target = max(1, math.ceil(self.total_count * percentile / 100.0))
+                while cumulative[position] < target:
+                    position += 1
+                value = min(self._bounds(ordered[position])[1], self.max)
+                lines.append(f"{value / scale:12.3f} {percentile / 100.0:14.12f} {cumulative[position]:10d} "
+                             f"{1 / (1 - percentile / 100.0):14.2f}")
+                if cumulative[position] == self.total_count:
+                    lines.append(f"{self.max / scale:12.3f} {1.0:14.12f} {self.total_count:10d}")
+                    break
+                # Ticks get denser as the percentile approaches 100, halving the remaining distance
+                half_distance = 2 ** (math.floor(math.log2(100.0 / (100.0 - percentile))) + 1)
+                percentile += 100.0 / (half_distance * ticks_per_half_distance)
+
+        lines.append(f"#[Mean    = {self.mean() / scale:12.3f}, StdDeviation   = {self.stddev() / scale:12.3f}]")
+        lines.append(f"#[Max     = {self.max / scale:12.3f}, Total count    = {self.total_count:12d}]")
+        lines.append(f"#[Buckets = {len(self.counts):12d}, SubBuckets     = {self._exact:12d}]")
+        return "\n".join(lines) + "\n"
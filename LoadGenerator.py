@@ -0,0 +1,350 @@
+"""
+Open-loop HTTP load generator for the api1 endpoints, built on aiohttp.
+
+Requests are issued on a schedule drawn from an arrival model (Poisson, step or diurnal)
+regardless of how fast the server answers, and every latency is measured from the
+request's intended start time, so a stalled server shows up as queueing delay instead
+of silently lowering the offered load (coordinated omission).
+
+    python LoadGenerator.py http://localhost:8000 --rate 500 --duration 60 \\
+        --endpoints /get_data=5,/cputask=1,/memorytask=1,/networktask=1
+    python LoadGenerator.py http://localhost/app --arrival step --steps 30:100,30:500,30:1000 --jtl run.jtl
+    python LoadGenerator.py http://localhost:8000 --arrival diurnal --rate 50 --peak-rate 800 --period 600
+"""
+import argparse
+import asyncio
+import bisect
+import csv
+import json
+import logging
+import math
+import os
+import random
+import sys
+import time
+
+import aiohttp
+
+from LatencyHistogram import LatencyHistogram
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+DEFAULT_ENDPOINTS = "/get_data=1,/cputask=1,/memorytask=1,/networktask=1"
+
+
+class ConstantRate:
+    def __init__(self, rate):
+        self.rate = rate
+        self.peak = rate
+
+    def rate_at(self, t):
+        return self.rate
+
+
+class StepRate:
+    """
+    Piecewise-constant rate: [(duration seconds, requests per second), ...]; the last step holds.
+    """
+
+    def __init__(self, steps):
+        self.steps = steps
+        self.peak = max(rate for _, rate in steps)
+        self.ends = []
+        elapsed = 0.0
+        for duration, _ in steps:
+            elapsed += duration
+            self.ends.append(elapsed)
+
+    def rate_at(self, t):
+        index = bisect.bisect_right(self.ends, t)
+        return self.steps[min(index, len(self.steps) - 1)][1]
+
+
+class DiurnalRate:
+    """
+    Sinusoidal day/night cycle between `low` and `peak` requests per second, starting at the trough.
+    """
+
+    def __init__(self, low, peak, period):
+        self.low = low
+        self.peak = peak
+        self.period = period
+
+    def rate_at(self, t):
+        return self.low + (self.peak - self.low) * (1 - math.cos(2 * math.pi * t / self.period)) / 2
+
+
+def arrivals(model, duration, rng, poisson=True):
+    """
+    Intended send times (seconds from the start). Poisson arrivals for a time-varying rate
+    are drawn by thinning a process at the peak rate; otherwise arrivals are evenly spaced.
+    """
+    t = 0.0
+    while True:
+        if poisson:
+            t += rng.expovariate(model.peak)
+            if t >= duration:
+                return
+            if rng.random() * model.peak <= model.rate_at(t):
+                yield t
+        else:
+            rate = model.rate_at(t)
+            t += 1.0 / rate if rate > 0 else 0.1
+            if t >= duration:
+                return
+            if rate > 0:
+                yield t
+
+
+def parse_endpoints(spec):
+    """
+    '/get_data=5,/cputask=1' -> (paths, cumulative weights).
+    """
+    paths, cumulative, total = [], [], 0.0
+    for item in spec.split(","):
+        path, _, weight = item.strip().partition("=")
+        total += float(weight or 1)
+        paths.append(path)
+        cumulative.append(total)
+    return paths, cumulative
+
+
+class EndpointStats:
+    def __init__(self):
+        self.response_time = LatencyHistogram()  # From the intended start (includes queueing)
+        self.service_time = LatencyHistogram()   # From the actual send
+        self.statuses = {}
+        self.errors = 0
+
+    def merge_into(self, other):
+        other.response_time.merge(self.response_time)
+        other.service_time.merge(self.service_time)
+        for status, count in self.statuses.items():
+            other.statuses[status] = other.statuses.get(status, 0) + count
+        other.errors += self.errors
+
+    def summary(self, duration):
+        count = self.response_time.total_count
+        response = self.response_time.percentiles((50, 90, 99, 99.9))
+        service = self.service_time.percentiles((50, 99))
+        return {
+            "requests": count,
+            "throughput": round(count / duration, 2) if duration else 0.0,
+            "errors": self.errors,
+            "statuses": {str(k): v for k, v in sorted(self.statuses.items(), key=lambda item: str(item[0]))},
+            "response_ms": {f"p{p:g}": round(v / 1000.0, 3) for p, v in response.items()},
+            "response_mean_ms": round(self.response_time.mean() / 1000.0, 3),
+            "response_max_ms": round(self.response_time.max / 1000.0, 3),
+            "service_ms": {f"p{p:g}": round(v / 1000.0, 3) for p, v in service.items()},
+        }
+
+
+class LoadGenerator:
+    """
+    Fires requests at their scheduled times from one event loop. `max_in_flight` bounds
+    memory under overload; requests over the bound wait for a slot and that wait counts
+    towards their response time.
+    """
+
+    def __init__(self, base_url, model, endpoints=DEFAULT_ENDPOINTS, duration=60, warmup=0, poisson=True,
+                 connections=1000, max_in_flight=20000, timeout=30, seed=None, jtl_path=None):
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self.paths, self.weights = parse_endpoints(endpoints)
+        self.duration = duration
+        self.warmup = warmup
+        self.poisson = poisson
+        self.connections = connections
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self.rng = random.Random(seed)
+        self.jtl_path = jtl_path
+
+        self.stats = {path: EndpointStats() for path in self.paths}
+        self.scheduled = 0
+        self.in_flight = 0
+        self.max_lag = 0.0  # Worst delay of the scheduler behind the intended send time
+        self._jtl = None
+
+    def _pick(self):
+        return self.paths[bisect.bisect_left(self.weights, self.rng.random() * self.weights[-1])]
+
+    async def _request(self, session, slots, path, intended, epoch):
+        try:
+            async with slots:
+                sent = time.perf_counter()
+                status = None
+                try:
+                    async with session.get(self.base_url + path) as response:
+                        await response.read()
+                        status = response.status
+                except asyncio.TimeoutError:
+                    status = "timeout"
+                except aiohttp.ClientError as e:
+                    status = type(e).__name__
+                finished = time.perf_counter()
+        finally:
+            # Also on cancellation or an unexpected error, or in_flight drifts upwards for the rest of the run
+            self.in_flight -= 1
+
+        relative = intended - epoch
+        if relative < self.warmup:
+            return
+        stats = self.stats[path]
+        stats.response_time.record((finished - intended) * 1e6)
+        stats.service_time.record((finished - sent) * 1e6)
+        stats.statuses[status] = stats.statuses.get(status, 0) + 1
+        success = isinstance(status, int) and status < 400
+        if not success:
+            stats.errors += 1
+        if self._jtl is not None:
+            self._jtl.writerow([int((self.wall_epoch + relative) * 1000), int((finished - intended) * 1000), path,
+                                status, "", "LoadGenerator", "text", "true" if success else "false", "", 0, 0,
+                                self.in_flight + 1, self.in_flight + 1, self.base_url + path,
+                                int((finished - sent) * 1000), 0, 0])
+
+    async def _progress(self, epoch):
+        last_count, last_time = 0, epoch
+        while True:
+            await asyncio.sleep(5)
+            now = time.perf_counter()
+            done = sum(stats.response_time.total_count for stats in self.stats.values())
+            logging.info(f"t={now - epoch:.0f}s target={self.model.rate_at(now - epoch):.0f}/s "
+                         f"achieved={(done - last_count) / (now - last_time):.0f}/s in_flight={self.in_flight} "
+                         f"scheduler_lag_max={self.max_lag * 1000:.1f}ms")
+            last_count, last_time = done, now
+
+    async def run(self):
+        connector = aiohttp.TCPConnector(limit=self.connections, ttl_dns_cache=300)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        slots = asyncio.Semaphore(self.max_in_flight)
+        tasks = set()
+        jtl_file = None
+        if self.jtl_path:
+            jtl_file = open(self.jtl_path, "w", newline="")
+            self._jtl = csv.writer(jtl_file)
+            self._jtl.writerow(["timeStamp", "elapsed", "label", "responseCode", "responseMessage", "threadName",
+                                "dataType", "success", "failureMessage", "bytes", "sentBytes", "grpThreads",
+                                "allThreads", "URL", "Latency", "IdleTime", "Connect"])
+
+        try:
+            async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+                epoch = time.perf_counter()
+                self.wall_epoch = time.time()
+                progress = asyncio.ensure_future(self._progress(epoch))
+                try:
+                    for offset in arrivals(self.model, self.duration + self.warmup, self.rng, self.poisson):
+                        intended = epoch + offset
+                        delay = intended - time.perf_counter()
+                        if delay > 0.001:
+                            await asyncio.sleep(delay)
+                        else:
+                            # Behind schedule: send right away, and yield now and then so responses are processed
+                            self.max_lag = max(self.max_lag, -delay)
+                            if self.scheduled % 64 == 0:
+                                await asyncio.sleep(0)
+                        self.scheduled += 1
+                        self.in_flight += 1
+                        task = asyncio.ensure_future(self._request(session, slots, self._pick(), intended, epoch))
+                        tasks.add(task)
+                        task.add_done_callback(tasks.discard)
+                    if tasks:
+                        await asyncio.wait(set(tasks))
+                finally:
+                    progress.cancel()
+        finally:
+            if jtl_file is not None:
+                jtl_file.close()
+        return self.report()
+
+    def report(self):
+        total = EndpointStats()
+        for stats in self.stats.values():
+            stats.merge_into(total)
+        return {
+            "base_url": self.base_url,
+            "duration": self.duration,
+            "scheduled": self.scheduled,
+            "scheduler_lag_max_ms": round(self.max_lag * 1000, 3),
+            "total": total.summary(self.duration),
+            "endpoints": {path: stats.summary(self.duration) for path, stats in self.stats.items()},
+        }
+
+    def write_hgrm(self, directory):
+        """
+        One .hgrm file per endpoint plus all.hgrm, in milliseconds.
+        """
+        os.makedirs(directory, exist_ok=True)
+        total = LatencyHistogram()
+        for path, stats in self.stats.items():
+            total.merge(stats.response_time)
+            name = path.strip("/").replace("/", "_") or "root"
+            with open(os.path.join(directory, f"{name}.hgrm"), "w") as f:
+                f.write(stats.response_time.percentile_distribution())
+        with open(os.path.join(directory, "all.hgrm"), "w") as f:
+            f.write(total.percentile_distribution())
+
+
+def _parse_steps(text):
+    steps = []
+    for item in text.split(","):
+        duration, _, rate = item.partition(":")
+        steps.append((float(duration), float(rate)))
+    return steps
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("base_url", help="e.g. http://localhost:8000 or http://localhost/app")
+    parser.add_argument("--endpoints", default=DEFAULT_ENDPOINTS, help="Weighted mix: PATH=WEIGHT,...")
+    parser.add_argument("--arrival", choices=("poisson", "uniform", "step", "diurnal"), default="poisson")
+    parser.add_argument("--rate", type=float, default=100.0, help="Requests per second (trough for diurnal)")
+    parser.add_argument("--peak-rate", type=float, help="Diurnal peak requests per second")
+    parser.add_argument("--period", type=float, default=3600.0, help="Diurnal period in seconds")
+    parser.add_argument("--steps", help="Step profile: SECONDS:RATE,... (duration defaults to its total)")
+    parser.add_argument("--duration", type=float, help="Measured seconds (default 60)")
+    parser.add_argument("--warmup", type=float, default=0.0, help="Seconds of load excluded from the results")
+    parser.add_argument("--connections", type=int, default=1000, help="Connection pool size")
+    parser.add_argument("--max-in-flight", type=int, default=20000)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--seed", type=int, help="Seed for arrivals and endpoint choice")
+    parser.add_argument("--output", help="Write the JSON summary to this file instead of stdout")
+    parser.add_argument("--hgrm-dir", help="Write HdrHistogram .hgrm percentile distributions here")
+    parser.add_argument("--jtl", help="Also write every request as a JMeter CSV JTL (for JtlAnalyzer.py)")
+    args = parser.parse_args(argv)
+
+    if args.arrival == "step":
+        if not args.steps:
+            parser.error("--arrival step needs --steps")
+        model = StepRate(_parse_steps(args.steps))
+        duration = args.duration or sum(duration for duration, _ in model.steps)
+    elif args.arrival == "diurnal":
+        model = DiurnalRate(args.rate, args.peak_rate or args.rate * 4, args.period)
+        duration = args.duration or args.period
+    else:
+        model = ConstantRate(args.rate)
+        duration = args.duration or 60.0
+    if model.peak <= 0:
+        # Poisson arrivals are drawn at the peak rate; there is nothing to schedule below it
+        parser.error("the peak request rate must be positive")
+
+    generator = LoadGenerator(args.base_url, model, args.endpoints, duration, args.warmup,
+                              poisson=args.arrival != "uniform", connections=args.connections,
+                              max_in_flight=args.max_in_flight, timeout=args.timeout, seed=args.seed,
+                              jtl_path=args.jtl)
+    report = asyncio.run(generator.run())
+
+    document = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(document)
+        logging.info(f"Summary written to {args.output}")
+    else:
+        sys.stdout.write(document + "\n")
+    if args.hgrm_dir:
+        generator.write_hgrm(args.hgrm_dir)
+
+
+if __name__ == "__main__":
+    main()
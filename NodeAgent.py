@@ -0,0 +1,429 @@
+"""
+Node agent and cluster aggregator for multi-node Swarm monitoring.
+
+An agent runs as a global service on every node, talks to the local Docker socket and
+pushes gzip-compressed batches of changed values to the aggregator (POST /agent/push on
+the central app). The aggregator merges the batches into one cluster view, exposed on
+/metrics. When several agents can see the same container (e.g. agents pointed at shared
+remote daemons) the aggregator assigns it to one of them with a consistent hash ring, so
+collection work spreads over the agents and only moves for the containers of an agent
+that joins or leaves.
+
+    python NodeAgent.py --aggregator http://python-app-assignment:8000 --node "$(hostname)"
+"""
+import argparse
+import bisect
+import gzip
+import hashlib
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from prometheus_client import CollectorRegistry, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+from DockerMetrics import connect_docker
+from api import compute_container_sample
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+SERVICE_LABEL = "com.docker.swarm.service.name"
+SAMPLE_FIELDS = ("cpu_percent", "memory_percent", "network_sent", "network_recv", "disk_read", "disk_write")
+# Values are rounded before comparison so noise below these steps is not re-sent
+FIELD_PRECISION = {"cpu_percent": 2, "memory_percent": 2}
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    """
+    Consistent hash ring with virtual nodes. owner() can be restricted to the members that
+    are able to serve a key, walking clockwise past the others.
+    """
+
+    def __init__(self, members=(), vnodes=64):
+        self.vnodes = vnodes
+        self.members = set()
+        self._points = []  # Sorted (position, member)
+        for member in members:
+            self.add(member)
+
+    def add(self, member):
+        if member in self.members:
+            return
+        self.members.add(member)
+        for replica in range(self.vnodes):
+            bisect.insort(self._points, (_hash(f"{member}#{replica}"), member))
+
+    def remove(self, member):
+        if member not in self.members:
+            return
+        self.members.discard(member)
+        self._points = [point for point in self._points if point[1] != member]
+
+    def owner(self, key, candidates=None):
+        if not self._points:
+            return None
+        if candidates is not None and len(candidates) == 1:
+            return next(iter(candidates))
+        start = bisect.bisect(self._points, (_hash(key), ""))
+        for offset in range(len(self._points)):
+            member = self._points[(start + offset) % len(self._points)][1]
+            if candidates is None or member in candidates:
+                return member
+        return None
+
+
+class NodeAgent:
+    """
+    Collects the containers of the local daemon that the aggregator assigned to this agent
+    and pushes only the values that changed since the last successful push.
+    """
+
+    def __init__(self, node_name, aggregator_url, docker_url="unix:///var/run/docker.sock", interval=5,
+                 full_every=60, max_workers=16, client_factory=None):
+        self.node_name = node_name
+        self.aggregator_url = aggregator_url.rstrip("/")
+        self.docker_url = docker_url
+        self.interval = interval
+        self.full_every = full_every  # Pushes between full resynchronisations
+        self.client_factory = client_factory
+        self._client = None
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="agent-stats")
+        self.session = requests.Session()
+        self.stop_event = threading.Event()
+
+        self.containers = {}  # short id -> container handle
+        self.states = {}  # short id -> previous network/disk counters
+        self.last_sent = {}  # short id -> {field: value} as last reported
+        self.pending = {}  # short id -> fields not yet acknowledged
+        self.pending_removed = set()
+        self.owned = None  # None until the aggregator answers: collect everything visible
+        self.assignment_version = 0
+        self.visible_digest = None
+        self.seq = 0
+        self.force_full = True
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = connect_docker(self.docker_url, self.client_factory)
+        return self._client
+
+    def _discover(self):
+        containers = {container.id[:12]: container for container in self.client.containers.list()}
+        self.containers = containers
+        for short_id in list(self.states):
+            if short_id not in containers:
+                del self.states[short_id]
+        return sorted(containers)
+
+    def _sample(self, short_id):
+        container = self.containers[short_id]
+        stats = container.stats(stream=False)
+        state = self.states.setdefault(short_id, {"net_io": None, "blk_io": None})
+        sample = compute_container_sample(stats, state)
+        values = {}
+        for field in SAMPLE_FIELDS:
+            value = sample[field]
+            if value is not None:
+                values[field] = round(value, FIELD_PRECISION.get(field, 0))
+        return short_id, values
+
+    def collect(self):
+        """
+        One collection round: sample the owned containers in parallel and fold the changes into `pending`.
+        """
+        visible = self._discover()
+        targets = [short_id for short_id in visible if self.owned is None or short_id in self.owned]
+        for short_id, values in self.executor.map(self._safe_sample, targets):
+            if values is None:
+                continue
+            previous = self.last_sent.get(short_id)
+            if previous is None:
+                container = self.containers[short_id]
+                changed = dict(values, name=container.name,
+                               service=container.labels.get(SERVICE_LABEL, ""))
+            else:
+                changed = {field: value for field, value in values.items() if previous.get(field) != value}
+            self.last_sent[short_id] = dict(previous or {}, **changed)
+            if changed:
+                self.pending.setdefault(short_id, {}).update(changed)
+                self.pending_removed.discard(short_id)
+
+        for short_id in list(self.last_sent):
+            if short_id not in self.containers or (self.owned is not None and short_id not in self.owned):
+                del self.last_sent[short_id]
+                self.pending.pop(short_id, None)
+                self.pending_removed.add(short_id)
+        return visible
+
+    def _safe_sample(self, short_id):
+        try:
+            return self._sample(short_id)
+        except Exception as e:
+            logging.error(f"Error sampling container {short_id}: {e}")
+            return short_id, None
+
+    def build_batch(self, visible):
+        full = self.force_full or (self.full_every and self.seq % self.full_every == 0)
+        digest = hashlib.sha1(",".join(visible).encode("utf-8")).hexdigest()
+        batch = {
+            "agent": self.node_name,
+            "seq": self.seq + 1,
+            "full": bool(full),
+            "interval": self.interval,
+            "assignment_version": self.assignment_version,
+            "visible_digest": digest,
+            "samples": self.last_sent if full else self.pending,
+            "removed": [] if full else sorted(self.pending_removed),
+        }
+        if digest != self.visible_digest or full:
+            batch["visible"] = visible
+        return batch
+
+    def push(self, batch):
+        body = gzip.compress(json.dumps(batch, separators=(",", ":")).encode("utf-8"), compresslevel=5)
+        response = self.session.post(f"{self.aggregator_url}/agent/push", data=body, timeout=10,
+                                     headers={"Content-Type": "application/json", "Content-Encoding": "gzip"})
+        response.raise_for_status()
+        reply = response.json()
+
+        self.seq = batch["seq"]
+        self.pending = {}
+        self.pending_removed = set()
+        self.force_full = bool(reply.get("resync"))
+        if self.force_full:
+            self.assignment_version = 0  # Have the (possibly restarted) aggregator resend the assignment
+        if "visible" in batch:
+            self.visible_digest = batch["visible_digest"]
+        if "owned" in reply:
+            self.owned = set(reply["owned"])
+            self.assignment_version = reply["assignment_version"]
+        return reply, len(body)
+
+    def run_once(self):
+        visible = self.collect()
+        batch = self.build_batch(visible)
+        try:
+            _, size = self.push(batch)
+            logging.info(f"Pushed {len(batch['samples'])} container updates ({size} bytes) to the aggregator")
+        except Exception as e:
+            # Changes stay in `pending`, coalesced per container, until a push succeeds
+            logging.error(f"Error pushing to aggregator {self.aggregator_url}: {e}")
+
+    def run(self):
+        logging.info(f"Node agent {self.node_name} started, pushing to {self.aggregator_url}")
+        while not self.stop_event.is_set():
+            started = time.time()
+            try:
+                self.run_once()
+            except Exception as e:
+                logging.error(f"Error in agent collection round: {e}")
+            self.stop_event.wait(max(0.0, self.interval - (time.time() - started)))
+
+    def stop(self):
+        self.stop_event.set()
+        self.executor.shutdown(wait=False)
+
+
+class _ClusterCollector:
+    def __init__(self, aggregator):
+        self.aggregator = aggregator
+
+    def collect(self):
+        return self.aggregator.metric_families()
+
+
+class ClusterAggregator:
+    """
+    Merges agent batches into the cluster view and decides which agent collects which
+    container. Agents that stop pushing for `agent_timeout` seconds are dropped and their
+    containers reassigned to the other agents that can see them.
+    """
+
+    def __init__(self, agent_timeout=30, vnodes=64):
+        self.agent_timeout = agent_timeout
+        self.ring = HashRing(vnodes=vnodes)
+        self.lock = threading.Lock()
+
+        self.containers = {}  # short id -> {"node", "name", "service", fields..., "updated"}
+        self.agents = {}  # agent -> {"seq", "last_seen", "visible", "interval"}
+        self.assignments = {}  # agent -> (version, set of short ids)
+        self.assignment_dirty = False
+        self.bytes_received = {}  # agent -> compressed bytes
+        self.batches_received = {}
+
+        self.registry = CollectorRegistry()
+        self.registry.register(_ClusterCollector(self))
+
+    def handle_push(self, body, content_encoding=None):
+        """
+        Apply one agent batch and return the reply for the agent.
+        """
+        raw = gzip.decompress(body) if content_encoding == "gzip" else body
+        batch = json.loads(raw)
+        agent, now = batch["agent"], time.time()
+
+        with self.lock:
+            self._expire(now)
+            known = self.agents.get(agent)
+            expected_seq = known["seq"] + 1 if known else None
+            if not batch["full"] and (known is None or batch["seq"] != expected_seq):
+                # Aggregator restarted or batches were lost: ask for the whole state, visible set included
+                return {"resync": True}
+
+            self._touch(agent, batch, now)
+            if batch["full"]:
+                for short_id in [c for c, entry in self.containers.items() if entry["node"] == agent]:
+                    if short_id not in batch["samples"]:
+                        del self.containers[short_id]
+            for short_id, fields in batch["samples"].items():
+                entry = self.containers.get(short_id)
+                if entry is None:
+                    entry = self.containers[short_id] = {"node": agent, "name": short_id, "service": ""}
+                elif entry["node"] != agent:
+                    # Reassigned container: keep its identity, drop the previous agent's values
+                    entry = self.containers[short_id] = {"node": agent, "name": entry["name"],
+                                                         "service": entry["service"]}
+                entry.update(fields)
+                entry["updated"] = now
+            for short_id in batch.get("removed", []):
+                entry = self.containers.get(short_id)
+                if entry is not None and entry["node"] == agent:
+                    del self.containers[short_id]
+
+            self.bytes_received[agent] = self.bytes_received.get(agent, 0) + len(body)
+            self.batches_received[agent] = self.batches_received.get(agent, 0) + 1
+            return {"resync": False, **self._assignment_reply(agent, batch)}
+
+    def _touch(self, agent, batch, now):
+        entry = self.agents.get(agent)
+        if entry is None:
+            entry = self.agents[agent] = {"seq": 0, "visible": set()}
+            self.ring.add(agent)
+            self.assignment_dirty = True
+        entry["seq"] = batch["seq"]
+        entry["last_seen"] = now
+        entry["interval"] = batch.get("interval")
+        if "visible" in batch:
+            visible = set(batch["visible"])
+            if visible != entry["visible"]:
+                entry["visible"] = visible
+                self.assignment_dirty = True
+
+    def _expire(self, now):
+        for agent in [a for a, entry in self.agents.items() if now - entry["last_seen"] > self.agent_timeout]:
+            logging.warning(f"Agent {agent} stopped reporting; reassigning its containers")
+            del self.agents[agent]
+            self.ring.remove(agent)
+            self.assignments.pop(agent, None)
+            for short_id in [c for c, entry in self.containers.items() if entry["node"] == agent]:
+                del self.containers[short_id]
+            self.assignment_dirty = True
+
+    def _rebalance(self):
+        candidates = {}
+        for agent, entry in self.agents.items():
+            for short_id in entry["visible"]:
+                candidates.setdefault(short_id, set()).add(agent)
+        owned = {agent: set() for agent in self.agents}
+        for short_id, agents in candidates.items():
+            owned[self.ring.owner(short_id, agents)].add(short_id)
+        for agent, containers in owned.items():
+            version, previous = self.assignments.get(agent, (0, None))
+            if containers != previous:
+                self.assignments[agent] = (version + 1, containers)
+        self.assignment_dirty = False
+
+    def _assignment_reply(self, agent, batch):
+        if self.assignment_dirty:
+            self._rebalance()
+        version, containers = self.assignments.get(agent, (0, set()))
+        if batch.get("assignment_version") == version:
+            return {"assignment_version": version}
+        return {"assignment_version": version, "owned": sorted(containers)}
+
+    def expire(self):
+        with self.lock:
+            self._expire(time.time())
+
+    def cluster_view(self):
+        """
+        Per-service totals over every node: container count and summed fields.
+        """
+        with self.lock:
+            self._expire(time.time())
+            services = {}
+            for entry in self.containers.values():
+                service = services.setdefault(entry["service"] or entry["name"], {"containers": 0, "nodes": set()})
+                service["containers"] += 1
+                service["nodes"].add(entry["node"])
+                for field in SAMPLE_FIELDS:
+                    if field in entry:
+                        service[field] = service.get(field, 0) + entry[field]
+        for service in services.values():
+            service["nodes"] = sorted(service["nodes"])
+        return services
+
+    def metric_families(self):
+        with self.lock:
+            containers = list(self.containers.values())
+            agents = {agent: dict(entry) for agent, entry in self.agents.items()}
+            bytes_received = dict(self.bytes_received)
+            batches_received = dict(self.batches_received)
+
+        now = time.time()
+        families = []
+        labels = ["container", "service", "node"]
+        for field, name, documentation in (
+                ("cpu_percent", "cluster_container_cpu_usage_percent", "CPU usage percent reported by node agents"),
+                ("memory_percent", "cluster_container_memory_usage_percent", "Memory usage percent reported by node agents"),
+                ("network_sent", "cluster_container_network_sent_bytes", "Network transmitted bytes per agent interval"),
+                ("network_recv", "cluster_container_network_recv_bytes", "Network received bytes per agent interval"),
+                ("disk_read", "cluster_container_disk_read_bytes", "Disk read bytes per agent interval"),
+                ("disk_write", "cluster_container_disk_write_bytes", "Disk write bytes per agent interval")):
+            family = GaugeMetricFamily(name, documentation, labels=labels)
+            for entry in containers:
+                if field in entry:
+                    family.add_metric([entry["name"], entry["service"], entry["node"]], entry[field])
+            families.append(family)
+
+        age = GaugeMetricFamily("cluster_agent_last_push_age_seconds", "Seconds since each agent last pushed",
+                                labels=["node"])
+        received = CounterMetricFamily("cluster_agent_received_bytes", "Compressed bytes received from each agent",
+                                       labels=["node"])
+        batches = CounterMetricFamily("cluster_agent_batches", "Batches received from each agent", labels=["node"])
+        for agent, entry in agents.items():
+            age.add_metric([agent], now - entry["last_seen"])
+            received.add_metric([agent], bytes_received.get(agent, 0))
+            batches.add_metric([agent], batches_received.get(agent, 0))
+        count = GaugeMetricFamily("cluster_agents", "Node agents currently reporting")
+        count.add_metric([], len(agents))
+        return families + [age, received, batches, count]
+
+    def get_metrics(self):
+        return generate_latest(self.registry).decode("utf-8")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--aggregator", default=os.getenv("AGGREGATOR_URL", "http://python-app-assignment:8000"))
+    parser.add_argument("--node", default=os.getenv("NODE_NAME") or socket.gethostname())
+    parser.add_argument("--docker-url", default=os.getenv("DOCKER_URL", "unix:///var/run/docker.sock"))
+    parser.add_argument("--interval", type=float, default=float(os.getenv("AGENT_INTERVAL", 5)))
+    args = parser.parse_args()
+
+    NodeAgent(args.node, args.aggregator, args.docker_url, args.interval).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,398 @@
+import logging
+import os
+import random
+import time
+import docker
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+# Label written on the nodes that stay active; services are pinned to it with a placement constraint
+ACTIVE_POOL_LABEL = "energy.pool"
+ACTIVE_POOL_VALUE = "active"
+
+DEFAULT_IDLE_WATTS = float(os.getenv('NODE_IDLE_WATTS', 100))
+DEFAULT_MAX_WATTS = float(os.getenv('NODE_MAX_WATTS', 250))
+
+
+def node_power(node, cpu_used):
+    """
+    Estimate the power draw (W) of a node running `cpu_used` cores.
+    Uses the node's `power_curve` [(utilization, watts), ...] if given,
+    otherwise a linear curve between `idle_watts` and `max_watts`.
+    """
+    utilization = min(1.0, cpu_used / node['cpu']) if node['cpu'] > 0 else 0.0
+    curve = node.get('power_curve')
+    if not curve:
+        idle = node.get('idle_watts', DEFAULT_IDLE_WATTS)
+        peak = node.get('max_watts', DEFAULT_MAX_WATTS)
+        return idle + (peak - idle) * utilization
+
+    # Piecewise-linear interpolation over the measured curve
+    if utilization <= curve[0][0]:
+        return curve[0][1]
+    for (u0, w0), (u1, w1) in zip(curve, curve[1:]):
+        if utilization <= u1:
+            return w0 + (w1 - w0) * (utilization - u0) / (u1 - u0)
+    return curve[-1][1]
+
+
+class NodeConsolidationOptimizer:
+    """
+    Packs Swarm service tasks onto as few nodes as possible so the remaining nodes
+    can be drained and powered down.
+
+    services: [{"name", "cpu" (cores per task), "memory" (MB per task), "replicas", "max_per_node"?}]
+    nodes:    [{"name", "cpu" (cores), "memory" (MB), "idle_watts", "max_watts", "power_curve"?, "off_watts"?}]
+    """
+
+    def __init__(self, services, nodes, headroom=0.1, max_search_passes=3):
+        self.services = services
+        self.nodes = nodes
+        self.headroom = headroom  # Fraction of each node kept free for bursts
+        self.max_search_passes = max_search_passes
+
+    def _expand_tasks(self):
+        tasks = []
+        for service_index, service in enumerate(self.services):
+            for _ in range(int(service.get('replicas', 1))):
+                tasks.append(service_index)
+        return tasks
+
+    def _node_order(self):
+        # Prefer nodes with the lowest watts per core at full load, then the largest nodes
+        def efficiency(index):
+            node = self.nodes[index]
+            return (node_power(node, node['cpu']) / max(node['cpu'], 1e-9), -node['cpu'])
+        return sorted(range(len(self.nodes)), key=efficiency)
+
+    def optimize(self, current_placement=None):
+        """
+        Run first-fit-decreasing followed by a node-emptying local search.
+        current_placement: optional {node_name: {service_name: task_count}} used for the baseline power.
+        Returns a plan dictionary (see _build_plan).
+        """
+        start_time = time.time()
+        services = self.services
+        nodes = self.nodes
+        scale = 1.0 - self.headroom
+
+        free_cpu = [node['cpu'] * scale for node in nodes]
+        free_mem = [node['memory'] * scale for node in nodes]
+        counts = [dict() for _ in nodes]  # service_index -> tasks on this node
+        order = self._node_order()
+        opened = []  # node indexes in the order they were opened
+        is_open = [False] * len(nodes)
+
+        total_cpu = sum(node['cpu'] for node in nodes) or 1
+        total_mem = sum(node['memory'] for node in nodes) or 1
+
+        def task_size(service_index):
+            service = services[service_index]
+            return max(service['cpu'] / total_cpu, service['memory'] / total_mem)
+
+        tasks = self._expand_tasks()
+        tasks.sort(key=task_size, reverse=True)
+
+        unplaced = []
+        # Identical replicas never fit an earlier node than the previous replica did,
+        # so remember where the last replica of each service landed.
+        start_hint = {}
+        for service_index in tasks:
+            service = services[service_index]
+            cpu, mem = service['cpu'], service['memory']
+            max_per_node = service.get('max_per_node')
+            placed = False
+
+            for position in range(start_hint.get(service_index, 0), len(opened)):
+                node_index = opened[position]
+                if free_cpu[node_index] >= cpu and free_mem[node_index] >= mem and \
+                        (max_per_node is None or counts[node_index].get(service_index, 0) < max_per_node):
+                    placed = True
+                    start_hint[service_index] = position
+                    break
+
+            if not placed:
+                # Open the next most efficient node that can hold the task
+                for node_index in order:
+                    if is_open[node_index]:
+                        continue
+                    if free_cpu[node_index] >= cpu and free_mem[node_index] >= mem:
+                        opened.append(node_index)
+                        is_open[node_index] = True
+                        start_hint[service_index] = len(opened) - 1
+                        placed = True
+                        break
+
+            if not placed:
+                unplaced.append(service['name'])
+                continue
+
+            free_cpu[node_index] -= cpu
+            free_mem[node_index] -= mem
+            counts[node_index][service_index] = counts[node_index].get(service_index, 0) + 1
+
+        self._local_search(opened, free_cpu, free_mem, counts)
+
+        plan = self._build_plan(counts, unplaced, current_placement)
+        plan['solve_seconds'] = round(time.time() - start_time, 4)
+        logging.info(f"Consolidation plan: {len(plan['active_nodes'])}/{len(nodes)} nodes active, "
+                     f"{len(plan['drain_nodes'])} to drain, projected savings {plan['savings_watts']:.1f} W "
+                     f"(solved in {plan['solve_seconds']}s)")
+        return plan
+
+    def _local_search(self, opened, free_cpu, free_mem, counts):
+        """
+        Try to empty the least loaded active nodes by moving their tasks onto the
+        other active nodes (best fit). A move is only committed if the node empties completely.
+        """
+        services = self.services
+        nodes = self.nodes
+
+        for _ in range(self.max_search_passes):
+            improved = False
+            active = [index for index in opened if counts[index]]
+            active.sort(key=lambda index: nodes[index]['cpu'] - free_cpu[index])
+
+            for victim in active:
+                if not counts[victim]:
+                    continue
+                targets = [index for index in active if index != victim and counts[index]]
+                # Only the nodes touched by this attempt are copied
+                trial_cpu = {}
+                trial_mem = {}
+                trial_counts = {}
+                feasible = True
+
+                for service_index, task_count in sorted(counts[victim].items(),
+                                                        key=lambda item: services[item[0]]['cpu'], reverse=True):
+                    service = services[service_index]
+                    cpu, mem = service['cpu'], service['memory']
+                    max_per_node = service.get('max_per_node')
+                    for _ in range(task_count):
+                        best = None
+                        best_cpu = None
+                        for index in targets:
+                            index_cpu = trial_cpu.get(index, free_cpu[index])
+                            if index_cpu < cpu or trial_mem.get(index, free_mem[index]) < mem:
+                                continue
+                            if max_per_node is not None and \
+                                    trial_counts.get(index, counts[index]).get(service_index, 0) >= max_per_node:
+                                continue
+                            if best is None or index_cpu < best_cpu:
+                                best, best_cpu = index, index_cpu
+                        if best is None:
+                            feasible = False
+                            break
+                        if best not in trial_counts:
+                            trial_counts[best] = dict(counts[best])
+                        trial_cpu[best] = best_cpu - cpu
+                        trial_mem[best] = trial_mem.get(best, free_mem[best]) - mem
+                        trial_counts[best][service_index] = trial_counts[best].get(service_index, 0) + 1
+                    if not feasible:
+                        break
+
+                if not feasible:
+                    continue
+
+                # Commit: the victim node is now empty
+                for index, node_counts in trial_counts.items():
+                    free_cpu[index] = trial_cpu[index]
+                    free_mem[index] = trial_mem[index]
+                    counts[index] = node_counts
+                free_cpu[victim] = nodes[victim]['cpu'] * (1.0 - self.headroom)
+                free_mem[victim] = nodes[victim]['memory'] * (1.0 - self.headroom)
+                counts[victim] = {}
+                improved = True
+
+            if not improved:
+                break
+
+    def _baseline_power(self, current_placement):
+        services_by_name = {service['name']: service for service in self.services}
+        if current_placement:
+            total = 0.0
+            for node in self.nodes:
+                placed = current_placement.get(node['name'], {})
+                cpu_used = sum(services_by_name[name]['cpu'] * count
+                               for name, count in placed.items() if name in services_by_name)
+                total += node_power(node, cpu_used)
+            return total
+
+        # Without a known placement assume Swarm's default spread: every node on, load shared evenly
+        total_cpu = sum(node['cpu'] for node in self.nodes) or 1
+        demand = sum(service['cpu'] * int(service.get('replicas', 1)) for service in self.services)
+        return sum(node_power(node, demand * node['cpu'] / total_cpu) for node in self.nodes)
+
+    def _build_plan(self, counts, unplaced, current_placement):
+        services = self.services
+        assignments = {}
+        active_nodes = []
+        drain_nodes = []
+        projected_watts = 0.0
+
+        for node_index, node in enumerate(self.nodes):
+            if counts[node_index]:
+                cpu_used = sum(services[s]['cpu'] * c for s, c in counts[node_index].items())
+                projected_watts += node_power(node, cpu_used)
+                active_nodes.append(node['name'])
+                assignments[node['name']] = {services[s]['name']: c for s, c in counts[node_index].items()}
+            else:
+                projected_watts += node.get('off_watts', 0.0)
+                drain_nodes.append(node['name'])
+
+        baseline_watts = self._baseline_power(current_placement)
+
+        actions = []
+        for name in active_nodes:
+            # Nodes drained by an earlier plan are put back in service
+            actions.append({"action": "label", "node": name,
+                            "command": f"docker node update --availability active "
+                                       f"--label-add {ACTIVE_POOL_LABEL}={ACTIVE_POOL_VALUE} {name}"})
+        for name in drain_nodes:
+            actions.append({"action": "drain", "node": name,
+                            "command": f"docker node update --availability drain {name}"})
+
+        return {
+            "assignments": assignments,
+            "active_nodes": active_nodes,
+            "drain_nodes": drain_nodes,
+            "unplaced": unplaced,
+            "constraints": [f"node.labels.{ACTIVE_POOL_LABEL} == {ACTIVE_POOL_VALUE}"],
+            "actions": actions,
+            "baseline_watts": round(baseline_watts, 2),
+            "projected_watts": round(projected_watts, 2),
+            "savings_watts": round(baseline_watts - projected_watts, 2),
+        }
+
+
+def collect_cluster(client):
+    """
+    Build the optimizer input from a Swarm manager.
+    Task demand comes from the service resource reservations (falling back to limits),
+    node capacity from the node description. Power figures can be set per node with the
+    `energy.idle_watts` / `energy.max_watts` node labels.
+    """
+    nodes = []
+    for node in client.nodes.list():
+        description = node.attrs.get('Description', {})
+        resources = description.get('Resources', {})
+        labels = node.attrs.get('Spec', {}).get('Labels', {}) or {}
+        nodes.append({
+            "name": description.get('Hostname', node.id),
+            "id": node.id,
+            "cpu": resources.get('NanoCPUs', 0) / 1e9,
+            "memory": resources.get('MemoryBytes', 0) / (1024 ** 2),
+            "idle_watts": float(labels.get('energy.idle_watts', DEFAULT_IDLE_WATTS)),
+            "max_watts": float(labels.get('energy.max_watts', DEFAULT_MAX_WATTS)),
+        })
+
+    services = []
+    for service in client.services.list():
+        spec = service.attrs['Spec']
+        resources = spec.get('TaskTemplate', {}).get('Resources', {})
+        demand = resources.get('Reservations') or resources.get('Limits') or {}
+        replicated = spec.get('Mode', {}).get('Replicated')
+        if replicated is None:
+            continue  # Global services run on every active node anyway
+        placement = spec.get('TaskTemplate', {}).get('Placement', {})
+        services.append({
+            "name": service.name,
+            "cpu": demand.get('NanoCPUs', 0) / 1e9 or 0.1,
+            "memory": demand.get('MemoryBytes', 0) / (1024 ** 2) or 64,
+            "replicas": replicated.get('Replicas', 1),
+            "max_per_node": placement.get('MaxReplicas') or None,
+        })
+
+    return services, nodes
+
+
+def apply_plan(client, plan, dry_run=True):
+    """
+    Label the active nodes (making any drained one available again) and drain the rest.
+    With dry_run the actions are only logged.
+    Services still need the plan's placement constraint to stay on the active pool.
+    """
+    results = []
+    nodes_by_name = {}
+    for node in client.nodes.list():
+        nodes_by_name[node.attrs.get('Description', {}).get('Hostname', node.id)] = node
+
+    for action in plan['actions']:
+        node = nodes_by_name.get(action['node'])
+        if node is None:
+            results.append({"node": action['node'], "status": "error", "message": "Node not found"})
+            continue
+        if dry_run:
+            logging.info(f"[dry-run] {action['command']}")
+            results.append({"node": action['node'], "status": "dry-run", "command": action['command']})
+            continue
+        try:
+            spec = dict(node.attrs['Spec'])
+            if action['action'] == "drain":
+                spec['Availability'] = "drain"
+            else:
+                spec['Availability'] = "active"
+                labels = dict(spec.get('Labels') or {})
+                labels[ACTIVE_POOL_LABEL] = ACTIVE_POOL_VALUE
+                spec['Labels'] = labels
+            node.update(spec)
+            results.append({"node": action['node'], "status": "success", "action": action['action']})
+        except docker.errors.APIError as e:
+            logging.error(f"Failed to {action['action']} node {action['node']}: {e}")
+            results.append({"node": action['node'], "status": "error", "message": str(e)})
+    return results
+
+
+def synthetic_cluster(num_nodes=50, num_services=200, max_replicas=10, target_utilization=0.35, seed=0):
+    """
+    Generate a random but reproducible cluster for testing and benchmarking the optimizer.
+    Task CPU demand is scaled so the whole cluster runs at `target_utilization`.
+    Returns (services, nodes, current_placement) where the placement spreads replicas round-robin.
+    """
+    rng = random.Random(seed)
+    node_shapes = [(4, 8192, 60, 150), (8, 16384, 90, 250), (16, 65536, 140, 400)]
+    nodes = []
+    for index in range(num_nodes):
+        cpu, memory, idle, peak = rng.choice(node_shapes)
+        nodes.append({"name": f"node-{index}", "cpu": cpu, "memory": memory,
+                      "idle_watts": idle, "max_watts": peak})
+
+    services = []
+    for index in range(num_services):
+        services.append({
+            "name": f"service-{index}",
+            "cpu": rng.uniform(0.05, 1.5),
+            "memory": rng.choice([64, 128, 256, 512, 1024]),
+            "replicas": rng.randint(1, max_replicas),
+        })
+
+    capacity = sum(node['cpu'] for node in nodes)
+    demand = sum(service['cpu'] * service['replicas'] for service in services)
+    factor = target_utilization * capacity / demand if demand else 1.0
+    for service in services:
+        service['cpu'] = round(max(0.01, service['cpu'] * factor), 3)
+
+    current_placement = {node['name']: {} for node in nodes}
+    position = 0
+    for service in services:
+        for _ in range(service['replicas']):
+            node_name = nodes[position % num_nodes]['name']
+            current_placement[node_name][service['name']] = current_placement[node_name].get(service['name'], 0) + 1
+            position += 1
+
+    return services, nodes, current_placement
+
+
+def main():
+    services, nodes, current_placement = synthetic_cluster(num_nodes=200, num_services=600)
+    tasks = sum(service['replicas'] for service in services)
+    plan = NodeConsolidationOptimizer(services, nodes).optimize(current_placement)
+    print(f"{tasks} tasks on {len(nodes)} nodes -> {len(plan['active_nodes'])} active, "
+          f"{len(plan['drain_nodes'])} drained, {len(plan['unplaced'])} unplaced")
+    print(f"Baseline {plan['baseline_watts']} W, projected {plan['projected_watts']} W, "
+          f"savings {plan['savings_watts']} W, solved in {plan['solve_seconds']}s")
+
+
+if __name__ == "__main__":
+    main()
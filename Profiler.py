@@ -0,0 +1,283 @@
+import hmac
+import io
+import logging
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+DEFAULT_INTERVAL = 0.005  # 200 samples per second
+MAX_SECONDS = float(os.getenv('PROFILING_MAX_SECONDS', 60))
+
+
+class ProfilerBusy(Exception):
+    """
+    Another profile is already running; reported as 409.
+    """
+
+
+class ProfilingError(Exception):
+    """
+    Invalid profiling parameters; reported as 400.
+    """
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of every thread with sys._current_frames() from one background
+    thread, so the waitress workers and the collector threads all show up, and nothing
+    is hooked into the interpreter. Each sample is weighted by the wall time since the
+    previous one.
+    """
+
+    def __init__(self, interval=DEFAULT_INTERVAL, exclude=()):
+        self.interval = interval
+        self.exclude = set(exclude)
+        self.stacks = {}  # (thread name, code objects from outermost to leaf) -> seconds
+        self.counts = {}  # same key -> number of samples
+        self.samples = 0
+        self.elapsed = 0.0
+        self._thread_names = {}
+        self._labels = {}
+
+    def run(self, duration):
+        stop = threading.Event()
+        sampler = threading.Thread(target=self._sample, args=(stop,), name="profiler-sampler", daemon=True)
+        self.exclude.add(threading.get_ident())  # The waiting request thread
+        started = time.perf_counter()
+        sampler.start()
+        stop.wait(duration)
+        stop.set()
+        sampler.join()
+        self.elapsed = time.perf_counter() - started
+        return self
+
+    def _sample(self, stop):
+        own = threading.get_ident()
+        previous = time.perf_counter()
+        while not stop.wait(self.interval):
+            now = time.perf_counter()
+            weight, previous = now - previous, now
+            for ident, frame in sys._current_frames().items():
+                if ident == own or ident in self.exclude:
+                    continue
+                codes = []
+                while frame is not None:
+                    codes.append(frame.f_code)
+                    frame = frame.f_back
+                codes.reverse()
+                key = (self._thread_name(ident), tuple(codes))
+                self.stacks[key] = self.stacks.get(key, 0.0) + weight
+                self.counts[key] = self.counts.get(key, 0) + 1
+            self.samples += 1
+
+    def _thread_name(self, ident):
+        name = self._thread_names.get(ident)
+        if name is None:
+            self._thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+            name = self._thread_names.setdefault(ident, f"thread-{ident}")
+        return name
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})"
+        return label
+
+    def collapsed(self):
+        """
+        Brendan Gregg's collapsed format, one 'thread;outer;...;leaf weight' line per stack,
+        with weights in milliseconds; feed it to flamegraph.pl or speedscope.
+        """
+        lines = []
+        for (thread_name, codes), seconds in sorted(self.stacks.items(), key=lambda item: -item[1]):
+            frames = ";".join(self._label(code) for code in codes)
+            lines.append(f"{thread_name};{frames} {max(1, round(seconds * 1000))}")
+        return "\n".join(lines) + "\n"
+
+    def pstats_data(self):
+        """
+        Build the dictionary pstats.Stats loads: tottime is time as the leaf frame, cumtime is
+        time anywhere on the stack, and call counts are sample counts.
+        """
+        stats = {}
+
+        def add(entry, samples, seconds, leaf):
+            cc, nc, tt, ct = entry
+            return cc + samples, nc + samples, tt + (seconds if leaf else 0.0), ct + seconds
+
+        for key, seconds in self.stacks.items():
+            codes, samples = key[1], self.counts[key]
+            functions = [(code.co_filename, code.co_firstlineno, code.co_name) for code in codes]
+            seen, edges = set(), set()
+            for depth, function in enumerate(functions):
+                leaf = depth == len(functions) - 1
+                cc, nc, tt, ct, callers = stats.get(function, (0, 0, 0.0, 0.0, {}))
+                if function not in seen:  # Recursion counts once towards cumtime
+                    seen.add(function)
+                    cc, nc, tt, ct = add((cc, nc, tt, ct), samples, seconds, leaf)
+                elif leaf:
+                    tt += seconds
+                if depth:
+                    edge = (functions[depth - 1], function)
+                    if edge not in edges:
+                        edges.add(edge)
+                        callers[edge[0]] = add(callers.get(edge[0], (0, 0, 0.0, 0.0)), samples, seconds, leaf)
+                stats[function] = (cc, nc, tt, ct, callers)
+        return stats
+
+    def pstats_dump(self):
+        """
+        Bytes in the format written by cProfile's dump_stats(), loadable with pstats.Stats(path).
+        """
+        return marshal.dumps(self.pstats_data())
+
+    def pstats_text(self, sort="cumulative", limit=50):
+        stats = pstats.Stats(_StatsSource(self.pstats_data()), stream=io.StringIO())
+        stats.sort_stats(sort).print_stats(limit)
+        return stats.stream.getvalue()
+
+
+class _StatsSource:
+    """
+    Lets pstats.Stats load an in-memory stats dictionary through its create_stats() protocol.
+    """
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+def allocation_profile(duration, limit=25, nframe=1, diff=False):
+    """
+    Trace allocations for `duration` seconds and report the top allocation sites of
+    memory still held at the end (or, with diff, growth against the starting snapshot).
+    Tracing is stopped afterwards unless it was already on.
+    """
+    was_tracing = tracemalloc.is_tracing()
+    if not was_tracing:
+        tracemalloc.start(nframe)
+    try:
+        key_type = "traceback" if nframe > 1 else "lineno"
+        filters = [tracemalloc.Filter(False, tracemalloc.__file__)]
+        before = tracemalloc.take_snapshot().filter_traces(filters)
+        time.sleep(duration)
+        after = tracemalloc.take_snapshot().filter_traces(filters)
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        if not was_tracing:
+            tracemalloc.stop()
+
+    lines = [f"# traced memory: current={current / 1024:.1f} KiB peak={peak / 1024:.1f} KiB "
+             f"window={duration:g}s mode={'diff' if diff else 'top'}"]
+    stats = after.compare_to(before, key_type) if diff else after.statistics(key_type)
+    for stat in stats[:limit]:
+        lines.append(str(stat))
+        if nframe > 1:
+            lines.extend(f"    {line}" for line in stat.traceback.format())
+    return "\n".join(lines) + "\n"
+
+
+def _number(params, name, default, cast, minimum, maximum):
+    try:
+        value = cast(params.get(name, default))
+    except (TypeError, ValueError):
+        raise ProfilingError(f"{name} must be a number")
+    if not minimum <= value <= maximum:
+        raise ProfilingError(f"{name} must be between {minimum} and {maximum}")
+    return value
+
+
+class ProfilingController:
+    """
+    Admin-gated entry point shared by the Flask app and the WebOb app. Set
+    PROFILING_ADMIN_TOKEN to enable it and send the token in the X-Admin-Token header.
+    Only one profile runs at a time; nothing runs between requests.
+    """
+
+    def __init__(self, admin_token=None):
+        self.admin_token = admin_token if admin_token is not None else os.getenv('PROFILING_ADMIN_TOKEN', '')
+        self.lock = threading.Lock()
+
+    def authorize(self, headers):
+        """
+        Return None if the request may profile, else an error response tuple.
+        """
+        if not self.admin_token:
+            return 404, "text/plain", b"Profiling is disabled\n", {}
+        supplied = headers.get('X-Admin-Token', '')
+        if not supplied:
+            return 401, "text/plain", b"X-Admin-Token header required\n", {}
+        if not hmac.compare_digest(supplied.encode('utf-8'), self.admin_token.encode('utf-8')):
+            return 403, "text/plain", b"Invalid admin token\n", {}
+        return None
+
+    def handle(self, kind, params, headers):
+        """
+        Serve /debug/profile/<kind>. Returns (status, content type, body bytes, extra headers).
+        cpu:    seconds=10 interval=0.005 format=collapsed|pstats|text
+        memory: seconds=10 limit=25 frames=1 mode=top|diff
+        """
+        denied = self.authorize(headers)
+        if denied:
+            return denied
+        try:
+            if kind == "cpu":
+                return self._cpu(params)
+            if kind == "memory":
+                return self._memory(params)
+            return 404, "text/plain", f"Unknown profile: {kind}\n".encode('utf-8'), {}
+        except ProfilingError as e:
+            return 400, "text/plain", f"{e}\n".encode('utf-8'), {}
+        except ProfilerBusy as e:
+            return 409, "text/plain", f"{e}\n".encode('utf-8'), {}
+
+    def _run_exclusive(self, description, profile):
+        if not self.lock.acquire(blocking=False):
+            raise ProfilerBusy("A profile is already running")
+        try:
+            logging.info(f"Profiling started: {description}")
+            return profile()
+        finally:
+            self.lock.release()
+            logging.info(f"Profiling finished: {description}")
+
+    def _cpu(self, params):
+        seconds = _number(params, 'seconds', 10, float, 0.1, MAX_SECONDS)
+        interval = _number(params, 'interval', DEFAULT_INTERVAL, float, 0.001, 1.0)
+        output = params.get('format', 'collapsed')
+        if output not in ("collapsed", "pstats", "text"):
+            raise ProfilingError("format must be collapsed, pstats or text")
+
+        profiler = self._run_exclusive(f"cpu {seconds:g}s",
+                                       lambda: SamplingProfiler(interval).run(seconds))
+        headers = {"X-Profile-Samples": str(profiler.samples)}
+        if output == "pstats":
+            headers["Content-Disposition"] = 'attachment; filename="profile.pstats"'
+            return 200, "application/octet-stream", profiler.pstats_dump(), headers
+        body = profiler.collapsed() if output == "collapsed" else profiler.pstats_text()
+        return 200, "text/plain", body.encode('utf-8'), headers
+
+    def _memory(self, params):
+        seconds = _number(params, 'seconds', 10, float, 0.1, MAX_SECONDS)
+        limit = _number(params, 'limit', 25, int, 1, 500)
+        frames = _number(params, 'frames', 1, int, 1, 50)
+        mode = params.get('mode', 'top')
+        if mode not in ("top", "diff"):
+            raise ProfilingError("mode must be top or diff")
+
+        body = self._run_exclusive(f"memory {seconds:g}s",
+                                   lambda: allocation_profile(seconds, limit, frames, mode == "diff"))
+        return 200, "text/plain", body.encode('utf-8'), {}
+
+
+# Shared controller so the Flask and WebOb apps in one process never profile concurrently
+profiling = ProfilingController()
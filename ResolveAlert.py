@@ -1,25 +1,41 @@
 import psutil  # Library to collect system metrics
 import subprocess
-import docker
 import logging
 import os
 from docker.errors import DockerException
+from DockerMetrics import connect_docker, update_docker_service
+from Deadline import backend_guard
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
 class ResolveAlert:
-    def __init__(self, docker_url=os.getenv('DOCKER_URL', 'tcp://localhost:2375'), registry=None):
-        self.client = docker.DockerClient(base_url=docker_url)
-        # Connect to Docker daemon
-        try:
-            self.client = docker.DockerClient(base_url=docker_url)
-            logging.info("Connected to Docker daemon at %s", docker_url)
-        except Exception as e:
-            logging.error("Failed to connect to Docker daemon: %s", e)
-            raise
+    def __init__(self, docker_url=os.getenv('DOCKER_URL', 'tcp://localhost:2375'), registry=None, client_factory=None):
+        # The Docker daemon is only contacted when an alert is handled
+        self.docker_url = docker_url
+        self.client_factory = client_factory
+        self._client = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = connect_docker(self.docker_url, self.client_factory)
+        return self._client
 
 
+    def get_service(self, service_name):
+        """
+        services.get() under the docker circuit breaker; raises rather than hanging on a stuck daemon.
+        """
+        return backend_guard.call("docker", f"get {service_name}", lambda timeout: self.client.services.get(service_name),
+                                  in_thread=True, fallback=False)
+
+    def update_service(self, service, **changes):
+        """
+        See update_docker_service: a timed-out update is checked against the service version.
+        """
+        return update_docker_service(service, **changes)
+
     # Helper function to get a process by name
     def get_process_by_name(self, app_name):
         for process in psutil.process_iter(attrs=['pid', 'name']):
@@ -33,7 +49,7 @@ class ResolveAlert:
         """
         print(f"Handling high CPU usage for service: {service_name}")
         try:
-            service = self.client.services.get(service_name)
+            service = self.get_service(service_name)
             spec = service.attrs['Spec']
 
             if 'TaskTemplate' in spec:
@@ -44,7 +60,7 @@ class ResolveAlert:
                 resources['Limits']['NanoCPUs'] = int(float(cpu_limit) * 1e9)
 
                 # Update the service
-                service.update(task_template={"Resources": resources})
+                self.update_service(service, task_template={"Resources": resources})
                 logging.info(f"Updated CPU limit for service {service_name} to {cpu_limit} CPUs")
                 print(f"CPU usage limited for service {service_name} to {cpu_limit} CPUs.")
 
@@ -63,7 +79,7 @@ class ResolveAlert:
         """
         print(f"Handling high memory usage for service: {service_name}")
         try:
-            service = self.client.services.get(service_name)
+            service = self.get_service(service_name)
             spec = service.attrs['Spec']
 
             if 'TaskTemplate' in spec:
@@ -74,7 +90,7 @@ class ResolveAlert:
                 resources['Limits']['MemoryBytes'] = self.convert_to_bytes(mem_limit)
 
                 # Update the service
-                service.update(task_template={"Resources": resources})
+                self.update_service(service, task_template={"Resources": resources})
                 logging.info(f"Updated memory limit for service {service_name} to {mem_limit}")
                 print(f"Memory limit for service {service_name} updated to {mem_limit}.")
 
@@ -87,7 +103,8 @@ class ResolveAlert:
             logging.error(f"Error updating memory for service {service_name}: {e}")
             return {"status": "error", "message": str(e)}
 
-    def convert_to_bytes(self, mem_limit):
+    @staticmethod
+    def convert_to_bytes(mem_limit):
         """
         Convert memory limit (e.g., '128M', '1G') to bytes.
         """
@@ -0,0 +1,442 @@
+"""
+Raw sample recorder and deterministic replay.
+
+SampleRecorder appends the raw Docker stats frames and psutil readings the collectors
+consume to a compressed, append-only log. ReplayEngine feeds such a log back through
+the collectors, the energy models and the status recommendations, faster than real
+time, so incidents can be reproduced and models compared on identical input.
+
+Log format: a 6-byte magic header, then blocks of `>II` (compressed length, CRC32)
+followed by a zlib-compressed batch of JSON lines `[timestamp, kind, key, data]`.
+A block cut short by a crash is detected and ignored on read, and cut off the log when
+a recorder reopens it, so blocks appended after a crash are readable again.
+
+    python SampleRecorder.py info samples.log
+    python SampleRecorder.py replay samples.log --model custom_app --model node_linear --speed 0
+"""
+import argparse
+import contextlib
+import importlib
+import json
+import logging
+import os
+import queue
+import re
+import struct
+import sys
+import threading
+import time
+import zlib
+
+from NodeConsolidation import DEFAULT_IDLE_WATTS, DEFAULT_MAX_WATTS
+from SelfMetrics import PipelineMetrics, pipeline_metrics
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+MAGIC = b"SREC1\n"
+BLOCK_HEADER = struct.Struct(">II")
+
+# Record kinds and the collector entry point each one is replayed through
+KINDS = ("docker_service", "docker_container", "psutil")
+
+
+class SampleRecorder:
+    """
+    Appends (timestamp, kind, key, data) records to `path`. record() only enqueues the
+    record; a writer thread serializes and compresses it in blocks of `block_records`,
+    or every `flush_interval` seconds, so the collector paths pay a queue put per sample.
+    When the queue is full the record is dropped and counted in the pipeline self-metrics.
+    The data dicts must not be mutated after they are recorded.
+    """
+
+    def __init__(self, path, block_records=256, flush_interval=1.0, level=6, max_queue=10000, self_metrics=None):
+        self.path = path
+        self.block_records = block_records
+        self.flush_interval = flush_interval
+        self.level = level
+        self.self_metrics = self_metrics or pipeline_metrics
+
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.records = 0
+        self.bytes_written = 0
+        self._flushed = threading.Condition()
+        self._pending_flush = 0
+        self._closed = False
+
+        self.file = open(path, "r+b" if os.path.exists(path) else "w+b")
+        end = _valid_length(self.file, path)
+        if end == 0:
+            self.file.seek(0)
+            self.file.write(MAGIC)
+            end = len(MAGIC)
+        elif end < os.fstat(self.file.fileno()).st_size:
+            logging.warning(f"{path}: cutting off a torn block at offset {end} left by an interrupted recorder")
+        self.file.seek(end)
+        self.file.truncate()
+        self.file.flush()
+        self.self_metrics.register_queue("sample_recorder_queue", self.queue.qsize)
+        self.writer = threading.Thread(target=self._write_loop, name="sample-recorder", daemon=True)
+        self.writer.start()
+        logging.info(f"Recording raw samples to {path}")
+
+    @classmethod
+    def from_env(cls):
+        """
+        A recorder writing to SAMPLE_RECORD_PATH, or None when recording is not enabled.
+        """
+        path = os.getenv('SAMPLE_RECORD_PATH')
+        if not path:
+            return None
+        return cls(path, block_records=int(os.getenv('SAMPLE_RECORD_BLOCK', 256)),
+                   flush_interval=float(os.getenv('SAMPLE_RECORD_FLUSH_INTERVAL', 1.0)))
+
+    def record(self, kind, key, data, timestamp=None):
+        try:
+            self.queue.put_nowait((timestamp or time.time(), kind, key, data))
+        except queue.Full:
+            self.self_metrics.drop("sample_recorder", "queue_full")
+
+    def flush(self, timeout=5):
+        """
+        Write everything recorded so far and wait until it is on disk (or `timeout` passes).
+        """
+        with self._flushed:
+            self._pending_flush += 1
+            self.queue.put(None)
+            self._flushed.wait_for(lambda: self._pending_flush == 0 or self._closed, timeout)
+
+    def close(self):
+        self.flush()
+        self._closed = True
+        self.queue.put(None)
+        self.writer.join(5)
+        self.file.close()
+
+    def _write_block(self, batch):
+        payload = "\n".join(json.dumps(record, separators=(",", ":")) for record in batch).encode("utf-8")
+        block = zlib.compress(payload, self.level)
+        self.file.write(BLOCK_HEADER.pack(len(block), zlib.crc32(block)) + block)
+        self.file.flush()
+        self.records += len(batch)
+        self.bytes_written += BLOCK_HEADER.size + len(block)
+
+    def _write_loop(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while not self._closed:
+            try:
+                item = self.queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                item = None
+            if item is not None:
+                batch.append(item)
+                if len(batch) < self.block_records:
+                    continue
+            # Block full, flush interval elapsed or flush() requested
+            if batch:
+                try:
+                    self._write_block(batch)
+                except (OSError, TypeError, ValueError) as e:
+                    logging.error(f"Error writing sample block: {e}")
+                    self.self_metrics.drop("sample_recorder", "write_error", len(batch))
+                batch = []
+            deadline = time.monotonic() + self.flush_interval
+            if item is None:
+                with self._flushed:
+                    if self._pending_flush:
+                        self._pending_flush = 0
+                        self._flushed.notify_all()
+
+
+def _blocks(f, path):
+    """
+    Yield (end offset, block) for each intact block after the magic header, stopping at
+    the first truncated or corrupt one.
+    """
+    while True:
+        header = f.read(BLOCK_HEADER.size)
+        if not header:
+            return
+        if len(header) < BLOCK_HEADER.size:
+            logging.warning(f"{path}: ignoring truncated block header at the end of the log")
+            return
+        length, crc = BLOCK_HEADER.unpack(header)
+        block = f.read(length)
+        if len(block) < length or zlib.crc32(block) != crc:
+            logging.warning(f"{path}: ignoring a truncated or corrupt block at offset {f.tell() - len(block)}")
+            return
+        yield f.tell(), block
+
+
+def _valid_length(f, path):
+    """
+    Bytes of `f` up to the end of its last intact block (0 for an empty file or a torn
+    magic header).
+    """
+    f.seek(0)
+    magic = f.read(len(MAGIC))
+    if len(magic) < len(MAGIC) and MAGIC.startswith(magic):
+        return 0
+    if magic != MAGIC:
+        raise ValueError(f"{path} is not a sample log")
+    end = len(MAGIC)
+    for end, _ in _blocks(f, path):
+        pass
+    return end
+
+
+def read_records(path):
+    """
+    Yield the (timestamp, kind, key, data) records of a sample log in write order.
+    """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a sample log")
+        for _, block in _blocks(f, path):
+            for line in zlib.decompress(block).split(b"\n"):
+                timestamp, kind, key, data = json.loads(line)
+                yield timestamp, kind, key, data
+
+
+def _frame_cpu(stats):
+    """
+    (CPU cores in use, CPU count) of a Docker stats frame.
+    """
+    cpu_stats = stats.get("cpu_stats", {})
+    precpu_stats = stats.get("precpu_stats", {})
+    num_cpus = len(cpu_stats.get("cpu_usage", {}).get("percpu_usage") or []) or cpu_stats.get("online_cpus", 1)
+    system_delta = cpu_stats.get("system_cpu_usage", 0) - precpu_stats.get("system_cpu_usage", 0)
+    if system_delta <= 0:
+        return 0.0, num_cpus
+    cpu_delta = cpu_stats.get("cpu_usage", {}).get("total_usage", 0) - \
+        precpu_stats.get("cpu_usage", {}).get("total_usage", 0)
+    return cpu_delta / system_delta * num_cpus, num_cpus
+
+
+def custom_app_power(stats):
+    """
+    CustomAppMetrics' model: 0.5 W per CPU percent and 0.3 W per GB of memory.
+    """
+    cores, _ = _frame_cpu(stats)
+    memory_gb = stats.get("memory_stats", {}).get("usage", 0) / 1024 ** 3
+    return cores * 100 * 0.5 + memory_gb * 0.3
+
+
+def node_linear_power(stats):
+    """
+    The container's share of the dynamic part of NodeConsolidation's linear node curve.
+    """
+    cores, num_cpus = _frame_cpu(stats)
+    return (DEFAULT_MAX_WATTS - DEFAULT_IDLE_WATTS) * min(1.0, cores / num_cpus)
+
+
+# Energy models compared by the replay: name -> function(stats frame) -> watts
+ENERGY_MODELS = {"custom_app": custom_app_power, "node_linear": node_linear_power}
+
+
+def load_energy_model(spec):
+    """
+    An energy model by name, or any function given as `module:function`.
+    """
+    if spec in ENERGY_MODELS:
+        return ENERGY_MODELS[spec]
+    module_name, separator, function_name = spec.partition(":")
+    if not separator:
+        raise ValueError(f"Unknown energy model: {spec}")
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+class _OfflineDockerClient:
+    """
+    Replay never talks to a Docker daemon; any attempt to do so is a bug.
+    """
+
+    def __getattr__(self, name):
+        raise RuntimeError(f"Docker client used during replay ({name})")
+
+
+class ReplayEngine:
+    """
+    Feeds recorded samples through fresh collectors (each with its own registries), the
+    energy models and the status recommendations. `speed` 0 replays as fast as possible,
+    otherwise at `speed` times the recorded pace. Given the same log and options the
+    resulting gauges, energy totals and recommendation timeline are identical.
+    """
+
+    def __init__(self, app_names=None, energy_models=None, status_interval=5.0, speed=0.0, max_gap=60.0):
+        # Imported here: app.py imports this module for the recorder
+        from prometheus_client import CollectorRegistry
+        import api
+        from CustomAppMetrics import CustomAppMetricsMonitor
+        from DockerMetrics import DockerMetricsMonitor
+        from app import build_status
+
+        self.app_names = app_names
+        self.energy_models = energy_models or dict(ENERGY_MODELS)
+        self.status_interval = status_interval
+        self.speed = speed
+        self.max_gap = max_gap  # Longer gaps between samples of a key are not integrated
+        self.build_status = build_status
+
+        self.self_metrics = PipelineMetrics(CollectorRegistry())
+        self.service_monitor = DockerMetricsMonitor(registry=CollectorRegistry(), client_factory=_OfflineDockerClient,
+                                                    self_metrics=self.self_metrics)
+        self.container_monitor = api.DockerMetricsMonitor(registry=CollectorRegistry(), client=_OfflineDockerClient(),
+                                                          self_metrics=self.self_metrics, collection_mode="fixed")
+        self.CustomAppMetricsMonitor = CustomAppMetricsMonitor
+        self.app_monitor = None
+        self.registries = [self.service_monitor.registry, self.container_monitor.registry]
+
+        self.service_state = {}
+        self.container_state = {}
+        self.service_names = set()
+        self.last_seen = {}  # (kind, key) -> timestamp of its previous sample
+        self.energy = {name: {} for name in self.energy_models}
+        self.status = {}
+        self.changes = []
+        self.counts = dict.fromkeys(KINDS, 0)
+
+    def query(self, promql):
+        """
+        Evaluate the `metric{label='value'}` selectors build_status() issues against the replay registries.
+        """
+        match = re.fullmatch(r"(\w+)\{(\w+)='([^']*)'\}", promql)
+        if match is None:
+            return None
+        name, label, value = match.groups()
+        for registry in self.registries:
+            sample = registry.get_sample_value(name, {label: value})
+            if sample is not None:
+                return sample
+        return None
+
+    def _integrate(self, kind, key, timestamp, frames):
+        previous = self.last_seen.get((kind, key))
+        self.last_seen[(kind, key)] = timestamp
+        if previous is None or not 0 < timestamp - previous <= self.max_gap:
+            return
+        elapsed = timestamp - previous
+        for name, model in self.energy_models.items():
+            watts = sum(model(stats) for stats in frames)
+            totals = self.energy[name]
+            totals[key] = totals.get(key, 0.0) + watts * elapsed
+
+    def _evaluate_status(self, timestamp):
+        app_names = self.app_names if self.app_monitor is not None else []
+        # build_status() prints missing metrics; keep stdout for the report
+        with contextlib.redirect_stdout(sys.stderr):
+            entries = self.build_status(app_names, sorted(self.service_names), self.query)
+        for entry in entries:
+            previous = self.status.get(entry["name"])
+            for field in ("cpu_recommendation", "memory_recommendation", "energy_recommendation"):
+                if previous is None or previous[field] != entry[field]:
+                    self.changes.append({"timestamp": timestamp, "name": entry["name"], "field": field,
+                                         "from": previous[field] if previous else None, "to": entry[field]})
+            self.status[entry["name"]] = entry
+
+    def apply(self, timestamp, kind, key, data):
+        if kind == "docker_service":
+            self.service_names.add(key)
+            self.service_monitor.record_service(key, data, self.service_state.setdefault(
+                key, {"net_io": {}, "blk_io": []}))
+            self._integrate(kind, key, timestamp, data.values())
+        elif kind == "docker_container":
+            self.container_monitor.record_stats(key, data, self.container_state.setdefault(
+                key, {"net_io": None, "blk_io": None}))
+            self._integrate(kind, key, timestamp, (data,))
+        elif kind == "psutil":
+            if self.app_monitor is None:
+                # Starts at the first reading so its first energy interval matches the live one
+                self.app_names = self.app_names or ["custom_app"]
+                self.app_monitor = self.CustomAppMetricsMonitor(self.app_names, self_metrics=self.self_metrics,
+                                                                start_time=timestamp)
+                self.registries.append(self.app_monitor.registry)
+            self.app_monitor.record_host(data, timestamp)
+        else:
+            self.self_metrics.drop("replay", "unknown_kind")
+            return
+        self.counts[kind] += 1
+
+    def run(self, records):
+        """
+        Replay `records` (e.g. read_records(path)) and return the report.
+        """
+        started = time.perf_counter()
+        first = last = next_status = None
+        for timestamp, kind, key, data in records:
+            if first is None:
+                first, next_status = timestamp, timestamp + self.status_interval
+            if self.speed:
+                # Keep the recorded spacing, compressed by `speed`
+                delay = (timestamp - first) / self.speed - (time.perf_counter() - started)
+                if delay > 0:
+                    time.sleep(delay)
+            while timestamp >= next_status:
+                self._evaluate_status(next_status)
+                next_status += self.status_interval
+            self.apply(timestamp, kind, key, data)
+            last = timestamp
+        if first is not None:
+            self._evaluate_status(last)
+
+        wall = time.perf_counter() - started
+        simulated = (last - first) if first is not None else 0.0
+        return {
+            "records": self.counts,
+            "simulated_seconds": simulated,
+            "wall_seconds": wall,
+            "speedup": simulated / wall if wall > 0 else None,
+            "energy_joules": self.energy,
+            "recommendation_changes": self.changes,
+            "final_status": sorted(self.status.values(), key=lambda entry: entry["name"]),
+        }
+
+
+def log_info(path):
+    counts = {}
+    first = last = None
+    for timestamp, kind, key, _ in read_records(path):
+        counts.setdefault(kind, set()).add(key)
+        first = timestamp if first is None else first
+        last = timestamp
+    return {"path": path, "bytes": os.path.getsize(path), "start": first, "end": last,
+            "keys": {kind: sorted(str(key) for key in keys) for kind, keys in counts.items()}}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect or replay a raw sample log")
+    commands = parser.add_subparsers(dest="command", required=True)
+    info = commands.add_parser("info", help="Summarize a sample log")
+    info.add_argument("log")
+    replay = commands.add_parser("replay", help="Replay a sample log through the collectors and models")
+    replay.add_argument("log")
+    replay.add_argument("--app", action="append", dest="app_names", help="App names for the psutil readings")
+    replay.add_argument("--model", action="append", default=[],
+                        help="Energy model to compare, by name or module:function (default: all built-in)")
+    replay.add_argument("--speed", type=float, default=0.0, help="Multiple of the recorded pace; 0 = unthrottled")
+    replay.add_argument("--status-interval", type=float, default=5.0, help="Seconds between status evaluations")
+    replay.add_argument("--output", help="Write the JSON report to this file instead of stdout")
+    replay.add_argument("--verbose", action="store_true", help="Keep the collectors' per-sample logging")
+    args = parser.parse_args(argv)
+
+    if args.command == "info":
+        result = log_info(args.log)
+    else:
+        if not args.verbose:
+            logging.getLogger().setLevel(logging.WARNING)
+        models = {spec: load_energy_model(spec) for spec in args.model} or None
+        engine = ReplayEngine(args.app_names, models, status_interval=args.status_interval, speed=args.speed)
+        result = engine.run(read_records(args.log))
+
+    document = json.dumps(result, indent=2, default=str)
+    if getattr(args, "output", None):
+        with open(args.output, "w") as f:
+            f.write(document)
+        logging.warning(f"Report written to {args.output}")
+    else:
+        sys.stdout.write(document + "\n")
+
+
+if __name__ == "__main__":
+    main()
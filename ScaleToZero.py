@@ -0,0 +1,376 @@
+"""
+Scale-to-zero for idle services, with a wake-on-request proxy in front of them.
+
+The proxy sits between nginx and the services it manages (see docker/nginx.conf).
+It forwards requests under each route prefix to the service's upstream and watches
+for idleness: a service that has had no request through the proxy and whose CPU
+(docker_service_cpu_usage_percent in Prometheus) stayed under `cpu_threshold` for
+`idle_after` seconds is scaled to 0 replicas through BulkUpdate. A request for a
+scaled-down service is held while the service is scaled back to its previous
+replica count and its health path answers; every request held meanwhile shares the
+same wake-up, then they are all forwarded.
+
+Cold-start latency and the energy saved while at zero (`replica_watts` per replica
+not running) are exported on /_proxy/metrics.
+
+Only workloads whose traffic all passes through the proxy belong behind it. The
+monitoring app is scraped by Prometheus and receives node-agent pushes directly, so
+it would look idle and be scaled to zero along with all collection.
+
+    SCALE_TO_ZERO_ROUTES="/api1/=my_thesis_api1@http://api1:8001" python ScaleToZero.py
+"""
+import argparse
+import asyncio
+import logging
+import os
+import time
+
+import aiohttp
+from aiohttp import web
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily
+
+from BulkUpdate import BulkUpdater, current_replicas
+from DockerMetrics import connect_docker
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+# Not forwarded in either direction (RFC 7230 section 6.1, plus the lengths aiohttp recomputes)
+HOP_BY_HOP_HEADERS = {"connection", "keep-alive", "proxy-authenticate", "proxy-authorization", "te", "trailer",
+                      "transfer-encoding", "upgrade", "host", "content-length"}
+
+
+def parse_routes(specs):
+    """
+    ["/app/=service@http://upstream:8000", ...] -> [{"prefix", "service", "upstream"}, ...], longest prefix first.
+    """
+    routes = []
+    for spec in specs:
+        prefix, _, target = spec.partition("=")
+        service, _, upstream = target.partition("@")
+        if not prefix or not service or not upstream:
+            raise ValueError(f"Invalid route, expected PREFIX=SERVICE@UPSTREAM: {spec}")
+        routes.append({"prefix": prefix, "service": service, "upstream": upstream.rstrip("/")})
+    return sorted(routes, key=lambda route: -len(route["prefix"]))
+
+
+class IdlePolicy:
+    """
+    A service is idle once it has gone `idle_after` seconds without a proxied request
+    or a CPU reading at or above `cpu_threshold` percent.
+    """
+
+    def __init__(self, idle_after=900.0, cpu_threshold=2.0):
+        self.idle_after = idle_after
+        self.cpu_threshold = cpu_threshold
+        self.last_active = {}
+
+    def note_request(self, service, now):
+        self.last_active[service] = now
+
+    def observe(self, service, now, cpu_percent=None):
+        self.last_active.setdefault(service, now)
+        if cpu_percent is not None and cpu_percent >= self.cpu_threshold:
+            self.last_active[service] = now
+
+    def is_idle(self, service, now):
+        return now - self.last_active.get(service, now) >= self.idle_after
+
+    def reset(self, service, now):
+        self.last_active[service] = now
+
+
+class _ServiceState:
+    __slots__ = ("replicas", "scaled_down_at", "wake", "in_flight", "saved_joules", "lock")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()  # Serializes scale-downs and wake-ups of the service
+        self.replicas = None  # Replica count to restore on wake, while scaled down
+        self.scaled_down_at = None
+        self.wake = None  # Task of the wake-up in progress
+        self.in_flight = 0
+        self.saved_joules = 0.0
+
+
+class _SavedEnergyCollector:
+    def __init__(self, proxy):
+        self.proxy = proxy
+
+    def collect(self):
+        saved = CounterMetricFamily("scale_to_zero_energy_saved_joules",
+                                    "Energy not drawn by replicas while their service was scaled to zero",
+                                    labels=["service"])
+        now = time.time()
+        for service, state in self.proxy.states.items():
+            saved.add_metric([service], state.saved_joules + self.proxy.pending_savings(state, now))
+        yield saved
+
+
+class ScaleToZeroProxy:
+    """
+    `client` is a docker client for reading replica counts, `updater` a BulkUpdater for
+    changing them. `replica_watts` is the power one idle replica draws.
+    """
+
+    def __init__(self, routes, client, updater, policy=None, prometheus_url=None, replica_watts=5.0,
+                 check_interval=30.0, wake_timeout=120.0, health_path="/", health_interval=0.5):
+        self.routes = routes
+        self.client = client
+        self.updater = updater
+        self.policy = policy or IdlePolicy()
+        self.prometheus_url = prometheus_url
+        self.replica_watts = replica_watts
+        self.check_interval = check_interval
+        self.wake_timeout = wake_timeout
+        self.health_path = health_path
+        self.health_interval = health_interval
+        self.states = {route["service"]: _ServiceState() for route in routes}
+        self.session = None
+
+        self.registry = CollectorRegistry()
+        self.cold_start = Histogram("scale_to_zero_cold_start_seconds",
+                                    "Time from the first held request until the service answered its health check",
+                                    ["service"], registry=self.registry,
+                                    buckets=(0.5, 1, 2, 5, 10, 20, 30, 60, 120))
+        self.scaled_down = Gauge("scale_to_zero_scaled_down", "1 while the service is scaled to zero", ["service"],
+                                 registry=self.registry)
+        self.held = Gauge("scale_to_zero_held_requests", "Requests waiting for their service to wake up", ["service"],
+                          registry=self.registry)
+        self.transitions = Counter("scale_to_zero_transitions", "Scale-downs to zero and wake-ups",
+                                   ["service", "direction"], registry=self.registry)
+        self.requests = Counter("scale_to_zero_requests", "Requests through the proxy", ["service", "outcome"],
+                                registry=self.registry)
+        self.registry.register(_SavedEnergyCollector(self))
+
+    def pending_savings(self, state, now):
+        if state.scaled_down_at is None:
+            return 0.0
+        return (now - state.scaled_down_at) * self.replica_watts * (state.replicas or 1)
+
+    def route_for(self, path):
+        for route in self.routes:
+            if path.startswith(route["prefix"]):
+                return route
+        return None
+
+    async def _docker(self, function, *args):
+        # docker-py is blocking; keep it off the event loop
+        return await asyncio.get_running_loop().run_in_executor(None, function, *args)
+
+    def _replicas(self, service_name):
+        return current_replicas(self.client.services.get(service_name))
+
+    def _set_replicas(self, service_name, replicas):
+        report = self.updater.run([{"service": service_name, "replicas": replicas}], stack_name="")
+        result = report["results"][0]
+        if result["status"] not in ("applied", "unchanged"):
+            raise RuntimeError(f"Scaling {service_name} to {replicas} failed: {result.get('message')}")
+
+    async def start(self):
+        self.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=None, connect=10))
+        now = time.time()
+        for service, state in self.states.items():
+            # A service left at zero by an earlier run is woken up with one replica
+            try:
+                if await self._docker(self._replicas, service) == 0:
+                    state.replicas, state.scaled_down_at = 1, now
+                    self.scaled_down.labels(service=service).set(1)
+            except Exception as e:
+                logging.error(f"Error reading replicas of {service}: {e}")
+            self.policy.observe(service, now)
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+
+    async def _cpu_percent(self, service):
+        if not self.prometheus_url:
+            return None
+        query = f"docker_service_cpu_usage_percent{{service='{service}'}}"
+        try:
+            async with self.session.get(f"{self.prometheus_url}/api/v1/query", params={"query": query},
+                                        timeout=aiohttp.ClientTimeout(total=5)) as response:
+                data = await response.json()
+            result = data["data"]["result"]
+            return float(result[0]["value"][1]) if result else None
+        except (aiohttp.ClientError, asyncio.TimeoutError, KeyError, ValueError) as e:
+            logging.warning(f"Error querying CPU of {service}: {e}")
+            return None
+
+    async def check_idle(self):
+        """
+        One idle check: scale to zero every running service the policy finds idle.
+        """
+        now = time.time()
+        for service, state in self.states.items():
+            if state.scaled_down_at is not None or state.wake is not None:
+                continue
+            self.policy.observe(service, now, await self._cpu_percent(service))
+            if state.in_flight or not self.policy.is_idle(service, now):
+                continue
+            async with state.lock:
+                # Requests may have arrived while the CPU query or the lock was awaited
+                if state.scaled_down_at is not None or state.wake is not None or state.in_flight or \
+                        not self.policy.is_idle(service, time.time()):
+                    continue
+                # Marked first, so requests arriving during the scale-down wait for the wake-up
+                state.replicas, state.scaled_down_at = 1, time.time()
+                try:
+                    replicas = await self._docker(self._replicas, service)
+                    if replicas:
+                        state.replicas = replicas
+                        await self._docker(self._set_replicas, service, 0)
+                except Exception as e:
+                    logging.error(f"Error scaling {service} to zero: {e}")
+                    state.replicas = state.scaled_down_at = None
+                    continue
+            self.scaled_down.labels(service=service).set(1)
+            self.transitions.labels(service=service, direction="down").inc()
+            logging.info(f"Scaled idle service {service} to zero (was {replicas} replicas)")
+
+    async def run_idle_checks(self):
+        while True:
+            await asyncio.sleep(self.check_interval)
+            try:
+                await self.check_idle()
+            except Exception as e:
+                logging.error(f"Error checking idle services: {e}")
+
+    async def _healthy(self, upstream):
+        try:
+            async with self.session.get(upstream + self.health_path, timeout=aiohttp.ClientTimeout(total=2)) as response:
+                return response.status < 500
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            return False
+
+    async def _wake(self, route, started):
+        service, state = route["service"], self.states[route["service"]]
+        async with state.lock:
+            await self._docker(self._set_replicas, service, state.replicas or 1)
+        deadline = started + self.wake_timeout
+        while not await self._healthy(route["upstream"]):
+            if time.monotonic() > deadline:
+                raise asyncio.TimeoutError(f"{service} not healthy after {self.wake_timeout}s")
+            await asyncio.sleep(self.health_interval)
+
+        state.saved_joules += self.pending_savings(state, time.time())
+        state.replicas = state.scaled_down_at = None
+        self.policy.reset(service, time.time())
+        self.cold_start.labels(service=service).observe(time.monotonic() - started)
+        self.scaled_down.labels(service=service).set(0)
+        self.transitions.labels(service=service, direction="up").inc()
+        logging.info(f"Woke {service} in {time.monotonic() - started:.2f}s")
+
+    async def ensure_awake(self, route):
+        """
+        Wait until the route's service is up, starting a wake-up if it is scaled to zero.
+        """
+        state = self.states[route["service"]]
+        if state.scaled_down_at is None and state.wake is None:
+            return
+        if state.wake is None:
+            state.wake = asyncio.ensure_future(self._wake(route, time.monotonic()))
+            state.wake.add_done_callback(lambda _: setattr(state, "wake", None))
+        self.held.labels(service=route["service"]).inc()
+        try:
+            # shield: a client giving up must not cancel the wake-up for everyone else
+            await asyncio.shield(state.wake)
+        finally:
+            self.held.labels(service=route["service"]).dec()
+
+    async def handle(self, request):
+        route = self.route_for(request.path)
+        if route is None:
+            return web.Response(status=404, text="No route")
+        service, state = route["service"], self.states[route["service"]]
+        self.policy.note_request(service, time.time())
+        state.in_flight += 1
+        try:
+            try:
+                await self.ensure_awake(route)
+            except Exception as e:
+                logging.error(f"Error waking {service}: {e}")
+                self.requests.labels(service=service, outcome="wake_failed").inc()
+                return web.Response(status=503, text=f"{service} is starting, try again later")
+            response = await self._forward(request, route)
+            self.requests.labels(service=service, outcome="forwarded").inc()
+            return response
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self.requests.labels(service=service, outcome="upstream_error").inc()
+            return web.Response(status=502, text=f"Upstream error: {e}")
+        finally:
+            state.in_flight -= 1
+            self.policy.note_request(service, time.time())
+
+    async def _forward(self, request, route):
+        path = "/" + request.raw_path[len(route["prefix"]):].lstrip("/")
+        headers = {name: value for name, value in request.headers.items() if name.lower() not in HOP_BY_HOP_HEADERS}
+        headers["X-Forwarded-For"] = request.headers.get("X-Forwarded-For", request.remote or "")
+        body = await request.read()
+        async with self.session.request(request.method, route["upstream"] + path, headers=headers,
+                                        data=body or None, allow_redirects=False) as upstream:
+            response = web.StreamResponse(status=upstream.status, reason=upstream.reason)
+            for name, value in upstream.headers.items():
+                if name.lower() not in HOP_BY_HOP_HEADERS and name.lower() != "content-encoding":
+                    response.headers.add(name, value)
+            await response.prepare(request)
+            # Streamed, so server-sent events (/metrics_status/stream) pass through as they arrive
+            async for chunk in upstream.content.iter_any():
+                await response.write(chunk)
+            await response.write_eof()
+            return response
+
+    async def metrics(self, request):
+        return web.Response(body=generate_latest(self.registry), content_type="text/plain")
+
+    async def healthz(self, request):
+        return web.json_response({"status": "ok"})
+
+    def make_app(self):
+        app = web.Application()
+        app.router.add_get("/_proxy/metrics", self.metrics)
+        app.router.add_get("/_proxy/healthz", self.healthz)
+        app.router.add_route("*", "/{tail:.*}", self.handle)
+
+        async def on_startup(app):
+            await self.start()
+            app["idle_checks"] = asyncio.ensure_future(self.run_idle_checks())
+
+        async def on_cleanup(app):
+            app["idle_checks"].cancel()
+            await self.close()
+
+        app.on_startup.append(on_startup)
+        app.on_cleanup.append(on_cleanup)
+        return app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Wake-on-request proxy that scales idle services to zero")
+    parser.add_argument("--route", action="append",
+                        default=[route for route in os.getenv('SCALE_TO_ZERO_ROUTES', '').split(',') if route],
+                        help="PREFIX=SERVICE@UPSTREAM, e.g. /api1/=my_thesis_api1@http://api1:8001")
+    parser.add_argument("--port", type=int, default=int(os.getenv('PROXY_PORT', 8080)))
+    parser.add_argument("--idle-after", type=float, default=float(os.getenv('SCALE_TO_ZERO_IDLE_AFTER', 900)))
+    parser.add_argument("--cpu-threshold", type=float, default=float(os.getenv('SCALE_TO_ZERO_CPU_THRESHOLD', 2)))
+    parser.add_argument("--replica-watts", type=float, default=float(os.getenv('SCALE_TO_ZERO_REPLICA_WATTS', 5)))
+    parser.add_argument("--wake-timeout", type=float, default=float(os.getenv('WAKE_TIMEOUT', 120)))
+    parser.add_argument("--health-path", default=os.getenv('WAKE_HEALTH_PATH', '/'))
+    args = parser.parse_args(argv)
+
+    routes = parse_routes(args.route)
+    if not routes:
+        parser.error("No routes; pass --route or set SCALE_TO_ZERO_ROUTES")
+    docker_url = os.getenv('DOCKER_URL', 'tcp://localhost:2375')
+    client = connect_docker(docker_url)
+    proxy = ScaleToZeroProxy(routes, client, BulkUpdater(client, daemon=docker_url, max_in_flight=2),
+                             policy=IdlePolicy(args.idle_after, args.cpu_threshold),
+                             prometheus_url=os.getenv('PROMETHEUS_URL'), replica_watts=args.replica_watts,
+                             check_interval=min(30.0, args.idle_after / 4), wake_timeout=args.wake_timeout,
+                             health_path=args.health_path)
+    web.run_app(proxy.make_app(), port=args.port, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+import threading
+import time
+from contextlib import contextmanager
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+
+# Collector stages and backend calls range from microseconds (gauge updates) to seconds (blocking stats)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class _SampleAgeCollector:
+    """
+    Computes the age of each container's last sample at scrape time, so recording
+    a sample costs only a dict assignment.
+    """
+
+    def __init__(self, pipeline_metrics):
+        self.pipeline_metrics = pipeline_metrics
+
+    def collect(self):
+        now = time.time()
+        family = GaugeMetricFamily("monitor_container_last_sample_age_seconds",
+                                   "Seconds since the last successful stats sample of a container",
+                                   labels=["collector", "container"])
+        for (collector, container), timestamp in list(self.pipeline_metrics.last_sample.items()):
+            family.add_metric([collector, container], now - timestamp)
+        yield family
+
+
+class PipelineMetrics:
+    """
+    Metrics about the monitoring pipeline itself, kept in their own registry and served
+    on a separate endpoint so they never mix with the application metrics.
+    """
+
+    def __init__(self, registry=None):
+        self.registry = registry or CollectorRegistry()
+
+        self.stage_seconds = Histogram("monitor_collector_stage_seconds",
+                                       "Time spent in each collector stage",
+                                       ["collector", "stage"], buckets=LATENCY_BUCKETS, registry=self.registry)
+        self.backend_seconds = Histogram("monitor_backend_call_seconds",
+                                         "Latency of calls to Docker, Prometheus and Alertmanager",
+                                         ["backend", "call", "outcome"], buckets=LATENCY_BUCKETS, registry=self.registry)
+        self.dropped_samples = Counter("monitor_dropped_samples_total",
+                                       "Samples lost to errors or skipped collection",
+                                       ["collector", "reason"], registry=self.registry)
+        self.threads = Gauge("monitor_threads", "Live threads in the monitoring process", registry=self.registry)
+        self.threads.set_function(threading.active_count)
+        self.queue_depth = Gauge("monitor_queue_depth", "Items waiting in internal queues",
+                                 ["queue"], registry=self.registry)
+
+        self.last_sample = {}  # (collector, container) -> timestamp
+        self.registry.register(_SampleAgeCollector(self))
+
+        # Labelled children are cached so the hot path skips the label lookup and its lock
+        self._children = {}
+
+    def _child(self, metric, *labels):
+        key = (id(metric), labels)
+        child = self._children.get(key)
+        if child is None:
+            child = self._children[key] = metric.labels(*labels)
+        return child
+
+    @contextmanager
+    def time_stage(self, collector, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._child(self.stage_seconds, collector, stage).observe(time.perf_counter() - started)
+
+    @contextmanager
+    def time_backend(self, backend, call):
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            yield
+            outcome = "success"
+        finally:
+            self._child(self.backend_seconds, backend, call, outcome).observe(time.perf_counter() - started)
+
+    def observe_stage(self, collector, stage, seconds):
+        self._child(self.stage_seconds, collector, stage).observe(seconds)
+
+    def observe_backend(self, backend, call, seconds, outcome="success"):
+        self._child(self.backend_seconds, backend, call, outcome).observe(seconds)
+
+    def mark_sample(self, collector, container):
+        self.last_sample[(collector, container)] = time.time()
+
+    def forget(self, collector, container):
+        self.last_sample.pop((collector, container), None)
+
+    def drop(self, collector, reason, count=1):
+        self._child(self.dropped_samples, collector, reason).inc(count)
+
+    def register_queue(self, name, depth):
+        """
+        Report a queue's depth through a callable evaluated at scrape time.
+        """
+        self.queue_depth.labels(queue=name).set_function(depth)
+
+    def get_metrics(self):
+        return generate_latest(self.registry).decode('utf-8')
+
+
+# Shared instance used by the collectors unless one is injected
+pipeline_metrics = PipelineMetrics()
@@ -0,0 +1,258 @@
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import docker
+from prometheus_client.core import GaugeMetricFamily
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+
+class StatsSlot:
+    """
+    The latest stats frame of one container, reduced to the counters the gauges need
+    instead of the full decoded document (about 20 numbers instead of a nested dict).
+    """
+    __slots__ = ("frames", "updated", "cpu_total", "precpu_total", "system", "presystem", "num_cpus",
+                 "mem_usage", "mem_limit", "net_tx", "net_rx", "blk_read", "blk_write")
+
+    def __init__(self):
+        self.frames = 0
+        self.updated = None
+
+    def update(self, frame):
+        cpu_stats = frame.get("cpu_stats", {})
+        precpu_stats = frame.get("precpu_stats", {})
+        self.cpu_total = cpu_stats.get("cpu_usage", {}).get("total_usage", 0)
+        self.precpu_total = precpu_stats.get("cpu_usage", {}).get("total_usage", 0)
+        self.system = cpu_stats.get("system_cpu_usage", 0)
+        self.presystem = precpu_stats.get("system_cpu_usage", 0)
+        self.num_cpus = len(cpu_stats.get("cpu_usage", {}).get("percpu_usage") or []) or cpu_stats.get("online_cpus", 1)
+
+        memory_stats = frame.get("memory_stats", {})
+        self.mem_usage = memory_stats.get("usage", 0)
+        self.mem_limit = memory_stats.get("limit", 1)
+
+        networks = frame.get("networks") or {}
+        self.net_tx = sum(interface.get("tx_bytes", 0) for interface in networks.values())
+        self.net_rx = sum(interface.get("rx_bytes", 0) for interface in networks.values())
+
+        read = write = 0
+        for entry in (frame.get("blkio_stats") or {}).get("io_service_bytes_recursive") or []:
+            op = entry.get("op", "").lower()
+            if op == "read":
+                read += entry.get("value", 0)
+            elif op == "write":
+                write += entry.get("value", 0)
+        self.blk_read, self.blk_write = read, write
+
+        self.frames += 1
+        self.updated = time.time()
+
+    def as_stats(self):
+        """
+        A minimal stats document in the Docker API shape, for api.compute_container_sample().
+        """
+        return {
+            "cpu_stats": {"cpu_usage": {"total_usage": self.cpu_total, "percpu_usage": [0] * self.num_cpus},
+                          "system_cpu_usage": self.system},
+            "precpu_stats": {"cpu_usage": {"total_usage": self.precpu_total}, "system_cpu_usage": self.presystem},
+            "memory_stats": {"usage": self.mem_usage, "limit": self.mem_limit},
+            "networks": {"all": {"tx_bytes": self.net_tx, "rx_bytes": self.net_rx}},
+            "blkio_stats": {"io_service_bytes_recursive": [{"op": "Read", "value": self.blk_read},
+                                                           {"op": "Write", "value": self.blk_write}]},
+        }
+
+
+class StatsStreamPool:
+    """
+    Keeps one long-lived `stats(stream=True)` connection per watched container, at most
+    `max_connections` at a time. Containers beyond that wait for a free connection and are
+    meanwhile polled with `stats(stream=False)` by run_poller(), so none goes unsampled.
+    Streams that end or fail are reopened with exponential backoff, unless the container
+    is gone. The latest frame of each container is kept in its StatsSlot.
+    """
+
+    def __init__(self, client, max_connections=100, backoff=(1.0, 30.0), on_drop=None, poll_workers=8):
+        self.client = client
+        self.max_connections = max_connections
+        self.poll_workers = poll_workers
+        self.backoff = backoff
+        self.on_drop = on_drop  # Called with a reason whenever a stream ends unexpectedly
+
+        self.slots = {}  # container name -> StatsSlot
+        self.watched = {}  # container name -> container
+        self.connections = set()  # names with a reader thread
+        self.waiting = deque()
+        self.reconnects = 0
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+
+    def watch(self, container):
+        with self.lock:
+            if container.name in self.watched:
+                return
+            self.watched[container.name] = container
+            self.slots[container.name] = StatsSlot()
+            if len(self.connections) < self.max_connections:
+                self._start(container.name)
+            else:
+                self.waiting.append(container.name)
+
+    def unwatch(self, name):
+        """
+        Stop following a container; its reader exits after the next frame and frees its connection.
+        """
+        with self.lock:
+            self.watched.pop(name, None)
+            self.slots.pop(name, None)
+            try:
+                self.waiting.remove(name)
+            except ValueError:
+                pass
+
+    def latest(self):
+        """
+        {name: StatsSlot} for containers that have received at least one frame.
+        """
+        with self.lock:
+            return {name: slot for name, slot in self.slots.items() if slot.frames}
+
+    def unsampled(self, max_age):
+        """
+        {name: reason} of watched containers without a frame ("no_frame") or whose latest
+        frame is older than `max_age` seconds ("stale").
+        """
+        now = time.time()
+        with self.lock:
+            slots = list(self.slots.items())
+        unsampled = {}
+        for name, slot in slots:
+            if not slot.frames:
+                unsampled[name] = "no_frame"
+            elif now - slot.updated > max_age:
+                unsampled[name] = "stale"
+        return unsampled
+
+    def run_poller(self, interval=5):
+        """
+        Poll the containers waiting for a stream connection once per `interval`, on up to
+        `poll_workers` threads, until stop().
+        """
+        with ThreadPoolExecutor(max_workers=self.poll_workers, thread_name_prefix="stats-poll") as executor:
+            while not self.stop_event.is_set():
+                started = time.monotonic()
+                with self.lock:
+                    names = list(self.waiting)
+                if names:
+                    list(executor.map(self._poll, names))
+                if self.stop_event.wait(max(0.0, interval - (time.monotonic() - started))):
+                    return
+
+    def _poll(self, name):
+        with self.lock:
+            container = self.watched.get(name)
+            slot = self.slots.get(name)
+        if container is None or name not in self.waiting:
+            return  # Unwatched, or it got a stream connection meanwhile
+        try:
+            frame = container.stats(stream=False)
+        except Exception as e:
+            logging.warning(f"Stats poll for {name} failed: {e}")
+            if not self._still_running(container):
+                self.unwatch(name)
+            elif self.on_drop is not None:
+                self.on_drop("poll_error")
+            return
+        with self.lock:
+            if self.slots.get(name) is slot:
+                slot.update(frame)
+
+    def stop(self):
+        self.stop_event.set()
+
+    def _start(self, name):
+        self.connections.add(name)
+        threading.Thread(target=self._read, args=(name,), name=f"stats-stream-{name}", daemon=True).start()
+
+    def _release(self, name):
+        with self.lock:
+            self.connections.discard(name)
+            while self.waiting and len(self.connections) < self.max_connections:
+                next_name = self.waiting.popleft()
+                if next_name in self.watched:
+                    self._start(next_name)
+
+    def _read(self, name):
+        delay = self.backoff[0]
+        try:
+            while not self.stop_event.is_set():
+                with self.lock:
+                    container = self.watched.get(name)
+                    slot = self.slots.get(name)
+                if container is None:
+                    return
+                try:
+                    # docker-py splits the chunked response into JSON documents as they arrive
+                    for frame in container.stats(stream=True, decode=True):
+                        if self.stop_event.is_set() or self.slots.get(name) is not slot:
+                            return
+                        slot.update(frame)
+                        delay = self.backoff[0]
+                    reason = "stream_closed"
+                except Exception as e:
+                    logging.warning(f"Stats stream for {name} failed: {e}")
+                    reason = "stream_error"
+
+                if not self._still_running(container):
+                    logging.info(f"Container {name} is gone, closing its stats stream")
+                    self.unwatch(name)
+                    return
+                if self.on_drop is not None:
+                    self.on_drop(reason)
+                self.reconnects += 1
+                # Jittered exponential backoff so a daemon restart does not reconnect everything at once
+                if self.stop_event.wait(delay * random.uniform(0.5, 1.0)):
+                    return
+                delay = min(delay * 2, self.backoff[1])
+        finally:
+            self._release(name)
+
+    def _still_running(self, container):
+        try:
+            container.reload()
+            return getattr(container, "status", "running") == "running"
+        except docker.errors.NotFound:
+            return False
+        except Exception:
+            return True  # Daemon unreachable: keep retrying with backoff
+
+
+class _UnsampledCollector:
+    """
+    docker_container_unsampled{container, reason}: 1 for each watched container the pool
+    has no recent frame for.
+    """
+
+    def __init__(self, pool, max_age):
+        self.pool = pool
+        self.max_age = max_age
+
+    def collect(self):
+        family = GaugeMetricFamily("docker_container_unsampled",
+                                   "Watched containers without a recent stats frame",
+                                   labels=["container", "reason"])
+        for name, reason in sorted(self.pool.unsampled(self.max_age).items()):
+            family.add_metric([name, reason], 1)
+        yield family
+
+    def describe(self):
+        return [GaugeMetricFamily("docker_container_unsampled", "Watched containers without a recent stats frame",
+                                  labels=["container", "reason"])]
+
+
+def register_unsampled(pool, registry, max_age):
+    registry.register(_UnsampledCollector(pool, max_age))
@@ -0,0 +1,141 @@
+import base64
+import hashlib
+import json
+
+# Recommendation texts start with one of these markers (see app.evaluate_utilization)
+RECOMMENDATION_LEVELS = {"✅": "ok", "⚠️": "warning", "❌": "critical"}
+RECOMMENDATION_FIELDS = ("cpu_recommendation", "memory_recommendation", "energy_recommendation",
+                         "anomaly_recommendation")
+RESOURCES = {"cpu", "memory", "energy", "anomaly"}
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+class ApiError(Exception):
+    """
+    Invalid query parameters; reported to the client as a 400 response.
+    """
+
+
+def recommendation_level(text):
+    for marker, level in RECOMMENDATION_LEVELS.items():
+        if str(text).startswith(marker):
+            return level
+    return "unknown"
+
+
+def with_levels(entry):
+    """
+    Add machine-readable *_level fields next to the emoji recommendation texts.
+    """
+    entry = dict(entry)
+    for field in RECOMMENDATION_FIELDS:
+        if field in entry:
+            entry[field.replace("_recommendation", "_level")] = recommendation_level(entry[field])
+    return entry
+
+
+def _split(value):
+    return {item.strip() for item in value.split(',') if item.strip()} if value else set()
+
+
+def filter_status(entries, args):
+    """
+    level=warning,critical keeps entries with at least one recommendation at that level;
+    resource=cpu,memory,energy,anomaly restricts which recommendations are considered.
+    """
+    levels = _split(args.get('level'))
+    unknown = levels - set(RECOMMENDATION_LEVELS.values())
+    if unknown:
+        raise ApiError(f"Unknown level: {', '.join(sorted(unknown))}")
+    resources = _split(args.get('resource')) or RESOURCES
+    unknown = resources - RESOURCES
+    if unknown:
+        raise ApiError(f"Unknown resource: {', '.join(sorted(unknown))}")
+
+    result = []
+    for entry in entries:
+        entry = with_levels(entry)
+        if levels and not any(entry.get(f"{resource}_level") in levels for resource in resources):
+            continue
+        result.append(entry)
+    return result
+
+
+def filter_alerts(alerts, args):
+    """
+    severity=, state= and source= filters, each accepting a comma separated list.
+    """
+    result = alerts
+    for field in ("severity", "state", "source"):
+        wanted = _split(args.get(field))
+        if wanted:
+            result = [alert for alert in result if alert.get(field) in wanted]
+    return result
+
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(key.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        return base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+    except Exception:
+        raise ApiError("Invalid cursor")
+
+
+def paginate(items, key_field, args):
+    """
+    Keyset pagination over items sorted by key_field. The cursor is the opaque last key
+    of the previous page, so pages stay stable while rows are added or removed.
+    """
+    try:
+        limit = int(args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        raise ApiError("limit must be an integer")
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise ApiError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+
+    items = sorted(items, key=lambda item: item[key_field])
+    cursor = args.get('cursor')
+    if cursor:
+        after = decode_cursor(cursor)
+        items = [item for item in items if item[key_field] > after]
+
+    page = items[:limit]
+    next_cursor = encode_cursor(page[-1][key_field]) if len(items) > limit else None
+    return page, next_cursor
+
+
+def select_fields(items, args, key_field):
+    """
+    fields=name,cpu returns only those fields; the key field is always included.
+    """
+    fields = _split(args.get('fields'))
+    if not fields:
+        return items
+    fields.add(key_field)
+    return [{field: item[field] for field in fields if field in item} for item in items]
+
+
+def build_page(items, key_field, args):
+    """
+    The page holds only its own rows, so its ETag changes only when those rows do.
+    """
+    page, next_cursor = paginate(items, key_field, args)
+    return {
+        "count": len(page),
+        "next_cursor": next_cursor,
+        "items": select_fields(page, args, key_field),
+    }
+
+
+def render_json(payload):
+    """
+    Serialise deterministically and return (body, strong ETag) so identical
+    responses always carry identical validators.
+    """
+    body = json.dumps(payload, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+    return body, hashlib.sha256(body).hexdigest()[:32]
@@ -0,0 +1,173 @@
+import json
+import logging
+import queue
+import threading
+import time
+
+from Deadline import deadline_scope
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+
+def alert_key(alert):
+    return f"{alert.get('alertname')}|{alert.get('service')}|{alert.get('source')}"
+
+
+def _diff_rows(previous, current):
+    """
+    Compare two {key: row} maps and return (changed or new rows, removed keys).
+    """
+    upsert = [row for key, row in current.items() if previous.get(key) != row]
+    remove = [key for key in previous if key not in current]
+    return upsert, remove
+
+
+class StatusBroadcaster:
+    """
+    Computes the status snapshot (utilization entries and alerts) on one background thread
+    and pushes compact diffs to every connected Server-Sent-Events client.
+    The thread only runs while at least one client is subscribed.
+    With `deadline` (seconds), each computation runs under that latency budget (see Deadline.py).
+    """
+
+    def __init__(self, compute_status, compute_alerts, interval=5, heartbeat=15, max_pending=100, deadline=None):
+        self.compute_status = compute_status
+        self.compute_alerts = compute_alerts
+        self.interval = interval
+        self.heartbeat = heartbeat
+        self.max_pending = max_pending
+        self.deadline = deadline
+
+        self.status = {}  # name -> status entry
+        self.alerts = {}  # alert_key -> alert
+        self.version = 0
+        self.updated_at = 0.0
+
+        self.subscribers = set()
+        self.lock = threading.Lock()
+        self.compute_lock = threading.RLock()
+        self.thread = None
+
+    def _compute(self):
+        with deadline_scope(self.deadline, "status") as deadline:
+            if deadline is not None:
+                deadline.plan(1)  # The alerts fetch keeps its share of the budget
+            status = {entry['name']: entry for entry in self.compute_status()}
+            alerts = {}
+            for alert in self.compute_alerts():
+                alert = dict(alert, key=alert_key(alert))
+                alerts[alert['key']] = alert
+        return status, alerts
+
+    def refresh(self):
+        """
+        Recompute the snapshot and return the diff against the previous one (None if unchanged).
+        """
+        with self.compute_lock:
+            status, alerts = self._compute()
+            status_upsert, status_remove = _diff_rows(self.status, status)
+            alerts_upsert, alerts_remove = _diff_rows(self.alerts, alerts)
+            with self.lock:
+                self.status, self.alerts = status, alerts
+                self.updated_at = time.time()
+                if not (status_upsert or status_remove or alerts_upsert or alerts_remove):
+                    return None
+                self.version += 1
+                return {
+                    "version": self.version,
+                    "status": {"upsert": status_upsert, "remove": status_remove},
+                    "alerts": {"upsert": alerts_upsert, "remove": alerts_remove},
+                }
+
+    def snapshot(self, max_age=None):
+        """
+        Return (version, status entries, alerts), recomputing only if older than max_age.
+        Page renders and streams share the same computation this way.
+        """
+        max_age = self.interval if max_age is None else max_age
+        if time.time() - self.updated_at > max_age:
+            with self.compute_lock:
+                # Another request may have refreshed while we waited for the lock
+                if time.time() - self.updated_at > max_age:
+                    self._publish(self.refresh())
+        with self.lock:
+            return self.version, list(self.status.values()), list(self.alerts.values())
+
+    def _full_event(self):
+        with self.lock:
+            payload = {"version": self.version,
+                       "status": list(self.status.values()),
+                       "alerts": list(self.alerts.values())}
+        return _encode("snapshot", payload)
+
+    def _publish(self, diff):
+        if diff is None:
+            return
+        event = _encode("patch", diff)  # Encoded once, shared by all clients
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(event)
+            except queue.Full:
+                # Slow client: drop its backlog and resynchronise with a full snapshot
+                with subscriber.mutex:
+                    subscriber.queue.clear()
+                subscriber.put_nowait(self._full_event())
+
+    def _run(self):
+        logging.info("Status stream started")
+        while True:
+            with self.lock:
+                if not self.subscribers:
+                    self.thread = None
+                    logging.info("Status stream stopped, no subscribers")
+                    return
+            # Page renders may have refreshed the snapshot in between
+            wait = self.updated_at + self.interval - time.time()
+            if wait > 0:
+                time.sleep(wait)
+                continue
+            try:
+                self._publish(self.refresh())
+            except Exception as e:
+                logging.error(f"Error refreshing status stream: {e}")
+                time.sleep(self.interval)
+
+    def subscribe(self):
+        subscriber = queue.Queue(maxsize=self.max_pending)
+        with self.lock:
+            self.subscribers.add(subscriber)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def pending_events(self):
+        with self.lock:
+            return sum(subscriber.qsize() for subscriber in self.subscribers)
+
+    def stream(self):
+        """
+        Generator for a text/event-stream response: one full snapshot, then patches.
+        """
+        subscriber = self.subscribe()
+        try:
+            self.snapshot()
+            yield self._full_event()
+            while True:
+                try:
+                    yield subscriber.get(timeout=self.heartbeat)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+        finally:
+            self.unsubscribe(subscriber)
+
+
+def _encode(event, payload):
+    return f"event: {event}\ndata: {json.dumps(payload, separators=(',', ':'))}\n\n"
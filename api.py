@@ -1,36 +1,127 @@
 import time
 import threading
 import docker
-from prometheus_client import Gauge, start_http_server
+from prometheus_client import Gauge, REGISTRY, start_http_server
 import logging
+import os
+from SelfMetrics import pipeline_metrics
+from AdaptiveSampler import AdaptiveSampler
+from StatsStream import StatsStreamPool, register_unsampled
+from SampleRecorder import SampleRecorder
+from ContainerState import ContainerStateTable, frame_counters
 
 # Configure logging for clarity and debugging.
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
 
+def compute_container_sample(stats, state):
+    """
+    Turn a decoded Docker stats frame into per-interval values. `state` carries the previous
+    network/disk counters between calls; their deltas are None on the first sample.
+    """
+    # === CPU Usage Calculation ===
+    cpu_current = stats["cpu_stats"]["cpu_usage"]["total_usage"]
+    cpu_previous = stats["precpu_stats"]["cpu_usage"]["total_usage"]
+    system_current = stats["cpu_stats"]["system_cpu_usage"]
+    system_previous = stats["precpu_stats"]["system_cpu_usage"]
+
+    cpu_delta = cpu_current - cpu_previous
+    system_delta = system_current - system_previous
+
+    # Calculate percentage usage (handle division by zero)
+    if system_delta > 0:
+        num_cpus = len(stats["cpu_stats"]["cpu_usage"].get("percpu_usage", []))
+        cpu_percent = (cpu_delta / system_delta) * num_cpus * 100.0
+    else:
+        cpu_percent = 0
+
+    # === Memory Usage Calculation ===
+    mem_usage = stats["memory_stats"].get("usage", 0)
+    mem_limit = stats["memory_stats"].get("limit", 1)  # avoid division by zero
+    mem_percent = (mem_usage / mem_limit) * 100.0
+
+    sample = {"cpu_percent": cpu_percent, "memory_percent": mem_percent,
+              "network_sent": None, "network_recv": None, "disk_read": None, "disk_write": None}
+
+    # === Network I/O Calculation ===
+    net_stats = stats.get("networks", {})
+    total_tx = sum(interface.get("tx_bytes", 0) for interface in net_stats.values())
+    total_rx = sum(interface.get("rx_bytes", 0) for interface in net_stats.values())
+    if state["net_io"] is not None:
+        # Delta calculation for the sampling period
+        sample["network_sent"] = total_tx - state["net_io"]["tx"]
+        sample["network_recv"] = total_rx - state["net_io"]["rx"]
+    state["net_io"] = {"tx": total_tx, "rx": total_rx}
+
+    # === Disk I/O Calculation ===
+    blk_stats = stats.get("blkio_stats", {}).get("io_service_bytes_recursive", [])
+    read_bytes = 0
+    write_bytes = 0
+    for entry in blk_stats:
+        op = entry.get("op", "").lower()
+        value = entry.get("value", 0)
+        if op == "read":
+            read_bytes += value
+        elif op == "write":
+            write_bytes += value
+
+    if state["blk_io"] is not None:
+        sample["disk_read"] = read_bytes - state["blk_io"]["read"]
+        sample["disk_write"] = write_bytes - state["blk_io"]["write"]
+    state["blk_io"] = {"read": read_bytes, "write": write_bytes}
+    return sample
+
+
 class DockerMetricsMonitor:
-    def __init__(self, docker_url="tcp://172.27.36.125:2375"):
-        # Connect to the Docker daemon using the provided URL.
-        self.client = docker.DockerClient(base_url=docker_url)
+    def __init__(self, docker_url="tcp://172.27.36.125:2375", registry=REGISTRY, client=None, self_metrics=None,
+                 collection_mode=None, recorder=None, state_mode=None):
+        # Connect to the Docker daemon using the provided URL (or use an injected client).
+        self.client = client or docker.DockerClient(base_url=docker_url)
+        self.registry = registry
+        self.self_metrics = self_metrics or pipeline_metrics
+        self.recorder = recorder  # Optional SampleRecorder that keeps the raw stats frames
 
+        # "fixed": one thread per container sampling every 5 seconds
+        # "adaptive": one scheduler sampling each container at a rate that follows its volatility
+        # "stream": one persistent streaming stats connection per container, published every 5 seconds
+        self.collection_mode = collection_mode or os.getenv('COLLECTION_MODE', 'fixed')
+        self.sampler = None
+        self.stream_pool = None
+        self.states = {}  # container name -> previous network/disk counters (adaptive and stream modes)
+
+        # "columnar": raw counters and per-frame deltas go into a ContainerStateTable and CPU/memory %
+        # are derived for all containers in one vectorized pass per scrape; "gauges": one set of Gauge
+        # updates per sample
+        self.state_mode = state_mode or os.getenv('CONTAINER_STATE', 'columnar')
+        self.table = None
+        if self.state_mode == "columnar":
+            self.table = ContainerStateTable()
+            self.table.register(registry)
+        else:
+            self._create_gauges(registry)
+        self.sample_interval = Gauge("docker_container_sample_interval_seconds",
+                                     "Sampling interval of each container, measured between samples",
+                                     ["container"], registry=registry)
+
+    def _create_gauges(self, registry):
         # Define Prometheus Gauges with a "container" label to differentiate containers.
         self.cpu_usage = Gauge("docker_container_cpu_usage_percent",
                                "CPU usage percent for Docker containers",
-                               ["container"])
+                               ["container"], registry=registry)
         self.memory_usage = Gauge("docker_container_memory_usage_percent",
                                   "Memory usage percent for Docker containers",
-                                  ["container"])
+                                  ["container"], registry=registry)
         self.network_sent = Gauge("docker_container_network_sent_bytes",
                                   "Network transmitted bytes per sampling interval",
-                                  ["container"])
+                                  ["container"], registry=registry)
         self.network_recv = Gauge("docker_container_network_recv_bytes",
                                   "Network received bytes per sampling interval",
-                                  ["container"])
+                                  ["container"], registry=registry)
         self.disk_read = Gauge("docker_container_disk_read_bytes",
                                "Disk read bytes per sampling interval",
-                               ["container"])
+                               ["container"], registry=registry)
         self.disk_write = Gauge("docker_container_disk_write_bytes",
                                 "Disk write bytes per sampling interval",
-                                ["container"])
+                                ["container"], registry=registry)
 
     def monitor_container(self, container):
         """
@@ -40,94 +131,166 @@ class DockerMetricsMonitor:
         container_name = container.name
         logging.info(f"Starting monitoring for container: {container_name}")
 
-        # Initialize previous snapshot variables for delta calculations.
-        prev_net_io = None
-        prev_blk_io = None
+        # Previous snapshot values for delta calculations.
+        state = {"net_io": None, "blk_io": None}
 
         while True:
             try:
-                stats = container.stats(stream=False)
-                
-                # === CPU Usage Calculation ===
-                cpu_current = stats["cpu_stats"]["cpu_usage"]["total_usage"]
-                cpu_previous = stats["precpu_stats"]["cpu_usage"]["total_usage"]
-                system_current = stats["cpu_stats"]["system_cpu_usage"]
-                system_previous = stats["precpu_stats"]["system_cpu_usage"]
-
-                cpu_delta = cpu_current - cpu_previous
-                system_delta = system_current - system_previous
-
-                # Calculate percentage usage (handle division by zero)
-                if system_delta > 0:
-                    num_cpus = len(stats["cpu_stats"]["cpu_usage"].get("percpu_usage", []))
-                    cpu_percent = (cpu_delta / system_delta) * num_cpus * 100.0
-                else:
-                    cpu_percent = 0
-                self.cpu_usage.labels(container=container_name).set(cpu_percent)
-
-                # === Memory Usage Calculation ===
-                mem_usage = stats["memory_stats"].get("usage", 0)
-                mem_limit = stats["memory_stats"].get("limit", 1)  # avoid division by zero
-                mem_percent = (mem_usage / mem_limit) * 100.0
-                self.memory_usage.labels(container=container_name).set(mem_percent)
-
-                # === Network I/O Calculation ===
-                net_stats = stats.get("networks", {})
-                total_tx = sum(interface.get("tx_bytes", 0) for interface in net_stats.values())
-                total_rx = sum(interface.get("rx_bytes", 0) for interface in net_stats.values())
-                if prev_net_io is not None:
-                    # Delta calculation for the sampling period
-                    sent_delta = total_tx - prev_net_io["tx"]
-                    recv_delta = total_rx - prev_net_io["rx"]
-                    self.network_sent.labels(container=container_name).set(sent_delta)
-                    self.network_recv.labels(container=container_name).set(recv_delta)
-                prev_net_io = {"tx": total_tx, "rx": total_rx}
-
-                # === Disk I/O Calculation ===
-                blk_stats = stats.get("blkio_stats", {}).get("io_service_bytes_recursive", [])
-                read_bytes = 0
-                write_bytes = 0
-                for entry in blk_stats:
-                    op = entry.get("op", "").lower()
-                    value = entry.get("value", 0)
-                    if op == "read":
-                        read_bytes += value
-                    elif op == "write":
-                        write_bytes += value
-
-                if prev_blk_io is not None:
-                    read_delta = read_bytes - prev_blk_io["read"]
-                    write_delta = write_bytes - prev_blk_io["write"]
-                    self.disk_read.labels(container=container_name).set(read_delta)
-                    self.disk_write.labels(container=container_name).set(write_delta)
-                prev_blk_io = {"read": read_bytes, "write": write_bytes}
-
+                self.sample_container(container, state)
             except Exception as e:
                 logging.error(f"Error monitoring container {container_name}: {e}")
+                self.self_metrics.drop("docker_container", "error")
 
             # Sample every 5 seconds (adjust as needed)
             time.sleep(5)
 
+    def sample_container(self, container, state):
+        """
+        Take one stats sample of a container and update its gauges.
+        `state` carries the previous network/disk counters between calls.
+        """
+        container_name = container.name
+        with self.self_metrics.time_backend("docker", "stats"):
+            stats = container.stats(stream=False)
+        with self.self_metrics.time_stage("docker_container", "compute"):
+            sample = self.record_stats(container_name, stats, state)
+        self.self_metrics.mark_sample("docker_container", container_name)
+        return sample
+
+    def record_stats(self, container_name, stats, state):
+        """
+        Update the gauges of one container from a decoded Docker stats frame and return the computed sample.
+        """
+        if self.recorder is not None:
+            self.recorder.record("docker_container", container_name, stats)
+        if self.table is not None:
+            counters = frame_counters(stats)
+            self.table.write(container_name, counters)
+            # Only the signals the adaptive sampler needs; deltas are derived at publish time
+            cpu_total, precpu_total, system, presystem, num_cpus, mem_usage, mem_limit = counters[:7]
+            return {"cpu_percent": (cpu_total - precpu_total) / (system - presystem) * num_cpus * 100.0
+                    if system > presystem else 0,
+                    "memory_percent": mem_usage / (mem_limit or 1) * 100.0}
+        sample = compute_container_sample(stats, state)
+        self.cpu_usage.labels(container=container_name).set(sample["cpu_percent"])
+        self.memory_usage.labels(container=container_name).set(sample["memory_percent"])
+        if sample["network_sent"] is not None:
+            self.network_sent.labels(container=container_name).set(sample["network_sent"])
+            self.network_recv.labels(container=container_name).set(sample["network_recv"])
+        if sample["disk_read"] is not None:
+            self.disk_read.labels(container=container_name).set(sample["disk_read"])
+            self.disk_write.labels(container=container_name).set(sample["disk_write"])
+        return sample
+
+    def _adaptive_sample(self, container):
+        """
+        Sampler callback: returns the signals whose volatility sets the container's rate.
+        """
+        state = self.states.setdefault(container.name, {"net_io": None, "blk_io": None}) if self.table is None else None
+        try:
+            sample = self.sample_container(container, state)
+        except Exception:
+            self.self_metrics.drop("docker_container", "error")
+            raise
+        return {"cpu_percent": sample["cpu_percent"], "memory_percent": sample["memory_percent"]}
+
+    def _start_sampler(self):
+        self.sampler = AdaptiveSampler(
+            self._adaptive_sample,
+            min_interval=float(os.getenv('SAMPLE_MIN_INTERVAL', 1)),
+            max_interval=float(os.getenv('SAMPLE_MAX_INTERVAL', 60)),
+            budget=float(os.getenv('SAMPLE_BUDGET', 50)),
+            workers=int(os.getenv('SAMPLE_WORKERS', 64)),
+            on_interval=lambda name, seconds: self.sample_interval.labels(container=name).set(seconds))
+        self.self_metrics.register_queue("adaptive_sampler_scheduled", lambda: len(self.sampler.heap))
+        threading.Thread(target=self.sampler.run, name="adaptive-sampler", daemon=True).start()
+
+    def _start_stream_pool(self):
+        self.stream_pool = StatsStreamPool(
+            self.client, max_connections=int(os.getenv('STATS_STREAM_MAX_CONNECTIONS', 100)),
+            on_drop=lambda reason: self.self_metrics.drop("docker_container", reason))
+        self.self_metrics.register_queue("stats_stream_connections", lambda: len(self.stream_pool.connections))
+        self.self_metrics.register_queue("stats_stream_waiting", lambda: len(self.stream_pool.waiting))
+        # Containers beyond the connection limit are polled; anything still without a recent frame is exported
+        register_unsampled(self.stream_pool, self.registry, max_age=float(os.getenv('STATS_UNSAMPLED_AFTER', 30)))
+        threading.Thread(target=self.stream_pool.run_poller, name="stats-stream-poller", daemon=True).start()
+        threading.Thread(target=self.publish_stream_samples, name="stats-stream-publisher", daemon=True).start()
+
+    def publish_stream_samples(self, interval=5):
+        """
+        Derive the gauges from the latest streamed frame of each container. Frames arrive
+        continuously, so network/disk deltas are available from the second publish on.
+        """
+        published = {}  # container name -> frame count at the last publish
+        while not self.stream_pool.stop_event.wait(interval):
+            with self.self_metrics.time_stage("docker_container", "publish"):
+                latest = self.stream_pool.latest()
+                for name, slot in latest.items():
+                    if published.get(name) == slot.frames:
+                        continue  # No new frame since the last publish
+                    published[name] = slot.frames
+                    if self.table is not None and self.recorder is None:
+                        self.table.write(name, (slot.cpu_total, slot.precpu_total, slot.system, slot.presystem,
+                                                slot.num_cpus, slot.mem_usage, slot.mem_limit, slot.net_tx,
+                                                slot.net_rx, slot.blk_read, slot.blk_write))
+                    else:
+                        state = self.states.setdefault(name, {"net_io": None, "blk_io": None})
+                        self.record_stats(name, slot.as_stats(), state)
+                    self.self_metrics.mark_sample("docker_container", name)
+                for name in [n for n in published if n not in latest]:
+                    del published[name]
+
+    def _track(self, container):
+        if self.collection_mode == "adaptive":
+            # The interval gauge appears once two samples have completed
+            self.sampler.add(container.name, container)
+        elif self.collection_mode == "stream":
+            self.stream_pool.watch(container)
+        else:
+            threading.Thread(target=self.monitor_container, args=(container,), daemon=True).start()
+
+    def _untrack(self, container_name):
+        if self.collection_mode == "adaptive":
+            # After remove() returns the sampler no longer reports an interval for the container
+            self.sampler.remove(container_name)
+            try:
+                self.sample_interval.remove(container_name)
+            except KeyError:
+                pass  # Removed before an interval was measured
+        elif self.collection_mode == "stream":
+            self.stream_pool.unwatch(container_name)
+        self.states.pop(container_name, None)
+        if self.table is not None:
+            self.table.remove(container_name)
+        self.self_metrics.forget("docker_container", container_name)
+
     def monitor_all_containers(self):
         """
-        Start monitoring threads for all currently running containers.
+        Start monitoring all currently running containers.
         """
+        if self.collection_mode == "adaptive" and self.sampler is None:
+            self._start_sampler()
+        elif self.collection_mode == "stream" and self.stream_pool is None:
+            self._start_stream_pool()
         containers = self.client.containers.list()
         for container in containers:
-            threading.Thread(target=self.monitor_container, args=(container,), daemon=True).start()
+            self._track(container)
 
     def auto_detect_new_containers(self):
         """
         Continuously checks for new containers that have started and begins monitoring them.
         """
-        monitored_ids = {c.id for c in self.client.containers.list()}
+        monitored = {c.id: c.name for c in self.client.containers.list()}
         while True:
             current_containers = self.client.containers.list()
             for container in current_containers:
-                if container.id not in monitored_ids:
+                if container.id not in monitored:
                     logging.info(f"New container detected: {container.name}")
-                    threading.Thread(target=self.monitor_container, args=(container,), daemon=True).start()
-                    monitored_ids.add(container.id)
+                    self._track(container)
+                    monitored[container.id] = container.name
+            current_ids = {c.id for c in current_containers}
+            for container_id in [i for i in monitored if i not in current_ids]:
+                self._untrack(monitored.pop(container_id))
             time.sleep(10)  # Check for new containers every 10 seconds
 
 def main():
@@ -135,8 +298,13 @@ def main():
     start_http_server(8001)
     logging.info("Prometheus metrics server started on port 8001.")
 
+    # Metrics about the monitor itself, on their own port so they never mix with container metrics.
+    start_http_server(8002, registry=pipeline_metrics.registry)
+    logging.info("Internal monitor metrics server started on port 8002.")
+
     # Initialize the Docker metrics monitor with your Docker daemon URL.
-    docker_monitor = DockerMetricsMonitor(docker_url="tcp://172.27.36.125:2375")
+    # Raw stats frames are also logged for offline replay when SAMPLE_RECORD_PATH is set.
+    docker_monitor = DockerMetricsMonitor(docker_url="tcp://172.27.36.125:2375", recorder=SampleRecorder.from_env())
     
     # Begin monitoring all running containers.
     docker_monitor.monitor_all_containers()
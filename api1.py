@@ -1,11 +1,47 @@
 import time
 import logging
+import re
 import requests
-from prometheus_client import Gauge, generate_latest, CollectorRegistry
+from prometheus_client import Counter, Gauge, generate_latest, CollectorRegistry, multiprocess
 from webob import Request, Response  # type: ignore
 import psutil
 import threading
 import os
+import fcntl
+from Profiler import profiling
+
+# Multi-worker mode: set PROMETHEUS_MULTIPROC_DIR to an empty directory shared by the workers
+# in the server's environment before it starts (e.g. `gunicorn -w 4 api1:app1`). Metric values
+# then live in per-process memory-mapped files that /metrics aggregates, using each metric's
+# multiprocess_mode, and the psutil samplers run in a single elected worker.
+MULTIPROC_DIR = os.getenv('PROMETHEUS_MULTIPROC_DIR') or os.getenv('prometheus_multiproc_dir')
+ENDPOINTS = ("/get_data", "/metrics", "/cputask", "/memorytask", "/networktask")
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def cleanup_dead_workers(path):
+    """
+    Remove the live-gauge files of worker processes that no longer exist, so their last
+    values stop showing up in the aggregate. Counter files are kept: their totals must survive.
+    """
+    pids = set()
+    for name in os.listdir(path):
+        match = re.match(r"gauge_live\w+_(\d+)\.db$", name)
+        if match:
+            pids.add(int(match.group(1)))
+    for pid in pids:
+        if pid != os.getpid() and not _pid_alive(pid):
+            logging.info(f"Cleaning up metrics of dead worker {pid}")
+            multiprocess.mark_process_dead(pid, path)
 
 
 class API1:
@@ -13,10 +49,19 @@ class API1:
         # Create a registry and gauge for tracking the API response time
         self.registry = CollectorRegistry()
 
-        # Metric for API response duration
+        # Metric for API response duration; the latest value written by any worker
         self.api_response_duration = Gauge(
             'api_response_duration_seconds',
             'Duration of the API response in seconds',
+            registry=self.registry,
+            multiprocess_mode='mostrecent'
+        )
+
+        # Requests handled, summed over all workers (including ones that have exited)
+        self.requests_total = Counter(
+            'api1_requests_total',
+            'Requests handled by the API, by endpoint',
+            ['endpoint'],
             registry=self.registry
         )
 
@@ -24,35 +69,70 @@ class API1:
         self.cpu_usage_gauge = Gauge(
             'custom_app_cpu_usage_percent',
             'CPU usage of the custom application (percentage)',
-            registry=self.registry
+            registry=self.registry,
+            multiprocess_mode='livemax'  # Only the sampler worker sets the host gauges
         )
 
         # Metric for Memory usage (in percentage)
         self.memory_usage_gauge = Gauge(
             'custom_app_memory_usage_percent',
             'Memory usage of the custom application (percentage)',
-            registry=self.registry
+            registry=self.registry,
+            multiprocess_mode='livemax'
         )
 
         # Metrics for Network Bandwidth (in bytes per second)
         self.network_sent_gauge = Gauge(
             'custom_app_network_sent_bytes_per_second',
             'Network bandwidth (bytes sent per second)',
-            registry=self.registry
+            registry=self.registry,
+            multiprocess_mode='livemax'
         )
         self.network_recv_gauge = Gauge(
             'custom_app_network_recv_bytes_per_second',
             'Network bandwidth (bytes received per second)',
-            registry=self.registry
+            registry=self.registry,
+            multiprocess_mode='livemax'
         )
 
+        if MULTIPROC_DIR:
+            # Scrapes aggregate the files of all workers instead of this process's registry
+            self.scrape_registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(self.scrape_registry, MULTIPROC_DIR)
+            self._sampler_lock = None
+            threading.Thread(target=self._elect_sampler, name="api1-sampler-election", daemon=True).start()
+        else:
+            self.scrape_registry = self.registry
+            self.start_samplers()
+
+    def start_samplers(self):
         # Start background threads to update CPU, memory usage, and network bandwidth
         self.start_cpu_usage_thread()
         self.start_memory_usage_thread()
         self.start_network_bandwidth_thread()
 
+    def _elect_sampler(self, retry=5):
+        """
+        Run the samplers only in the worker holding the sampler lock, so psutil work is not
+        repeated per worker. The others keep trying and take over when that worker exits.
+        """
+        lock_file = open(os.path.join(MULTIPROC_DIR, "sampler.lock"), "a")
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                time.sleep(retry)
+        self._sampler_lock = lock_file  # Held for the life of the process
+        logging.info(f"Worker {os.getpid()} runs the samplers")
+        self.start_samplers()
+        while True:
+            cleanup_dead_workers(MULTIPROC_DIR)
+            time.sleep(retry * 2)
+
     def __call__(self, environ, start_response):
         request = Request(environ)
+        self.requests_total.labels(endpoint=request.path if request.path in ENDPOINTS else "other").inc()
         if request.path == "/get_data":
             return self.get_data(environ, start_response)
         elif request.path == "/metrics":
@@ -63,6 +143,8 @@ class API1:
             return self.memory_intensive_task(environ, start_response)
         elif request.path == "/networktask":
             return self.network_bandwidth_intensive_task(environ, start_response)
+        elif request.path.startswith("/debug/profile/"):
+            return self.profile(request, environ, start_response)
         else:
             response = Response()
             response.text = "Invalid endpoint"
@@ -202,12 +284,31 @@ class API1:
             response.status = 500
             return response(environ, start_response)
 
+    def profile(self, request, environ, start_response):
+        """Time-boxed CPU or allocation profile of the whole process (admin token required)."""
+        kind = request.path[len("/debug/profile/"):]
+        status, content_type, body, headers = profiling.handle(kind, request.GET, request.headers)
+        response = Response(body=body, status=status, content_type=content_type)
+        response.headers.update(headers)
+        return response(environ, start_response)
+
     def metrics(self, environ, start_response):
         # Generate the metrics in Prometheus format
-        metrics_data = generate_latest(self.registry)
+        metrics_data = generate_latest(self.scrape_registry)
         return Response(body=metrics_data, content_type='text/plain')(environ, start_response)
 
 
+_api1 = None
+_api1_lock = threading.Lock()
+
+
 # Example WSGI entry point
 def app1(environ, start_response):
-    return API1()(environ, start_response)
+    # One API1 per worker process, created on its first request so that its threads and the
+    # sampler lock belong to the worker even when the server forks after importing this module
+    global _api1
+    if _api1 is None:
+        with _api1_lock:
+            if _api1 is None:
+                _api1 = API1()
+    return _api1(environ, start_response)
@@ -1,16 +1,25 @@
 import threading
-from flask import Flask, Response, jsonify, render_template, request
+from flask import Blueprint, Flask, Response, current_app, jsonify, render_template, request
 import logging
 import os
 
 from CustomAppMetrics import CustomAppMetricsMonitor
 from ResolveAlert import ResolveAlert
-from DockerMetrics import DockerMetricsMonitor
-from prometheus_client.parser import text_fd_to_metric_families
-from io import StringIO
+from DockerMetrics import DockerMetricsMonitor, connect_docker, update_docker_service
+from AlertRuleEvaluator import AlertRuleEvaluator, run_evaluator
+from StatusStream import StatusBroadcaster
+from NodeAgent import ClusterAggregator
+from SelfMetrics import pipeline_metrics
+from Profiler import profiling
+from SampleRecorder import SampleRecorder
+from Federation import ExpositionParser, FederationScraper, parse_aggregation
+from AnomalyDetector import AnomalyDetector, run_detector
+from BulkUpdate import BulkUpdater
+from EnergyBudget import EnergyBudgetController, parse_budgets, run_controller
+from Deadline import backend_guard, current_deadline
+from StatusApi import ApiError, build_page, filter_alerts, filter_status, render_json
 import psutil
 import requests
-import docker
 
 
 
@@ -18,29 +27,255 @@ import docker
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
 
 
-# Initialize the Flask app with the custom templates folder
-app = Flask(__name__, template_folder='View')
+# Routes are registered on the app built by create_app()
+routes = Blueprint('monitoring', __name__)
 
-# Initialize CustomAppMetrics
-app_names = ["custom_app"]
-custom_app_metrics = CustomAppMetricsMonitor(app_names)
-resolve_alerts = ResolveAlert()
 
-# Initialize DockerMetrics
-docker_metrics = DockerMetricsMonitor()
+class MonitoringServices:
+    """
+    Collaborators of the web app, created on first use so that importing app.py or
+    building the app makes no network calls. Background collectors only run between
+    start() and stop(). Pass a docker_client (or fakes for the monitors) in tests.
+    """
+
+    def __init__(self, app_names=None, docker_url=None, prometheus_url=None, alertmanager_url=None,
+                 docker_client=None, custom_app_metrics=None, docker_metrics=None, resolve_alerts=None):
+        self.app_names = app_names or ["custom_app"]
+        self.docker_url = docker_url or os.getenv('DOCKER_URL', 'tcp://localhost:2375')
+        self.prometheus_url = prometheus_url or os.getenv('PROMETHEUS_URL', 'http://localhost:9090')
+        self.alertmanager_url = alertmanager_url or os.getenv('ALERTMANAGER_URL', 'http://172.27.36.125:9093')
+
+        self._docker_client = docker_client
+        self._custom_app_metrics = custom_app_metrics
+        self._docker_metrics = docker_metrics
+        self._resolve_alerts = resolve_alerts
+        self._status_broadcaster = None
+        self._aggregator = None
+        self._recorder = None
+        self._federation = None
+        self._anomaly_detector = None
+        self._bulk_updater = None
+        self._energy_budget = None
+        self._lock = threading.RLock()
+        self._stop_event = threading.Event()
+        self._threads = []
+
+    @property
+    def docker_client(self):
+        with self._lock:
+            if self._docker_client is None:
+                # Also shared with the service monitor, bulk updater, remediation and energy controller;
+                # none of them hold stats streams, so every call gets the timeout and a stuck daemon
+                # can't hold a socket forever
+                self._docker_client = connect_docker(self.docker_url, timeout=int(os.getenv('DOCKER_TIMEOUT', 10)))
+            return self._docker_client
+
+    @property
+    def custom_app_metrics(self):
+        with self._lock:
+            if self._custom_app_metrics is None:
+                self._custom_app_metrics = CustomAppMetricsMonitor(self.app_names, recorder=self.recorder)
+            return self._custom_app_metrics
+
+    @property
+    def docker_metrics(self):
+        with self._lock:
+            if self._docker_metrics is None:
+                # Shares the lazily created client instead of opening its own connection
+                self._docker_metrics = DockerMetricsMonitor(self.docker_url, client_factory=lambda: self.docker_client,
+                                                            recorder=self.recorder)
+            return self._docker_metrics
+
+    @property
+    def recorder(self):
+        # Raw sample log for offline replay, only when SAMPLE_RECORD_PATH is set
+        with self._lock:
+            if self._recorder is None:
+                self._recorder = SampleRecorder.from_env()
+            return self._recorder
+
+    @property
+    def federation(self):
+        # Merged view of the replicas listed in FEDERATION_TARGETS (comma-separated /metrics URLs)
+        with self._lock:
+            if self._federation is None:
+                targets = [target for target in os.getenv('FEDERATION_TARGETS', '').split(',') if target]
+                if not targets:
+                    return None
+                aggregation = [spec for spec in os.getenv('FEDERATION_AGGREGATE', '').split(',') if spec]
+                self._federation = FederationScraper(targets, parse_aggregation(aggregation),
+                                                     timeout=float(os.getenv('FEDERATION_TIMEOUT', 5)))
+            return self._federation
+
+    @property
+    def anomaly_detector(self):
+        with self._lock:
+            if self._anomaly_detector is None:
+                self._anomaly_detector = AnomalyDetector(capacity=int(os.getenv('ANOMALY_CAPACITY', 100000)),
+                                                         threshold=float(os.getenv('ANOMALY_THRESHOLD', 5)))
+            return self._anomaly_detector
+
+    @property
+    def bulk_updater(self):
+        # Service updates are rate limited per daemon URL, shared by every batch
+        with self._lock:
+            if self._bulk_updater is None:
+                self._bulk_updater = BulkUpdater(self.docker_client, daemon=self.docker_url,
+                                                 max_in_flight=int(os.getenv('BULK_MAX_IN_FLIGHT', 8)),
+                                                 rate=float(os.getenv('DOCKER_UPDATE_RATE', 10)),
+                                                 burst=int(os.getenv('DOCKER_UPDATE_BURST', 20)),
+                                                 max_retries=int(os.getenv('BULK_MAX_RETRIES', 3)))
+            return self._bulk_updater
+
+    @property
+    def energy_budget(self):
+        # Per-service power budgets enforced through CPU quotas, only when ENERGY_BUDGETS is set
+        with self._lock:
+            if self._energy_budget is None:
+                budgets = parse_budgets(os.getenv('ENERGY_BUDGETS', ''))
+                if not budgets:
+                    return None
+                self._energy_budget = EnergyBudgetController(
+                    budgets, min_cpu=float(os.getenv('ENERGY_MIN_CPU', 0.1)),
+                    max_cpu=float(os.getenv('ENERGY_MAX_CPU', 2)),
+                    min_update_interval=float(os.getenv('ENERGY_MIN_UPDATE_INTERVAL', 120)))
+            return self._energy_budget
+
+    @property
+    def resolve_alerts(self):
+        with self._lock:
+            if self._resolve_alerts is None:
+                self._resolve_alerts = ResolveAlert(self.docker_url, client_factory=lambda: self.docker_client)
+            return self._resolve_alerts
+
+    @property
+    def aggregator(self):
+        # Cluster view merged from the node agents (NodeAgent.py), if any are deployed
+        with self._lock:
+            if self._aggregator is None:
+                self._aggregator = ClusterAggregator(agent_timeout=float(os.getenv('AGENT_TIMEOUT', 30)))
+            return self._aggregator
+
+    @property
+    def status_broadcaster(self):
+        # One background evaluation per interval, shared by every open dashboard
+        with self._lock:
+            if self._status_broadcaster is None:
+                broadcaster = StatusBroadcaster(
+                    lambda: evaluate_utilization(self),
+                    lambda: fetch_prometheus_alerts(self.alertmanager_url),
+                    interval=float(os.getenv('STATUS_STREAM_INTERVAL', 5)),
+                    deadline=float(os.getenv('STATUS_DEADLINE', 3)))
+                pipeline_metrics.register_queue("status_stream_subscribers", lambda: len(broadcaster.subscribers))
+                pipeline_metrics.register_queue("status_stream_pending_events",
+                                                broadcaster.pending_events)
+                self._status_broadcaster = broadcaster
+            return self._status_broadcaster
+
+    def start(self, embedded_alert_rules=None):
+        """
+        Start the background collectors: Docker service monitoring and, unless disabled,
+        the embedded alert rule evaluator.
+        """
+        if embedded_alert_rules is None:
+            embedded_alert_rules = os.getenv('EMBEDDED_ALERT_RULES', 'true').lower() == 'true'
+        self._stop_event.clear()
+        self._start_thread(self.docker_metrics.monitor_all_services, "docker-monitoring")
+        if embedded_alert_rules:
+            self._start_thread(self._run_alert_rule_evaluation, "alert-rule-evaluation")
+        if os.getenv('ANOMALY_DETECTION', 'true').lower() == 'true':
+            self._start_thread(self._run_anomaly_detection, "anomaly-detection")
+        if self.energy_budget is not None:
+            self._start_thread(self._run_energy_budget, "energy-budget")
+
+    def stop(self, timeout=5):
+        self._stop_event.set()
+        if self._docker_metrics is not None:
+            self._docker_metrics.stop()
+        if self._recorder is not None:
+            self._recorder.flush()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _start_thread(self, target, name):
+        thread = threading.Thread(target=target, name=name, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def _run_alert_rule_evaluation(self):
+        """
+        Evaluate docker/alert.rules.yml in-process against the collectors' live samples.
+        """
+        rules_file = os.getenv('ALERT_RULES_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'docker', 'alert.rules.yml'))
+        interval = float(os.getenv('ALERT_EVALUATION_INTERVAL', 1))
+        evaluator = AlertRuleEvaluator.from_file(rules_file, on_fire=self._remediate_fired_alert)
+        run_evaluator(evaluator, [self.docker_metrics.registry, self.custom_app_metrics.registry,
+                                  self.aggregator.registry],
+                      interval=interval, stop_event=self._stop_event)
+
+    def _run_anomaly_detection(self):
+        """
+        Score every collected series against its own EWMA and seasonal baseline.
+        """
+        run_detector(self.anomaly_detector, [self.docker_metrics.registry, self.custom_app_metrics.registry,
+                                             self.aggregator.registry],
+                     interval=float(os.getenv('ANOMALY_INTERVAL', 15)), stop_event=self._stop_event)
+
+    def _run_energy_budget(self):
+        """
+        Keep each budgeted service's attributed power at its budget by adjusting its CPU limit.
+        """
+        run_controller(self.energy_budget, self.docker_client, self.bulk_updater, self.docker_metrics.registry,
+                       watts_per_core=float(os.getenv('ENERGY_WATTS_PER_CORE', 10)),
+                       interval=float(os.getenv('ENERGY_BUDGET_INTERVAL', 15)), stop_event=self._stop_event)
+
+    def _remediate_fired_alert(self, alert):
+        """
+        Callback for the embedded evaluator: remediate as soon as an alert enters the firing state.
+        """
+        logging.warning(f"Alert {alert['alertname']} firing for {alert['service']}: {alert['description']}")
+        dispatch_remediation(self.resolve_alerts, alert['alertname'], alert['service'], alert['source'])
+
+
+def get_services():
+    return current_app.extensions['monitoring']
+
+
+def create_app(services=None, start_collectors=None):
+    """
+    Application factory. Building the app is side-effect free; background collectors are
+    started only when start_collectors is true (default: START_COLLECTORS env var).
+    """
+    flask_app = Flask(__name__, template_folder='View')
+    flask_app.extensions['monitoring'] = services or MonitoringServices()
+    flask_app.register_blueprint(routes)
+
+    if start_collectors is None:
+        start_collectors = os.getenv('START_COLLECTORS', 'false').lower() == 'true'
+    if start_collectors:
+        flask_app.extensions['monitoring'].start()
+    return flask_app
 
-@app.route('/metrics', methods=['GET'])
+
+@routes.route('/metrics', methods=['GET'])
 def metrics():
     """
     Expose the /metrics endpoint to Prometheus for scraping.
     Collects both custom app and Docker container metrics.
     """
     try:
-        custom_metrics_data = custom_app_metrics.get_metrics()
-        docker_metrics_data = docker_metrics.get_metrics()
-
-        # Combine both custom app and Docker container metrics
-        combined_metrics = custom_metrics_data + docker_metrics_data
+        services = get_services()
+        custom_metrics_data = services.custom_app_metrics.get_metrics()
+        docker_metrics_data = services.docker_metrics.get_metrics()
+        cluster_metrics_data = services.aggregator.get_metrics()
+        anomaly_metrics_data = services.anomaly_detector.get_metrics()
+        energy_budget = services.energy_budget
+        energy_budget_data = energy_budget.get_metrics() if energy_budget is not None else ""
+
+        # Combine custom app, Docker service, node agent, anomaly and energy budget metrics
+        combined_metrics = (custom_metrics_data + docker_metrics_data + cluster_metrics_data + anomaly_metrics_data +
+                            energy_budget_data)
         
         return Response(combined_metrics, content_type='text/plain')
     except Exception as e:
@@ -49,59 +284,152 @@ def metrics():
     
 
 
-def parse_metrics(prometheus_text):
+@routes.route('/agent/push', methods=['POST'])
+def agent_push():
     """
-    Parses Prometheus metrics text output and converts it into a dictionary.
+    Receive a batch of container updates from a node agent; the reply carries its container assignment.
     """
-    parsed_metrics = {}
     try:
-        for family in text_fd_to_metric_families(StringIO(prometheus_text)):
-            for sample in family.samples:
-                labels = tuple(sample.labels.items())
-                parsed_metrics[(family.name, labels)] = sample.value
-    except Exception as e:
-        logging.error(f"Error parsing metrics: {e}")
-    
-    return parsed_metrics
+        reply = get_services().aggregator.handle_push(request.get_data(), request.headers.get('Content-Encoding'))
+        return jsonify(reply)
+    except (ValueError, KeyError, OSError) as e:
+        logging.error(f"Invalid agent batch: {e}")
+        return jsonify({"error": f"Invalid agent batch: {e}"}), 400
+
+
+@routes.route('/agent/cluster', methods=['GET'])
+def agent_cluster():
+    """
+    Per-service totals over every node, merged from the node agents' pushes.
+    """
+    return jsonify(get_services().aggregator.cluster_view())
+
+
+@routes.route('/internal/metrics', methods=['GET'])
+def internal_metrics():
+    """
+    Metrics about the monitor itself (collector stages, backend latency, sample age),
+    kept apart from the application metrics on /metrics.
+    """
+    return Response(pipeline_metrics.get_metrics(), content_type='text/plain')
+
+
+@routes.route('/debug/profile/<kind>', methods=['GET'])
+def profile(kind):
+    """
+    Time-boxed CPU or allocation profile of the whole process (admin token required).
+    """
+    status, content_type, body, headers = profiling.handle(kind, request.args, request.headers)
+    return Response(body, status=status, content_type=content_type, headers=headers)
 
 
-def start_docker_monitoring():
+@routes.route('/federate', methods=['GET'])
+def federate():
     """
-    Starts Docker monitoring in a separate thread.
+    One merged view of the replicas in FEDERATION_TARGETS, scraped on request.
     """
-    docker_metrics.monitor_all_containers()
+    federation = get_services().federation
+    if federation is None:
+        return Response("No federation targets configured (FEDERATION_TARGETS)", status=404, content_type='text/plain')
+    with pipeline_metrics.time_stage("federation", "scrape"):
+        federation.scrape()
+    with pipeline_metrics.time_stage("federation", "render"):
+        return Response(federation.render(), content_type='text/plain')
+
+
+# Shared so that series seen in earlier calls are already interned
+_exposition_parser = ExpositionParser()
+
+
+def parse_metrics(prometheus_text):
+    """
+    Parses Prometheus metrics text output into {(sample name, sorted label pairs): value}.
+    """
+    try:
+        return _exposition_parser.parse(prometheus_text)
+    except ValueError as e:
+        logging.error(f"Error parsing metrics: {e}")
+        return {}
 
 
-@app.route('/grafana_dashboard')
+@routes.route('/grafana_dashboard')
 def grafana_dashboard():
     grafana_dashboard_id = os.getenv('GRAFANA_DASHBOARD_ID', '')  # Get the private IP
     return render_template('metrics_dashboard.html', grafana_dashboard_id=grafana_dashboard_id)
 
-@app.route('/metrics_status', methods=['GET'])
+@routes.route('/metrics_status', methods=['GET'])
 def metrics_status():
     try:
 
         logging.info("Starting metrics and alerts from prometheus.. ")
-        # Get recommendations and evaluate utilization
-        status_messages = evaluate_utilization()
-
-        # Fetch Prometheus alerts
-        alerts = fetch_prometheus_alerts()
+        # Recommendations and alerts come from the snapshot shared with the live stream
+        version, status_messages, alerts = get_services().status_broadcaster.snapshot()
 
         # If no status messages or alerts, show success message
         if not status_messages and not alerts:
-            return render_template("status.html", message="✅ All applications, services, and alerts are optimal.")
+            return render_template("status.html", message="✅ All applications, services, and alerts are optimal.",
+                                   stream_url="/metrics_status/stream")
 
         # Combine status messages and alerts into a single data structure
-        return render_template("metrics_status.html", status_messages=status_messages, alerts=alerts)
+        return render_template("metrics_status.html", status_messages=status_messages, alerts=alerts, version=version)
 
     except Exception as e:
         logging.error(f"Error evaluating metrics: {e}")
         return render_template("error.html", error_message=str(e))
 
 
+@routes.route('/metrics_status/stream', methods=['GET'])
+def metrics_status_stream():
+    """
+    Server-Sent Events: a full snapshot on connect, then only the changed status rows and alerts.
+    """
+    return Response(get_services().status_broadcaster.stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+def json_page(build):
+    """
+    Serve a JSON page with a strong ETag, answering 304 when the client already has it.
+    """
+    try:
+        payload = build()
+    except ApiError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    body, etag = render_json(payload)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(body, content_type='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+@routes.route('/api/status', methods=['GET'])
+def api_status():
+    """
+    Utilization status as JSON. Query: level, resource, fields, limit, cursor.
+    """
+    def build():
+        _, status_messages, _ = get_services().status_broadcaster.snapshot()
+        return build_page(filter_status(status_messages, request.args), 'name', request.args)
+    return json_page(build)
+
+
+@routes.route('/api/alerts', methods=['GET'])
+def api_alerts():
+    """
+    Active alerts as JSON. Query: severity, state, source, fields, limit, cursor.
+    """
+    def build():
+        _, _, alerts = get_services().status_broadcaster.snapshot()
+        return build_page(filter_alerts(alerts, request.args), 'key', request.args)
+    return json_page(build)
+
+
 # Flask routes for alert handling
-@app.route('/resolve_alert', methods=['POST'])
+@routes.route('/resolve_alert', methods=['POST'])
 def resolve_alert():
     # Get the data sent by the frontend
     data = request.get_json()  # Get the JSON data
@@ -115,21 +443,31 @@ def resolve_alert():
 
     service_name = stack_name + service_name
     # Perform resolution based on the alertname and source
+    dispatch_remediation(get_services().resolve_alerts, alert_name, service_name, source)
+
+    return jsonify({"status": "success", "message": f"Alert {alert_name} for {service_name} from {source} resolved."})
+
+
+def dispatch_remediation(resolve_alerts, alert_name, service_name, source):
+    """
+    Route an alert to the matching ResolveAlert handler.
+    Shared by the /resolve_alert route and the embedded alert rule evaluator.
+    """
     if source == "docker":
         if alert_name == "HighCPUUsage":
-            resolve_alerts.handle_high_cpu_usage(service_name)
+            return resolve_alerts.handle_high_cpu_usage(service_name)
         elif alert_name == "HighMemoryUsage":
-            resolve_alerts.handle_high_memory_usage(service_name)
+            return resolve_alerts.handle_high_memory_usage(service_name)
     elif source == "custom_app":
         if alert_name == "HighAppCpuUsage":
-            resolve_alerts.handle_app_high_cpu_usage(service_name)
+            return resolve_alerts.handle_app_high_cpu_usage(source, service_name)
         elif alert_name == "HighAppMemoryUsage":
-            resolve_alerts.handle_app_high_memory_usage(source,service_name)
-        
+            return resolve_alerts.handle_app_high_memory_usage(source, service_name)
+    logging.info(f"No remediation registered for alert {alert_name} from {source}")
+    return None
 
-    return jsonify({"status": "success", "message": f"Alert {alert_name} for {service_name} from {source} resolved."})
 
-@app.route('/scale_up', methods=['POST'])
+@routes.route('/scale_up', methods=['POST'])
 def scale_up():
     try:
         data = request.json
@@ -137,23 +475,23 @@ def scale_up():
         service_name = data['service']
         scale_factor = int(data.get('scale_factor', 1))  # Default to increasing by 1
 
-        docker_url = os.getenv('DOCKER_URL', 'tcp://localhost:2375')
-        dockerClient = docker.DockerClient(base_url=docker_url)
+        dockerClient = get_services().docker_client
 
-        service = next((s for s in dockerClient.services.list() if s.name == stack_name + service_name), None)
+        service = next((s for s in list_docker_services(dockerClient, fallback=False)
+                        if s.name == stack_name + service_name), None)
         if service is None:
             return jsonify({"error": "Service not found"}), 404
 
         current_replicas = service.attrs['Spec']['Mode'].get('Replicated', {}).get('Replicas', 1)
         new_replicas = current_replicas + scale_factor
 
-        service.update(mode={"Replicated": {"Replicas": new_replicas}})
+        update_docker_service(service, mode={"Replicated": {"Replicas": new_replicas}})
         return jsonify({"status": "success", "message": f"Scaled up {service_name} to {new_replicas} replicas"})
     except Exception as e:
         return jsonify({"status": "failed","error": str(e)}), 500
 
 
-@app.route('/scale_down', methods=['POST'])
+@routes.route('/scale_down', methods=['POST'])
 def scale_down():
     try:
         data = request.json
@@ -161,28 +499,66 @@ def scale_down():
         stack_name = "my_thesis_"
         scale_factor = int(data.get('scale_factor', 1))  # Default to decreasing by 1
 
-        docker_url = os.getenv('DOCKER_URL', 'tcp://localhost:2375')
-        dockerClient = docker.DockerClient(base_url=docker_url)
+        dockerClient = get_services().docker_client
 
-        service = next((s for s in dockerClient.services.list() if s.name == stack_name + service_name), None)
+        service = next((s for s in list_docker_services(dockerClient, fallback=False)
+                        if s.name == stack_name + service_name), None)
         if service is None:
             return jsonify({"error": "Service not found"}), 404
 
         current_replicas = service.attrs['Spec']['Mode'].get('Replicated', {}).get('Replicas', 1)
         new_replicas = max(0, current_replicas - scale_factor)  # Ensure replicas don't go negative
 
-        service.update(mode={"Replicated": {"Replicas": new_replicas}})
+        update_docker_service(service, mode={"Replicated": {"Replicas": new_replicas}})
         return jsonify({"status": "success", "message": f"Scaled down {service_name} to {new_replicas} replicas"})
     except Exception as e:
         return jsonify({"status": "failed","error": str(e)}), 500
 
 
-def fetch_prometheus_alerts():
+@routes.route('/bulk_update', methods=['POST'])
+def bulk_update():
+    """
+    Apply a batch of scale/limit changes (see BulkUpdate.py); one result per item, in order.
+    "dry_run": true only validates.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get('items'), list):
+        return jsonify({"status": "error", "message": "Expected a JSON object with an items list"}), 400
+    try:
+        report = get_services().bulk_updater.run(data['items'], stack_name=data.get('stack', "my_thesis_"),
+                                                 dry_run=bool(data.get('dry_run', False)))
+    except Exception as e:
+        return jsonify({"status": "failed", "error": str(e)}), 500
+    failed = any(result['status'] in ("invalid", "failed") for result in report['results'])
+    report['status'] = "partial" if failed else "success"
+    return jsonify(report), 207 if failed else 200
+
+
+def list_docker_services(client, fallback=True):
+    """
+    services.list() under the docker circuit breaker and the current deadline. With fallback,
+    a failed or timed-out call returns the last list (or [] if there is none); otherwise it raises.
+    """
+    def list_services(timeout):
+        with pipeline_metrics.time_backend("docker", "services.list"):
+            return client.services.list()
+    return backend_guard.call("docker", "services.list", list_services, default=[], in_thread=True,
+                              fallback=fallback)
+
+
+def fetch_prometheus_alerts(alertmanager_url=None):
     """Fetch active alerts from Prometheus /alerts endpoint."""
+    alertmanager_url = alertmanager_url or os.getenv('ALERTMANAGER_URL', 'http://172.27.36.125:9093')
+
+    def fetch(timeout):
+        with pipeline_metrics.time_backend("alertmanager", "alerts"):
+            response = requests.get(f"{alertmanager_url}/api/v2/alerts", timeout=timeout)
+            response.raise_for_status()
+        return response.json()
+
     try:
-        response = requests.get(f"{os.getenv('ALERTMANAGER_URL', 'http://172.27.36.125:9093')}/api/v2/alerts")
-        response.raise_for_status()
-        alerts_data = response.json()
+        # On failure the last good alert list is shown rather than none
+        alerts_data = backend_guard.call("alertmanager", "alerts", fetch, default=[])
 
         # Loop through each alert and extract necessary data
         alerts = []
@@ -212,15 +588,54 @@ def fetch_prometheus_alerts():
         return []
     
 
-def evaluate_utilization():
-    status_messages = []
+def evaluate_utilization(services):
+    with pipeline_metrics.time_stage("status", "evaluate_utilization"):
+        return _evaluate_utilization(services)
+
+
+def _evaluate_utilization(services):
+    prometheus_url = services.prometheus_url
+    deadline = current_deadline()
+    if deadline is not None:
+        deadline.plan(1)
+    docker_services = list_docker_services(services.docker_client)  # Get a list of all running services
+    if deadline is not None:
+        # Three queries per app and four per service share what is left of the budget
+        deadline.plan(3 * len(services.app_names) + 4 * len(docker_services))
+    entries = build_status(services.app_names, [service.name for service in docker_services],
+                           lambda query: get_metrics_from_prometheus(query, prometheus_url))
+    return add_anomaly_scores(entries, services.anomaly_detector)
+
+
+def add_anomaly_scores(entries, detector):
+    """
+    Add each entry's highest anomaly score and a recommendation based on it.
+    """
+    scores = detector.scores_by_name()
+    for entry in entries:
+        score = scores.get(entry['name'], 0.0)
+        entry['anomaly'] = round(score, 2)
+        if score >= detector.threshold:
+            entry['anomaly_recommendation'] = "⚠️ Unusual behaviour compared with its usual pattern. Investigate."
+        else:
+            entry['anomaly_recommendation'] = "✅ Behaviour matches its usual pattern."
+    return entries
+
+
+def build_status(app_names, service_names, query):
+    """
+    Status entries with recommendations for the given apps and Docker services.
+    `query(promql)` returns the current value of an instant selector, or None.
+    """
+    # Entries keyed by name so repeated apps/services are found in O(1)
+    status_by_name = {}
 
     # Loop through app names for custom metrics
     for app_name in app_names:
         # Fetch the custom application metrics from Prometheus
-        cpu_usage = get_metrics_from_prometheus(f"cpu_usage{{app='{app_name}'}}")
-        memory_usage = get_metrics_from_prometheus(f"memory_usage{{app='{app_name}'}}")
-        energy_usage = get_metrics_from_prometheus(f"energy_used_joules{{app='{app_name}'}}")
+        cpu_usage = query(f"cpu_usage{{app='{app_name}'}}")
+        memory_usage = query(f"memory_usage{{app='{app_name}'}}")
+        energy_usage = query(f"energy_used_joules{{app='{app_name}'}}")
 
         # Fallback to 0 if metrics are None
         cpu_usage = cpu_usage if cpu_usage is not None else 0
@@ -231,7 +646,7 @@ def evaluate_utilization():
             print(f"Metrics for app '{app_name}' are missing or 0. Using default values.")
 
         # Check if app already exists in the list
-        app_entry = next((entry for entry in status_messages if entry['name'] == app_name), None)
+        app_entry = status_by_name.get(app_name)
         if app_entry is None:
             app_entry = {
                 'name': app_name,
@@ -242,7 +657,7 @@ def evaluate_utilization():
                 'memory_recommendation': "✅ Memory usage is optimal.",
                 'energy_recommendation': "✅ Energy consumption is low."
             }
-            status_messages.append(app_entry)
+            status_by_name[app_name] = app_entry
 
         # Recommendation based on CPU usage
         if cpu_usage < 70:
@@ -269,17 +684,12 @@ def evaluate_utilization():
             app_entry['energy_recommendation'] = "❌ High energy consumption. Consider optimizing."
 
     # Now evaluate Docker service metrics
-    docker_url = os.getenv('DOCKER_URL', 'tcp://localhost:2375')
-    dockerClient = docker.DockerClient(base_url=docker_url)
-    services = dockerClient.services.list()  # Get a list of all running services
-
-    for service in services:
-        service_name = service.name
+    for service_name in service_names:
         # Fetch Docker service metrics from Prometheus (you might need to adjust the metric names to match those for services)
-        cpu_usage = get_metrics_from_prometheus(f"docker_service_cpu_usage_percent{{service='{service_name}'}}")
-        memory_usage = get_metrics_from_prometheus(f"docker_service_memory_usage_mb{{service='{service_name}'}}")
-        cpu_energy = get_metrics_from_prometheus(f"docker_service_cpu_energy_consumption_watt_hour{{service='{service_name}'}}")
-        memory_energy = get_metrics_from_prometheus(f"docker_service_memory_energy_consumption_watt_hour{{service='{service_name}'}}")
+        cpu_usage = query(f"docker_service_cpu_usage_percent{{service='{service_name}'}}")
+        memory_usage = query(f"docker_service_memory_usage_mb{{service='{service_name}'}}")
+        cpu_energy = query(f"docker_service_cpu_energy_consumption_watt_hour{{service='{service_name}'}}")
+        memory_energy = query(f"docker_service_memory_energy_consumption_watt_hour{{service='{service_name}'}}")
 
         # Fallback to 0 if any metric is None
         cpu_usage = cpu_usage if cpu_usage is not None else 0
@@ -291,7 +701,7 @@ def evaluate_utilization():
             print(f"Metrics for service '{service_name}' are missing or 0. Using default values.")
 
         # Check if service already exists in the list
-        service_entry = next((entry for entry in status_messages if entry['name'] == service_name), None)
+        service_entry = status_by_name.get(service_name)
         if service_entry is None:
             service_entry = {
                 'name': service_name,
@@ -302,7 +712,7 @@ def evaluate_utilization():
                 'memory_recommendation': "✅ Memory usage is optimal.",
                 'energy_recommendation': "✅ Energy consumption is low."
             }
-            status_messages.append(service_entry)
+            status_by_name[service_name] = service_entry
 
         # Recommendation based on CPU usage for Docker service
         if cpu_usage < 70:
@@ -328,7 +738,7 @@ def evaluate_utilization():
         else:
             service_entry['energy_recommendation'] = "❌ High energy consumption. Consider optimizing."
 
-    return status_messages
+    return list(status_by_name.values())
 
 
 
@@ -354,38 +764,33 @@ def get_total_memory_capacity(app_name=None):
     return total_memory_mb  # Return the system's total memory in MB
 
     
-def get_metrics_from_prometheus(query):
-    try:
-        prometheus_url=os.getenv('PROMETHEUS_URL', 'http://localhost:9090')
-        # prometheus_url = "http://localhost:9090"
+def get_metrics_from_prometheus(query, prometheus_url=None):
+    prometheus_url = prometheus_url or os.getenv('PROMETHEUS_URL', 'http://localhost:9090')
+
+    def run_query(timeout):
+        with pipeline_metrics.time_backend("prometheus", "query"):
+            response = requests.get(f"{prometheus_url}/api/v1/query?query={query}", timeout=timeout)
+            data = response.json()
 
-        response = requests.get(f"{prometheus_url}/api/v1/query?query={query}")
-        data = response.json()
-        
         if data['status'] == 'success' and data['data']['result']:
             return float(data['data']['result'][0]['value'][1])  # return the value of the metric
         else:
             return None
-    except Exception as e:
-        print(f"Error querying Prometheus: {e}")
-        return None
 
-def start_docker_monitoring():
-    """
-    Starts Docker monitoring in a separate thread.
-    """
-    docker_metrics.monitor_all_services()
+    # Errors, timeouts and an open breaker fall back to the query's last value, else None
+    return backend_guard.call("prometheus", query, run_query)
 
-monitoring_thread = threading.Thread(target=start_docker_monitoring)
-monitoring_thread.start()
+# Module-level app for `flask run` and `waitress-serve app:app`; building it is cheap and offline.
+# It never starts collectors: production uses `waitress-serve --call app:create_app` with
+# START_COLLECTORS=true, and importing this module must not start a second set.
+app = create_app(start_collectors=False)
 
 if __name__ == "__main__":
     # Start monitoring in separate threads
-    # monitoring_thread = threading.Thread(target=start_docker_monitoring)
-    # monitoring_thread.start()
+    app.extensions['monitoring'].start()
 
     # Start Flask application
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    app.run(host='0.0.0.0', port=5000, debug=True, use_reloader=False)
 
 
 
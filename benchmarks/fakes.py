@@ -0,0 +1,304 @@
+"""
+In-process stand-ins for the Docker API, Prometheus and Alertmanager, used by the
+benchmarks (and usable from any test) so the collectors and app paths can run at
+any scale without a daemon or a monitoring stack.
+"""
+import hashlib
+import json
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from urllib.parse import parse_qs, urlparse
+
+from docker.errors import APIError
+
+STACK_PREFIX = "my_thesis_"
+
+
+def make_stats(rng, tick, num_cpus=4):
+    """
+    A Docker stats frame with monotonically increasing counters, shaped like the
+    output of container.stats(stream=False).
+    """
+    system = 10 ** 12 + tick * 4 * 10 ** 9
+    cpu_total = tick * rng.randint(10 ** 7, 10 ** 9)
+    return {
+        "read": f"2025-01-01T00:00:{tick % 60:02d}Z",
+        "cpu_stats": {
+            "cpu_usage": {"total_usage": cpu_total, "percpu_usage": [cpu_total // num_cpus] * num_cpus},
+            "system_cpu_usage": system,
+            "online_cpus": num_cpus,
+        },
+        "precpu_stats": {
+            "cpu_usage": {"total_usage": max(0, cpu_total - rng.randint(10 ** 6, 10 ** 8))},
+            "system_cpu_usage": system - 4 * 10 ** 9,
+        },
+        "memory_stats": {"usage": rng.randint(50, 900) * 1024 ** 2, "limit": 1024 ** 3},
+        "networks": {
+            "eth0": {"rx_bytes": tick * rng.randint(1000, 100000), "tx_bytes": tick * rng.randint(1000, 100000)},
+        },
+        "blkio_stats": {
+            "io_service_bytes_recursive": [
+                {"major": 8, "minor": 0, "op": "Read", "value": tick * rng.randint(0, 10 ** 6)},
+                {"major": 8, "minor": 0, "op": "Write", "value": tick * rng.randint(0, 10 ** 6)},
+            ],
+        },
+    }
+
+
+class FakeContainer:
+    def __init__(self, name, service_name, seed=0, stats_delay=0.0, stream_interval=1.0):
+        self.name = name
+        self.status = "running"
+        self.id = hashlib.sha256(name.encode()).hexdigest()
+        self.labels = {"com.docker.swarm.service.name": service_name}
+        self.attrs = {"Name": f"/{name}", "Config": {"Labels": self.labels}}
+        self.stats_delay = stats_delay
+        self.stream_interval = stream_interval  # The daemon emits one frame per second
+        self._rng = random.Random(seed)
+        self._tick = 1
+        self._lock = threading.Lock()
+
+    def stats(self, stream=False, decode=False):
+        if self.stats_delay:
+            threading.Event().wait(self.stats_delay)
+        if stream:
+            return self._stream(decode)
+        with self._lock:
+            self._tick += 1
+            return make_stats(self._rng, self._tick)
+
+    def reload(self):
+        return self
+
+    def _stream(self, decode):
+        while True:
+            if self.stream_interval:
+                threading.Event().wait(self.stream_interval)
+            with self._lock:
+                self._tick += 1
+                frame = make_stats(self._rng, self._tick)
+            yield frame if decode else json.dumps(frame).encode() + b"\n"
+
+
+class FakeService:
+    """
+    `update_delay` seconds per update; `conflict_rate` of updates fail as if another
+    writer got there first ("update out of sequence"), until the service is reloaded.
+    """
+
+    def __init__(self, name, replicas=1, update_delay=0.0, conflict_rate=0.0, seed=0):
+        self.name = name
+        self.id = hashlib.sha256(name.encode()).hexdigest()[:25]
+        self.version = 1
+        self.attrs = {
+            "ID": self.id,
+            "Version": {"Index": self.version},
+            "Spec": {
+                "Name": name,
+                "Mode": {"Replicated": {"Replicas": replicas}},
+                "TaskTemplate": {"Resources": {"Limits": {}, "Reservations": {"NanoCPUs": 250000000,
+                                                                             "MemoryBytes": 128 * 1024 ** 2}}},
+            },
+        }
+        self.updates = []
+        self.update_delay = update_delay
+        self.conflict_rate = conflict_rate
+        self.stale = False
+        self._rng = random.Random(seed)
+
+    def update(self, **kwargs):
+        if self.update_delay:
+            threading.Event().wait(self.update_delay)
+        if self.stale or (self.conflict_rate and self._rng.random() < self.conflict_rate):
+            self.stale = True
+            raise APIError("rpc error: code = Unknown desc = update out of sequence")
+        self.updates.append(kwargs)
+        self.version += 1
+        self.attrs["Version"]["Index"] = self.version
+        if "mode" in kwargs:
+            self.attrs["Spec"]["Mode"] = kwargs["mode"]
+        if "task_template" in kwargs:
+            self.attrs["Spec"]["TaskTemplate"].update(kwargs["task_template"])
+        if "resources" in kwargs:
+            self.attrs["Spec"]["TaskTemplate"]["Resources"] = dict(kwargs["resources"])
+        return True
+
+    def reload(self):
+        self.stale = False
+        return self
+
+
+class FakeDockerClient:
+    """
+    Swarm-like client with `num_services` services and `num_containers` containers spread over them.
+    services.list()/get() take `api_delay` seconds and fail with `api_error_rate`; both can be
+    changed on a running client to inject faults mid-test.
+    """
+
+    def __init__(self, num_containers=10, num_services=None, stats_delay=0.0, seed=0, stream_interval=1.0,
+                 update_delay=0.0, conflict_rate=0.0, api_delay=0.0, api_error_rate=0.0):
+        self.api_delay = api_delay
+        self.api_error_rate = api_error_rate
+        self.rng = random.Random(seed)
+        num_services = num_services or max(1, num_containers // 2)
+        self._services = [FakeService(f"{STACK_PREFIX}service-{i}", update_delay=update_delay,
+                                      conflict_rate=conflict_rate, seed=seed + i) for i in range(num_services)]
+        self._containers = []
+        for i in range(num_containers):
+            service = self._services[i % num_services]
+            self._containers.append(FakeContainer(f"{service.name}.{i}", service.name, seed=seed + i,
+                                                  stats_delay=stats_delay, stream_interval=stream_interval))
+
+        self.containers = SimpleNamespace(list=self._list_containers, get=self._get_container)
+        self.services = SimpleNamespace(list=self._list_services, get=self._get_service)
+        self.nodes = SimpleNamespace(list=lambda **kwargs: [])
+
+    def _list_containers(self, all=False, filters=None):
+        label = (filters or {}).get("label")
+        if label:
+            key, _, value = label.partition("=")
+            return [c for c in self._containers if c.labels.get(key) == value]
+        return list(self._containers)
+
+    def _get_container(self, container_id):
+        for container in self._containers:
+            if container_id in (container.id, container.name):
+                return container
+        raise KeyError(container_id)
+
+    def _service_call(self):
+        if self.api_delay:
+            threading.Event().wait(self.api_delay)
+        if self.api_error_rate and self.rng.random() < self.api_error_rate:
+            raise APIError("injected daemon failure")
+
+    def _list_services(self, filters=None):
+        self._service_call()
+        return list(self._services)
+
+    def _get_service(self, service_id):
+        self._service_call()
+        for service in self._services:
+            if service_id in (service.id, service.name):
+                return service
+        raise KeyError(service_id)
+
+
+class _BackendHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        backend = self.server.backend
+        backend.requests += 1
+        if backend.latency:
+            threading.Event().wait(backend.latency)
+        if backend.hang_rate and backend.rng.random() < backend.hang_rate:
+            threading.Event().wait(backend.hang_seconds)
+        if backend.error_rate and backend.rng.random() < backend.error_rate:
+            self._send(500, {"status": "error", "error": "injected failure"})
+            return
+
+        url = urlparse(self.path)
+        if url.path == "/api/v1/query":
+            query = parse_qs(url.query).get("query", [""])[0]
+            value = backend.rng.uniform(0, 100)
+            self._send(200, {"status": "success", "data": {"resultType": "vector", "result": [
+                {"metric": {"__query__": query}, "value": [0, f"{value:.3f}"]}]}})
+        elif url.path == "/api/v2/alerts":
+            self._send(200, backend.alerts)
+        elif url.path == "/-/healthy":
+            self._send(200, {"status": "ok"})
+        else:
+            self._send(404, {"status": "error", "error": "not found"})
+
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # The client gave up on a slow response
+
+
+class FakeBackend:
+    """
+    Prometheus query API and Alertmanager v2 alerts API on a local port.
+    `latency` and `error_rate` inject faults, `hang_rate` of requests stall for `hang_seconds`.
+    All four can be changed while the backend is running.
+    """
+
+    def __init__(self, num_alerts=0, latency=0.0, error_rate=0.0, seed=0, hang_rate=0.0, hang_seconds=60.0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.hang_rate = hang_rate
+        self.hang_seconds = hang_seconds
+        self.rng = random.Random(seed)
+        self.requests = 0
+        self.alerts = [{
+            "labels": {"alertname": "HighCPUUsage", "severity": "critical", "source": "docker",
+                       "instance": f"{STACK_PREFIX}service-{i}:8000"},
+            "annotations": {"description": f"CPU usage is high for service service-{i}"},
+            "status": {"state": "active"},
+        } for i in range(num_alerts)]
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _BackendHandler)
+        self.server.daemon_threads = True
+        self.server.backend = self
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def write_series_exports(directory, num_services=10, days=30, step=300, services_per_file=50, seed=0):
+    """
+    Prometheus query_range JSON exports of docker_service_cpu_usage_percent and
+    docker_service_memory_usage_mb for `num_services` services over `days` days, one file
+    per metric and `services_per_file` services, as EnergyReport reads them. Returns the paths.
+    """
+    import os
+
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    timestamps = np.arange(1700000000, 1700000000 + days * 86400, step, dtype=np.float64)
+    daily = np.sin(2 * np.pi * (timestamps % 86400) / 86400)
+    paths = []
+    for first in range(0, num_services, services_per_file):
+        names = [f"{STACK_PREFIX}service-{i}" for i in range(first, min(num_services, first + services_per_file))]
+        for metric, base, swing in (("docker_service_cpu_usage_percent", 30, 20),
+                                    ("docker_service_memory_usage_mb", 50, 10)):
+            result = []
+            for name in names:
+                values = np.clip(base + swing * daily + rng.normal(0, 5, len(timestamps)), 0, 100)
+                result.append({"metric": {"__name__": metric, "service": name},
+                               "values": [[t, f"{v:.3f}"] for t, v in zip(timestamps.tolist(), values.tolist())]})
+            path = os.path.join(directory, f"{metric}-{first}.json")
+            with open(path, "w") as f:
+                json.dump({"status": "success", "data": {"resultType": "matrix", "result": result}}, f)
+            paths.append(path)
+    return paths
@@ -0,0 +1,346 @@
+"""
+Benchmarks for the collector, exposition and status paths against in-process fakes.
+
+Every (case, scale) pair runs in its own interpreter so peak RSS and thread counts are
+not polluted by earlier cases. Results are written as JSON and can be compared with a
+previous run to catch regressions:
+
+    python benchmarks/run_benchmarks.py --output bench.json
+    python benchmarks/run_benchmarks.py --output new.json --compare bench.json --threshold 0.2
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_SCALES = [10, 100, 1000, 5000]
+
+
+def case_monitor_container(scale):
+    """api.DockerMetricsMonitor.sample_container over every container."""
+    from prometheus_client import CollectorRegistry
+    from api import DockerMetricsMonitor
+    from fakes import FakeDockerClient
+
+    client = FakeDockerClient(num_containers=scale)
+    monitor = DockerMetricsMonitor(client=client, registry=CollectorRegistry())
+    containers = client.containers.list()
+    states = {c.name: {"net_io": None, "blk_io": None} for c in containers}
+
+    def run():
+        for container in containers:
+            monitor.sample_container(container, states[container.name])
+    return run, None
+
+
+def _record_and_scrape(scale, state_mode):
+    from prometheus_client import CollectorRegistry, generate_latest
+    from api import DockerMetricsMonitor
+    from fakes import FakeDockerClient
+
+    client = FakeDockerClient(num_containers=scale)
+    registry = CollectorRegistry()
+    monitor = DockerMetricsMonitor(client=client, registry=registry, state_mode=state_mode)
+    containers = client.containers.list()
+    frames = [(c.name, c.stats(), {"net_io": None, "blk_io": None}) for c in containers]
+
+    def run():
+        for name, stats, state in frames:
+            monitor.record_stats(name, stats, state)
+        generate_latest(registry)
+    return run, None
+
+
+def case_record_containers(scale):
+    """One stats frame per container into the columnar state table, then one scrape."""
+    return _record_and_scrape(scale, "columnar")
+
+
+def case_record_containers_gauges(scale):
+    """The same with per-sample Gauge updates, for comparison."""
+    return _record_and_scrape(scale, "gauges")
+
+
+def case_custom_app_metrics(scale):
+    """CustomAppMetrics.CustomAppMetricsMonitor.get_metrics with `scale` apps."""
+    from CustomAppMetrics import CustomAppMetricsMonitor
+
+    monitor = CustomAppMetricsMonitor([f"app-{i}" for i in range(scale)])
+    return monitor.get_metrics, None
+
+
+def case_app_metrics(scale):
+    """GET /metrics on the Flask app with `scale` Docker services in the registry."""
+    import app
+    from fakes import FakeDockerClient
+
+    services = app.MonitoringServices(docker_client=FakeDockerClient(num_services=scale, num_containers=scale))
+    docker_metrics = services.docker_metrics
+    for i in range(scale):
+        name = f"my_thesis_service-{i}"
+        for gauge in (docker_metrics.cpu_usage, docker_metrics.memory_usage, docker_metrics.network_sent,
+                      docker_metrics.network_recv, docker_metrics.disk_read, docker_metrics.disk_write,
+                      docker_metrics.cpu_energy_consumption, docker_metrics.memory_energy_consumption):
+            gauge.labels(service=name).set(i)
+    client = app.create_app(services).test_client()
+
+    def run():
+        response = client.get('/metrics')
+        assert response.status_code == 200
+    return run, None
+
+
+def case_evaluate_utilization(scale):
+    """app.evaluate_utilization with `scale` services against the fake Prometheus."""
+    import app
+    from fakes import FakeBackend, FakeDockerClient
+
+    backend = FakeBackend().start()
+    services = app.MonitoringServices(docker_client=FakeDockerClient(num_services=scale, num_containers=scale),
+                                      prometheus_url=backend.url, alertmanager_url=backend.url)
+
+    def run():
+        entries = app.evaluate_utilization(services)
+        assert len(entries) == scale + len(services.app_names)
+    return run, backend.stop
+
+
+def case_metrics_status(scale):
+    """GET /metrics_status rendering `scale` status rows and alerts from a warm snapshot."""
+    import app
+    from fakes import FakeBackend, FakeDockerClient
+
+    backend = FakeBackend(num_alerts=scale).start()
+    services = app.MonitoringServices(docker_client=FakeDockerClient(num_services=scale, num_containers=scale),
+                                      prometheus_url=backend.url, alertmanager_url=backend.url)
+    services.status_broadcaster.interval = 3600  # Measure rendering, not the backend round trips
+    services.status_broadcaster.snapshot()
+    client = app.create_app(services).test_client()
+
+    def run():
+        response = client.get('/metrics_status')
+        assert response.status_code == 200
+    return run, backend.stop
+
+
+def case_status_refresh_degraded(scale):
+    """
+    Status recomputation with `scale` services while half the Prometheus queries hang;
+    each refresh should stay within the STATUS_DEADLINE budget.
+    """
+    import app
+    from fakes import FakeBackend, FakeDockerClient
+
+    backend = FakeBackend(num_alerts=scale, hang_rate=0.5, hang_seconds=30).start()
+    services = app.MonitoringServices(docker_client=FakeDockerClient(num_services=scale, num_containers=scale),
+                                      prometheus_url=backend.url, alertmanager_url=backend.url)
+    broadcaster = services.status_broadcaster
+
+    def run():
+        started = time.perf_counter()
+        broadcaster.refresh()
+        assert time.perf_counter() - started < broadcaster.deadline + 0.5
+    return run, backend.stop
+
+
+def case_energy_report(scale):
+    """
+    EnergyReport.build_report over query_range exports of one day of 5-minute samples for
+    `scale` services (a month is ~30x the points).
+    """
+    import shutil
+    import tempfile
+
+    import EnergyReport
+    from fakes import write_series_exports
+
+    directory = tempfile.mkdtemp()
+    paths = write_series_exports(directory, num_services=scale, days=1)
+    options = {"watts_per_core": 10.0, "cpu_limit": 1.0, "limits": {}, "replicas": {}, "default_replicas": 1,
+               "max_gap": 3.0, "price": 0.1}
+
+    def run():
+        report = EnergyReport.build_report(paths, options)
+        assert report["totals"]["services"] == scale
+    return run, lambda: shutil.rmtree(directory)
+
+
+def _exposition_text(scale):
+    """Exposition text with exactly `scale` samples: labelled gauges, counters and histogram buckets."""
+    lines = ["# HELP docker_container_cpu_usage_percent CPU usage percent for Docker containers",
+             "# TYPE docker_container_cpu_usage_percent gauge",
+             "# TYPE api1_requests_total counter",
+             "# TYPE request_duration_seconds histogram"]
+    for i in range(scale):
+        if i % 3 == 0:
+            lines.append(f'docker_container_cpu_usage_percent{{container="my_thesis_service-{i}.1"}} {i * 0.37:.4f}')
+        elif i % 3 == 1:
+            lines.append(f'api1_requests_total{{endpoint="/get_data",code="200",replica="{i}"}} {i * 11}.0')
+        else:
+            lines.append(f'request_duration_seconds_bucket{{endpoint="/cputask",le="{i * 0.001:.3f}"}} {i}.0')
+    return "\n".join(lines) + "\n"
+
+
+def case_parse_exposition(scale):
+    """app.parse_metrics (Federation.ExpositionParser) over `scale` samples; throughput is samples/s."""
+    import app
+
+    text = _exposition_text(scale)
+
+    def run():
+        assert len(app.parse_metrics(text)) == scale
+    return run, None
+
+
+def case_parse_exposition_reference(scale):
+    """prometheus_client's text_string_to_metric_families over the same text, for comparison."""
+    from prometheus_client.parser import text_string_to_metric_families
+
+    text = _exposition_text(scale)
+
+    def run():
+        assert sum(len(family.samples) for family in text_string_to_metric_families(text)) == scale
+    return run, None
+
+
+CASES = {
+    "monitor_container": case_monitor_container,
+    "record_containers": case_record_containers,
+    "record_containers_gauges": case_record_containers_gauges,
+    "custom_app_metrics": case_custom_app_metrics,
+    "app_metrics": case_app_metrics,
+    "evaluate_utilization": case_evaluate_utilization,
+    "metrics_status": case_metrics_status,
+    "status_refresh_degraded": case_status_refresh_degraded,
+    "energy_report": case_energy_report,
+    "parse_exposition": case_parse_exposition,
+    "parse_exposition_reference": case_parse_exposition_reference,
+}
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def run_case(name, scale, min_iterations, max_seconds):
+    import psutil
+
+    logging.disable(logging.WARNING)
+    process = psutil.Process()
+    run, teardown = CASES[name](scale)
+    run()  # Warm-up, not measured
+
+    latencies = []
+    peak_threads = process.num_threads()
+    started = time.perf_counter()
+    while len(latencies) < min_iterations or time.perf_counter() - started < max_seconds:
+        t0 = time.perf_counter()
+        run()
+        latencies.append(time.perf_counter() - t0)
+        peak_threads = max(peak_threads, process.num_threads())
+        if len(latencies) >= min_iterations and time.perf_counter() - started >= max_seconds:
+            break
+    total = time.perf_counter() - started
+
+    if teardown:
+        teardown()
+
+    return {
+        "case": name,
+        "scale": scale,
+        "iterations": len(latencies),
+        "throughput_items_per_second": scale * len(latencies) / total,
+        "latency_p50_seconds": statistics.median(latencies),
+        "latency_p99_seconds": _percentile(latencies, 0.99),
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "peak_threads": peak_threads,
+    }
+
+
+def run_isolated(name, scale, args):
+    command = [sys.executable, os.path.abspath(__file__), "--worker", name, str(scale),
+               "--min-iterations", str(args.min_iterations), "--max-seconds", str(args.max_seconds)]
+    completed = subprocess.run(command, cwd=ROOT, capture_output=True, text=True)
+    if completed.returncode != 0:
+        return {"case": name, "scale": scale, "error": completed.stderr.strip().splitlines()[-1:]}
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def compare(results, baseline, threshold):
+    """
+    Return the regressions: p50 latency up or throughput down by more than `threshold`.
+    """
+    previous = {(r["case"], r["scale"]): r for r in baseline["results"] if "error" not in r}
+    regressions = []
+    for result in results:
+        old = previous.get((result["case"], result["scale"]))
+        if old is None or "error" in result:
+            continue
+        latency_change = result["latency_p50_seconds"] / old["latency_p50_seconds"] - 1
+        throughput_change = result["throughput_items_per_second"] / old["throughput_items_per_second"] - 1
+        if latency_change > threshold or throughput_change < -threshold:
+            regressions.append({"case": result["case"], "scale": result["scale"],
+                                "latency_p50_change": round(latency_change, 3),
+                                "throughput_change": round(throughput_change, 3)})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--cases", default=",".join(CASES), help="Comma separated subset of: " + ", ".join(CASES))
+    parser.add_argument("--scales", default=",".join(map(str, DEFAULT_SCALES)))
+    parser.add_argument("--min-iterations", type=int, default=3)
+    parser.add_argument("--max-seconds", type=float, default=2.0, help="Time budget per case and scale")
+    parser.add_argument("--output", default="bench_output.json")
+    parser.add_argument("--compare", help="Previous results file to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed relative slowdown")
+    parser.add_argument("--worker", nargs=2, metavar=("CASE", "SCALE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        name, scale = args.worker
+        print(json.dumps(run_case(name, int(scale), args.min_iterations, args.max_seconds)))
+        return
+
+    results = []
+    for name in args.cases.split(","):
+        for scale in map(int, args.scales.split(",")):
+            result = run_isolated(name, scale, args)
+            results.append(result)
+            if "error" in result:
+                print(f"{name:22} {scale:>6}  ERROR {result['error']}")
+            else:
+                print(f"{name:22} {scale:>6}  {result['throughput_items_per_second']:>12.1f} items/s  "
+                      f"p50 {result['latency_p50_seconds'] * 1000:>9.2f} ms  p99 {result['latency_p99_seconds'] * 1000:>9.2f} ms  "
+                      f"rss {result['peak_rss_mb']:>7.1f} MB  threads {result['peak_threads']}")
+
+    report = {
+        "meta": {"timestamp": time.time(), "python": platform.python_version(), "platform": platform.platform()},
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
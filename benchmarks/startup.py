@@ -0,0 +1,73 @@
+"""
+Cold-start benchmark for app.py.
+
+Each run happens in a fresh interpreter and measures importing app.py, building an app
+with create_app() and serving a first request. Socket connections are counted through
+the `socket.connect` audit hook, so any network call during cold start is reported.
+
+    python benchmarks/startup.py --runs 5 --output startup.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_CHILD = r"""
+import json, sys, time
+connects = []
+sys.addaudithook(lambda event, args: connects.append(repr(args[1])) if event == "socket.connect" else None)
+
+t0 = time.perf_counter()
+import app
+t1 = time.perf_counter()
+flask_app = app.create_app()
+t2 = time.perf_counter()
+response = flask_app.test_client().get('/grafana_dashboard')
+t3 = time.perf_counter()
+
+print(json.dumps({
+    "import_seconds": t1 - t0,
+    "create_app_seconds": t2 - t1,
+    "first_request_seconds": t3 - t2,
+    "first_request_status": response.status_code,
+    "socket_connects": connects,
+}))
+"""
+
+
+def run_once():
+    env = dict(os.environ, START_COLLECTORS="false")
+    output = subprocess.run([sys.executable, "-c", _CHILD], cwd=ROOT, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    runs = [run_once() for _ in range(args.runs)]
+    summary = {"runs": len(runs)}
+    for field in ("import_seconds", "create_app_seconds", "first_request_seconds"):
+        values = [run[field] for run in runs]
+        summary[field] = {"median": statistics.median(values), "max": max(values)}
+    summary["socket_connects"] = sorted({c for run in runs for c in run["socket_connects"]})
+
+    print(json.dumps(summary, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(summary, f, indent=2)
+
+    if summary["socket_connects"]:
+        print("Cold start opened network connections", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
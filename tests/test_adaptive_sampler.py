@@ -0,0 +1,74 @@
+import random
+import threading
+import time
+
+from AdaptiveSampler import AdaptiveSampler
+
+
+def _run(sampler, seconds):
+    stop = threading.Event()
+    thread = threading.Thread(target=sampler.run, args=(stop,), daemon=True)
+    thread.start()
+    time.sleep(seconds)
+    stop.set()
+    thread.join(5)
+
+
+def test_blocking_samples_reach_the_budget_and_report_the_achieved_interval():
+    # 100 volatile targets, each sample blocking 0.1 s: at a budget of 250/s every target
+    # should be sampled about every 0.4 s, which needs about 25 samples in flight
+    completions = {}
+    reported = {}
+    lock = threading.Lock()
+
+    def sample(key):
+        time.sleep(0.1)
+        with lock:
+            completions.setdefault(key, []).append(time.monotonic())
+        return {"cpu": random.uniform(0, 100)}
+
+    def on_interval(key, seconds):
+        reported[key] = seconds
+
+    sampler = AdaptiveSampler(sample, min_interval=0.2, max_interval=1.0, budget=250, on_interval=on_interval)
+    for key in range(100):
+        sampler.add(key, key)
+    _run(sampler, 3.0)
+
+    achieved = [(times[-1] - times[0]) / (len(times) - 1) for times in completions.values() if len(times) > 1]
+    mean_achieved = sum(achieved) / len(achieved)
+    mean_reported = sum(reported.values()) / len(reported)
+    assert len(achieved) == 100
+    assert mean_achieved < 0.6
+    assert abs(mean_reported - mean_achieved) < 0.25 * mean_achieved
+    assert sampler.concurrency() >= 20
+
+
+def test_flat_targets_back_off_and_volatile_ones_do_not():
+    def sample(key):
+        return {"cpu": random.uniform(0, 100) if key == "volatile" else 10.0}
+
+    sampler = AdaptiveSampler(sample, min_interval=0.05, max_interval=0.4, budget=0)
+    sampler.add("volatile", "volatile")
+    sampler.add("flat", "flat")
+    _run(sampler, 1.5)
+    assert sampler.entries["volatile"].desired == 0.05
+    assert sampler.entries["flat"].desired == 0.4
+
+
+def test_no_interval_is_reported_after_remove():
+    reported = []
+    sampler = AdaptiveSampler(lambda key: {"cpu": random.uniform(0, 100)}, min_interval=0.01, max_interval=0.05,
+                              on_interval=lambda key, seconds: reported.append(key))
+    sampler.add("gone", "gone")
+    stop = threading.Event()
+    thread = threading.Thread(target=sampler.run, args=(stop,), daemon=True)
+    thread.start()
+    time.sleep(0.3)
+    sampler.remove("gone")
+    count = len(reported)
+    time.sleep(0.2)
+    stop.set()
+    thread.join(5)
+    assert count > 0
+    assert len(reported) == count
@@ -0,0 +1,50 @@
+import os
+
+from AlertRuleEvaluator import AlertRuleEvaluator
+
+import app
+
+RULES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "docker", "alert.rules.yml")
+SERVICE = "my_thesis_prometheus"
+
+
+class _Resolver:
+    def __init__(self):
+        self.calls = []
+
+    def handle_high_cpu_usage(self, service_name):
+        self.calls.append(service_name)
+        return {"status": "success"}
+
+
+def test_only_the_service_cpu_rule_is_evaluable_in_process():
+    evaluator = AlertRuleEvaluator.from_file(RULES)
+    evaluable, missing = evaluator.evaluable({"docker_service_cpu_usage_percent", "docker_service_memory_usage_mb"})
+    assert [(rule.group, rule.name) for rule in evaluable] == [("alert_group", "HighCPUUsage")]
+    assert len(missing) == len(evaluator.rules) - 1
+
+
+def test_service_cpu_alert_reaches_docker_remediation():
+    resolver = _Resolver()
+    evaluator = AlertRuleEvaluator.from_file(
+        RULES, on_fire=lambda alert: app.dispatch_remediation(resolver, alert['alertname'], alert['service'],
+                                                              alert['source']))
+    sample = [("docker_service_cpu_usage_percent", {"service": SERVICE}, 95.0)]
+    evaluator.observe(sample, 0)
+    evaluator.evaluate(0)
+    evaluator.observe(sample, 61)
+    firing = evaluator.evaluate(61)
+    assert [alert['source'] for alert in firing] == ["docker"]
+    assert resolver.calls == [SERVICE]
+
+
+def test_unchanged_gauges_are_not_reevaluated():
+    evaluator = AlertRuleEvaluator.from_file(RULES)
+    sample = [("docker_service_cpu_usage_percent", {"service": "other"}, 10.0)]
+    evaluator.observe(sample, 0)
+    assert len(evaluator.dirty) == 1
+    evaluator.evaluate(0)
+    evaluator.observe(sample, 1)
+    assert not evaluator.dirty
+    evaluator.observe([("docker_service_cpu_usage_percent", {"service": "other"}, 11.0)], 2)
+    assert len(evaluator.dirty) == 1
@@ -0,0 +1,51 @@
+import numpy as np
+
+from AnomalyDetector import AnomalyDetector
+
+STEP = 15.0  # Seconds between ticks, as run_detector's default interval
+WARM = 400
+
+
+def _scores(shape, ticks, seed=0):
+    """
+    Scores of one series fed `shape(tick after warm-up) + noise` every STEP seconds.
+    """
+    rng = np.random.default_rng(seed)
+    detector = AnomalyDetector(capacity=4)
+    scores = []
+    for tick in range(-WARM, ticks):
+        detector.update([("m", ())], [shape(tick) + rng.normal(0, 2)], now=(tick + WARM) * STEP)
+        if tick >= 0:
+            scores.append(float(detector.score[detector.rows[("m", ())]]))
+    return np.array(scores)
+
+
+def test_noise_stays_under_the_threshold():
+    assert _scores(lambda tick: 50.0, 600).max() < 5.0
+
+
+def test_sustained_step_keeps_scoring_for_more_than_an_hour():
+    scores = _scores(lambda tick: 150.0 if tick >= 0 else 50.0, 600)
+    assert scores[0] > 20
+    # Neither the seasonal bins nor the level may learn the new level within minutes
+    assert (scores[:240] >= 5.0).all()
+
+
+def test_slow_leak_is_flagged():
+    # Doubles over 75 minutes (300 ticks), then keeps growing at the same rate
+    scores = _scores(lambda tick: 50.0 * (1 + max(tick, 0) / 300), 600)
+    assert scores[:100].max() < 5.0
+    assert scores[300] >= 5.0
+
+
+def test_eviction_never_frees_rows_of_series_seen_in_the_same_tick():
+    detector = AnomalyDetector(capacity=4)
+    detector.update([("a", ())], [1.0], now=0)
+    detector.update([("b", ()), ("c", ()), ("d", ())], [1.0, 1.0, 1.0], now=5)
+    # "a" is the least recently seen row, but it is part of this tick
+    keys = [("a", ()), ("e", ()), ("f", ())]
+    detector.update(keys, [2.0, 3.0, 4.0], now=10)
+    rows = [detector.rows[key] for key in keys]
+    assert len(set(rows)) == 3
+    assert [detector.row_keys[row] for row in rows] == keys
+    assert list(detector.value[rows]) == [2.0, 3.0, 4.0]
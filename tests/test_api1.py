@@ -0,0 +1,60 @@
+import multiprocessing
+import os
+import time
+
+from prometheus_client import CollectorRegistry, multiprocess
+from webob import Request
+
+from api1 import API1, cleanup_dead_workers
+
+
+def _worker(requests, reports, done):
+    # Runs in a spawned process, with PROMETHEUS_MULTIPROC_DIR already in its environment
+    api = API1()
+    for _ in range(requests):
+        Request.blank("/unknown").get_response(api)
+    deadline = time.monotonic() + 3
+    while api._sampler_lock is None and time.monotonic() < deadline:
+        time.sleep(0.05)
+    reports.put((os.getpid(), api._sampler_lock is not None))
+    done.wait(30)
+
+
+def test_workers_share_counters_and_elect_one_sampler(tmp_path, monkeypatch):
+    monkeypatch.setenv("PROMETHEUS_MULTIPROC_DIR", str(tmp_path))
+    context = multiprocessing.get_context("spawn")
+    reports, done = context.Queue(), [context.Event(), context.Event()]
+    workers = [context.Process(target=_worker, args=(requests, reports, event), daemon=True)
+               for requests, event in ((3, done[0]), (4, done[1]))]
+    for worker in workers:
+        worker.start()
+    try:
+        elected = dict(reports.get(timeout=60) for _ in workers)
+        assert sorted(elected) == sorted(worker.pid for worker in workers)
+        assert sum(elected.values()) == 1
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry, str(tmp_path))
+        assert registry.get_sample_value("api1_requests_total", {"endpoint": "other"}) == 7
+
+        # The worker that is not the sampler exits: its live gauges go, its counts stay
+        index = next(i for i, worker in enumerate(workers) if not elected[worker.pid])
+        dead = workers[index]
+        done[index].set()
+        dead.join(timeout=30)
+        assert not dead.is_alive()
+        assert os.path.exists(tmp_path / f"gauge_livemax_{dead.pid}.db")
+
+        cleanup_dead_workers(str(tmp_path))
+        files = os.listdir(tmp_path)
+        assert f"gauge_livemax_{dead.pid}.db" not in files
+        assert f"counter_{dead.pid}.db" in files
+        assert f"gauge_livemax_{workers[1 - index].pid}.db" in files
+        assert registry.get_sample_value("api1_requests_total", {"endpoint": "other"}) == 7
+    finally:
+        for event in done:
+            event.set()
+        for worker in workers:
+            worker.join(timeout=30)
+            if worker.is_alive():
+                worker.terminate()
@@ -0,0 +1,63 @@
+from BulkUpdate import BulkUpdater
+from fakes import FakeDockerClient
+
+
+def _updater(client, daemon, max_retries=3):
+    return BulkUpdater(client, daemon=daemon, rate=1000.0, burst=1000, max_retries=max_retries, retry_backoff=0)
+
+
+def test_conflicts_are_retried_on_a_reloaded_service():
+    client = FakeDockerClient(num_containers=0, num_services=3)
+    services = {service.name: service for service in client.services.list()}
+    services["my_thesis_service-1"].stale = True  # Another writer got there first: one conflict, then fine
+    services["my_thesis_service-2"].conflict_rate = 1.0  # Loses every race
+    updater = _updater(client, "test-conflicts", max_retries=2)
+    try:
+        report = updater.run([{"service": f"service-{i}", "replicas": 3} for i in range(3)])
+    finally:
+        updater.close()
+
+    results = report["results"]
+    assert [r["status"] for r in results] == ["applied", "applied", "failed"]
+    assert [r["attempts"] for r in results] == [1, 2, 3]
+    assert "out of sequence" in results[2]["message"]
+    assert [r["replicas"] for r in results] == [3, 3, 1]
+    assert report["summary"] == {"applied": 2, "failed": 1}
+    assert len(services["my_thesis_service-1"].updates) == 1
+    assert services["my_thesis_service-2"].updates == []
+
+
+def test_random_conflicts_give_one_result_per_item():
+    client = FakeDockerClient(num_containers=0, num_services=20, conflict_rate=0.5, seed=3)
+    updater = _updater(client, "test-random-conflicts", max_retries=4)
+    try:
+        report = updater.run([{"service": f"service-{i}", "scale_by": 2} for i in range(20)])
+    finally:
+        updater.close()
+
+    services = {service.name: service for service in client.services.list()}
+    assert [r["index"] for r in report["results"]] == list(range(20))
+    for result in report["results"]:
+        service = services["my_thesis_" + result["service"]]
+        assert 1 <= result["attempts"] <= 5
+        if result["status"] == "applied":
+            assert len(service.updates) == 1
+            assert result["replicas"] == 3
+        else:
+            assert result["status"] == "failed" and result["attempts"] == 5
+            assert service.updates == []
+    assert any(r["attempts"] > 1 for r in report["results"])
+
+
+def test_scale_by_is_floored_at_zero():
+    client = FakeDockerClient(num_containers=0, num_services=2)
+    updater = _updater(client, "test-scale-by")
+    try:
+        report = updater.run([{"service": "service-0", "scale_by": -5}, {"service": "service-1", "scale_by": 0}])
+    finally:
+        updater.close()
+
+    first, second = report["results"]
+    assert first["status"] == "applied" and first["replicas"] == 0
+    assert client.services.get("my_thesis_service-0").attrs["Spec"]["Mode"] == {"Replicated": {"Replicas": 0}}
+    assert second["status"] == "unchanged" and second["attempts"] == 0
@@ -0,0 +1,49 @@
+import random
+
+from prometheus_client import CollectorRegistry
+
+from api import DockerMetricsMonitor
+from ContainerState import METRICS
+from fakes import FakeDockerClient, make_stats
+
+
+def _monitor(state_mode):
+    registry = CollectorRegistry()
+    monitor = DockerMetricsMonitor(client=FakeDockerClient(num_containers=0), registry=registry,
+                                   state_mode=state_mode)
+    return monitor, registry
+
+
+def _values(registry, containers):
+    return {(metric, name): registry.get_sample_value(metric, {"container": name})
+            for metric, _, _, _ in METRICS for name in containers}
+
+
+def test_columnar_matches_gauges_however_often_it_is_scraped():
+    rng = random.Random(1)
+    containers = [f"my_thesis_service-{i}.1" for i in range(3)]
+    frames = [(name, make_stats(rng, tick)) for tick in range(1, 7) for name in containers]
+
+    gauges, gauges_registry = _monitor("gauges")
+    rarely, rarely_registry = _monitor("columnar")
+    often, often_registry = _monitor("columnar")
+    states = {}
+    for index, (name, stats) in enumerate(frames):
+        gauges.record_stats(name, stats, states.setdefault(name, {"net_io": None, "blk_io": None}))
+        rarely.record_stats(name, stats, None)
+        often.record_stats(name, stats, None)
+        _values(often_registry, containers)  # A scrape (or a manual curl) after every frame
+        if index % 7 == 6:
+            _values(rarely_registry, containers)
+
+    expected = _values(gauges_registry, containers)
+    assert _values(rarely_registry, containers) == expected
+    assert _values(often_registry, containers) == expected
+    assert expected[("docker_container_network_sent_bytes", containers[0])] is not None
+
+
+def test_first_frame_has_no_deltas():
+    monitor, registry = _monitor("columnar")
+    monitor.record_stats("c", make_stats(random.Random(2), 1), None)
+    assert registry.get_sample_value("docker_container_cpu_usage_percent", {"container": "c"}) is not None
+    assert registry.get_sample_value("docker_container_network_sent_bytes", {"container": "c"}) is None
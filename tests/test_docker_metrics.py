@@ -0,0 +1,73 @@
+import threading
+import time
+
+import pytest
+from prometheus_client import CollectorRegistry
+
+from Deadline import CallTimeout, backend_guard
+from DockerMetrics import DockerMetricsMonitor, update_docker_service
+from fakes import FakeDockerClient, FakeService
+from SelfMetrics import PipelineMetrics
+
+
+class _FastStop(threading.Event):
+    # The monitor sleeps 5 s between rounds; keep the test short
+    def wait(self, timeout=None):
+        return super().wait(min(timeout, 0.02) if timeout is not None else None)
+
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def test_replaced_task_containers_are_forgotten():
+    client = FakeDockerClient(num_containers=2, num_services=1)
+    self_metrics = PipelineMetrics(CollectorRegistry())
+    monitor = DockerMetricsMonitor(registry=CollectorRegistry(), client_factory=lambda: client,
+                                   self_metrics=self_metrics)
+    monitor.stop_event = _FastStop()
+    service = client.services.list()[0]
+    first, second = client.containers.list()
+
+    def sampled():
+        return {container for _, container in self_metrics.last_sample}
+
+    thread = threading.Thread(target=monitor.monitor_service, args=(service,), daemon=True)
+    thread.start()
+    try:
+        assert _wait_for(lambda: sampled() == {first.name, second.name})
+        client._containers.remove(first)
+        assert _wait_for(lambda: sampled() == {second.name})
+    finally:
+        monitor.stop()
+        thread.join(5)
+    assert sampled() == set()
+
+
+class _LateReply(FakeService):
+    # The daemon applies the update but the reply arrives after the caller gave up
+    def update(self, **kwargs):
+        result = super().update(**kwargs)
+        threading.Event().wait(0.3)
+        return result
+
+
+def test_timed_out_update_that_landed_counts_as_applied(monkeypatch):
+    monkeypatch.setitem(backend_guard.max_timeout, "docker", 0.05)
+    service = _LateReply("web")
+    assert update_docker_service(service, mode={"Replicated": {"Replicas": 3}}) is True
+    assert len(service.updates) == 1
+
+
+def test_timed_out_update_still_in_flight_is_reported_as_such(monkeypatch):
+    monkeypatch.setitem(backend_guard.max_timeout, "docker", 0.05)
+    service = FakeService("web", update_delay=0.3)
+    with pytest.raises(CallTimeout, match="may still be applied"):
+        update_docker_service(service, mode={"Replicated": {"Replicas": 3}})
+    # The abandoned call lands anyway, which is why the caller must not retry blindly
+    assert _wait_for(lambda: len(service.updates) == 1)
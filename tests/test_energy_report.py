@@ -0,0 +1,44 @@
+import json
+
+import numpy as np
+
+from EnergyReport import main, parse_limits, service_report
+
+OPTIONS = {"watts_per_core": 10.0, "cpu_limit": 1.0, "limits": {}, "replicas": {}, "default_replicas": 1,
+           "max_gap": 3.0, "price": None}
+
+
+def _cpu(percent, samples=13, step=300.0):
+    timestamps = np.arange(samples, dtype=np.float64) * step
+    return {"cpu": (timestamps, np.full(samples, percent))}
+
+
+def test_modelled_power_covers_every_replica():
+    single = service_report("web", _cpu(50.0), OPTIONS)
+    triple = service_report("web", _cpu(50.0), dict(OPTIONS, replicas={"web": 3}))
+    assert single["mean_watts"] == 5.0
+    assert triple["mean_watts"] == 15.0
+    assert np.isclose(triple["energy_kwh"], 3 * single["energy_kwh"])
+    assert triple["allocated_cores"] == 3.0
+    assert triple["overprovisioning_ratio"] == single["overprovisioning_ratio"]
+
+
+def test_measured_power_is_not_scaled_by_replicas():
+    series = dict(_cpu(50.0), power=(np.arange(13, dtype=np.float64) * 300.0, np.full(13, 42.0)))
+    report = service_report("web", series, dict(OPTIONS, default_replicas=4))
+    assert report["mean_watts"] == 42.0
+
+
+def test_limits_file_gives_replicas_and_limits(tmp_path):
+    path = tmp_path / "limits.csv"
+    path.write_text("service,cpu_limit,replicas\nweb,0.5,3\nworker,,2\n")
+    assert parse_limits(str(path)) == ({"web": 0.5}, {"web": 3, "worker": 2})
+
+
+def test_cli_reads_replicas(tmp_path, capsys):
+    series = tmp_path / "cpu.csv"
+    series.write_text("timestamp,metric,value,series\n" +
+                      "".join(f"{t * 60},docker_service_cpu_usage_percent,20,web\n" for t in range(10)))
+    main([str(series), "--replicas", "5", "--workers", "1", "--output", str(tmp_path / "report.json")])
+    row = json.loads((tmp_path / "report.json").read_text())["services"][0]
+    assert row["replicas"] == 5 and row["mean_watts"] == 10.0
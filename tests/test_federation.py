@@ -0,0 +1,24 @@
+from array import array
+
+from Federation import ExpositionParser, FederationScraper
+
+
+def test_parser_reset_drops_interned_names_and_label_sets():
+    parser = ExpositionParser(max_series=2)
+    parser.parse('a{x="1"} 1\nb{x="2"} 2\n')
+    parser.parse('c{x="3"} 3\n')
+    assert len(parser.series) == 1
+    assert set(parser.names) == {"c"}
+    assert set(parser.label_sets) == {(("x", "3"),)}
+
+
+def test_unmerged_series_replace_the_targets_own_instance_label():
+    scraper = FederationScraper(["http://a/metrics", "http://b/metrics"], aggregation={"up": "none"})
+    try:
+        scraper.series = {("up", (("instance", "localhost:8000"), ("job", "api"))): array("d", [1.0, 0.0])}
+        assert scraper.merged() == {
+            ("up", (("instance", "http://a/metrics"), ("job", "api"))): 1.0,
+            ("up", (("instance", "http://b/metrics"), ("job", "api"))): 0.0,
+        }
+    finally:
+        scraper.close()
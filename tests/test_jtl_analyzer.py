@@ -0,0 +1,28 @@
+from JtlAnalyzer import JtlAnalyzer, ResourceSeries, correlate
+
+
+def test_cpu_defaults_do_not_count_service_and_container_gauges_twice():
+    series = ResourceSeries()
+    assert series.kind_of("docker_service_cpu_usage_percent") == "cpu"
+    assert series.kind_of("docker_container_cpu_usage_percent") is None
+
+
+def test_a_sampler_named_all_is_not_merged_into_the_totals():
+    analyzer = JtlAnalyzer(bucket_seconds=10)
+    analyzer.add(100.0, 50, "ALL", True)
+    analyzer.add(101.0, 10, "login", True)
+    analyzer.add(112.0, 20, "login", False)
+
+    labels = analyzer.labels()
+    assert labels["ALL"]["count"] == 1
+    assert labels["login"]["count"] == 2
+    assert labels["ALL (all labels)"]["count"] == 3
+    assert [(bucket, stats.count) for bucket, stats in analyzer.bucket_rows()] == [(100, 2), (110, 1)]
+    assert [(bucket, stats.count) for bucket, stats in analyzer.bucket_rows("ALL")] == [(100, 1)]
+
+
+def test_totals_are_rendered_as_all():
+    analyzer = JtlAnalyzer(bucket_seconds=10)
+    analyzer.add(100.0, 10, "login", True)
+    assert list(analyzer.labels()) == ["login", "ALL"]
+    assert correlate(analyzer, ResourceSeries())["labels"]["ALL"]["count"] == 1
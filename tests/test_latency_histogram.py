@@ -0,0 +1,12 @@
+from LatencyHistogram import LatencyHistogram
+
+
+def test_bucket_width_stays_within_the_documented_bound():
+    histogram = LatencyHistogram()
+    widest = 0.0
+    # Values below 2**precision_bits have a bucket each
+    for value in range(1 << histogram.precision_bits, 1 << 16):
+        lowest, highest = histogram._bounds(histogram._index(value))
+        assert lowest <= value <= highest
+        widest = max(widest, (highest - lowest + 1) / lowest)
+    assert widest == 1 / 2 ** (histogram.precision_bits - 1)
@@ -0,0 +1,44 @@
+import asyncio
+
+import pytest
+
+from LoadGenerator import ConstantRate, LoadGenerator, main
+
+
+@pytest.mark.parametrize("argv", [
+    ["http://localhost:1", "--rate", "0"],
+    ["http://localhost:1", "--rate", "-5", "--arrival", "uniform"],
+    ["http://localhost:1", "--arrival", "step", "--steps", "10:0,10:0"],
+    ["http://localhost:1", "--arrival", "diurnal", "--rate", "0", "--peak-rate", "0"],
+])
+def test_non_positive_peak_rate_is_rejected(argv, capsys):
+    with pytest.raises(SystemExit) as exit_info:
+        main(argv)
+    assert exit_info.value.code == 2
+    assert "peak request rate must be positive" in capsys.readouterr().err
+
+
+class _BrokenSession:
+    def get(self, url):
+        raise RuntimeError("unexpected")
+
+
+def test_in_flight_is_released_when_a_request_fails_unexpectedly():
+    generator = LoadGenerator("http://localhost:1", ConstantRate(10), "/get_data=1")
+
+    async def scenario():
+        generator.in_flight += 1
+        with pytest.raises(RuntimeError):
+            await generator._request(_BrokenSession(), asyncio.Semaphore(1), "/get_data", 0.0, 0.0)
+
+        # Cancelled while waiting for a slot
+        slots = asyncio.Semaphore(0)
+        generator.in_flight += 1
+        task = asyncio.ensure_future(generator._request(_BrokenSession(), slots, "/get_data", 0.0, 0.0))
+        await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(scenario())
+    assert generator.in_flight == 0
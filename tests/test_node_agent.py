@@ -0,0 +1,101 @@
+import gzip
+import json
+
+from NodeAgent import ClusterAggregator, HashRing
+
+
+def _push(aggregator, agent, seq, samples=None, full=False, removed=(), visible=None, gzipped=False):
+    batch = {"agent": agent, "seq": seq, "full": full, "interval": 5,
+             "samples": samples or {}, "removed": list(removed)}
+    if visible is not None:
+        batch["visible"] = visible
+    body = json.dumps(batch).encode("utf-8")
+    if gzipped:
+        return aggregator.handle_push(gzip.compress(body), "gzip")
+    return aggregator.handle_push(body)
+
+
+def test_delta_after_a_sequence_gap_asks_for_a_resync():
+    aggregator = ClusterAggregator()
+    assert _push(aggregator, "node-a", 1, full=True, visible=["c1"])["resync"] is False
+    assert _push(aggregator, "node-a", 3, {"c1": {"cpu_percent": 1.0}}) == {"resync": True}
+    assert "cpu_percent" not in aggregator.containers.get("c1", {})
+
+    # The next delta in sequence is still accepted, and so is a full batch after the gap
+    assert _push(aggregator, "node-a", 2, {"c1": {"cpu_percent": 2.0}})["resync"] is False
+    assert _push(aggregator, "node-a", 7, {"c1": {"cpu_percent": 3.0}}, full=True)["resync"] is False
+    assert aggregator.containers["c1"]["cpu_percent"] == 3.0
+
+
+def test_delta_from_an_unknown_agent_asks_for_a_resync():
+    aggregator = ClusterAggregator()
+    assert _push(aggregator, "node-b", 4, {"c1": {"cpu_percent": 1.0}}, gzipped=True) == {"resync": True}
+    assert aggregator.containers == {}
+    assert aggregator.agents == {}
+
+
+def test_ring_owner_is_one_of_the_candidates():
+    ring = HashRing(["a", "b", "c"], vnodes=16)
+    for i in range(200):
+        assert ring.owner(f"key-{i}", {"b", "c"}) in {"b", "c"}
+        assert ring.owner(f"key-{i}", {"a"}) == "a"
+    assert HashRing().owner("key") is None
+
+
+def test_removing_a_member_only_moves_its_own_keys():
+    ring = HashRing(["a", "b", "c"], vnodes=32)
+    keys = [f"key-{i}" for i in range(500)]
+    before = {key: ring.owner(key) for key in keys}
+    ring.remove("b")
+    after = {key: ring.owner(key) for key in keys}
+
+    moved = {key for key in keys if before[key] != after[key]}
+    assert moved == {key for key in keys if before[key] == "b"}
+    assert "b" not in after.values()
+
+
+def test_assignments_split_shared_containers_across_the_agents_that_see_them():
+    aggregator = ClusterAggregator()
+    visible = [f"c{i}" for i in range(50)]
+    _push(aggregator, "node-a", 1, full=True, visible=visible + ["only-a"])
+    reply = _push(aggregator, "node-b", 1, full=True, visible=visible)
+    owned_b = set(reply["owned"])
+    owned_a = set(_push(aggregator, "node-a", 2, visible=visible + ["only-a"])["owned"])
+
+    assert owned_a | owned_b == set(visible) | {"only-a"}
+    assert owned_a & owned_b == set()
+    assert "only-a" in owned_a
+
+
+def test_deltas_merge_into_the_full_state():
+    aggregator = ClusterAggregator()
+    _push(aggregator, "node-a", 1, full=True, samples={
+        "c1": {"name": "web.1", "service": "web", "cpu_percent": 10.0, "memory_percent": 5.0},
+        "c2": {"name": "web.2", "service": "web", "cpu_percent": 20.0, "memory_percent": 7.0},
+        "c3": {"name": "db.1", "service": "db", "cpu_percent": 1.0},
+    })
+    _push(aggregator, "node-a", 2, samples={"c1": {"cpu_percent": 15.0}}, removed=["c3"])
+
+    assert aggregator.containers["c1"]["cpu_percent"] == 15.0
+    assert aggregator.containers["c1"]["memory_percent"] == 5.0
+    assert "c3" not in aggregator.containers
+
+    _push(aggregator, "node-b", 1, full=True, samples={
+        "c4": {"name": "web.3", "service": "web", "cpu_percent": 30.0}})
+    view = aggregator.cluster_view()
+    assert view["web"]["containers"] == 3
+    assert view["web"]["nodes"] == ["node-a", "node-b"]
+    assert view["web"]["cpu_percent"] == 65.0
+    assert view["web"]["memory_percent"] == 12.0
+
+    # A full batch replaces the agent's state: containers missing from it are gone
+    _push(aggregator, "node-a", 3, full=True, samples={"c2": aggregator.containers["c2"]})
+    assert set(aggregator.containers) == {"c2", "c4"}
+
+
+def test_removal_from_another_agent_is_ignored():
+    aggregator = ClusterAggregator()
+    _push(aggregator, "node-a", 1, full=True, samples={"c1": {"cpu_percent": 1.0}})
+    _push(aggregator, "node-b", 1, full=True)
+    _push(aggregator, "node-b", 2, removed=["c1"])
+    assert "c1" in aggregator.containers
@@ -0,0 +1,36 @@
+from NodeConsolidation import ACTIVE_POOL_LABEL, ACTIVE_POOL_VALUE, NodeConsolidationOptimizer, apply_plan, \
+    synthetic_cluster
+
+
+class _Node:
+    def __init__(self, name, availability):
+        self.id = name
+        self.attrs = {"Description": {"Hostname": name}, "Spec": {"Availability": availability, "Labels": {}}}
+
+    def update(self, spec):
+        self.attrs["Spec"] = spec
+
+
+class _Client:
+    def __init__(self, nodes):
+        self.nodes = type("Nodes", (), {"list": staticmethod(lambda: list(nodes))})()
+
+
+def test_apply_plan_reactivates_drained_nodes_it_uses():
+    services, nodes, current_placement = synthetic_cluster(num_nodes=12, num_services=30, seed=3)
+    plan = NodeConsolidationOptimizer(services, nodes).optimize(current_placement)
+    assert plan["active_nodes"] and plan["drain_nodes"]
+
+    # Every node drained, e.g. by an earlier plan that needed fewer of them
+    swarm = {node["name"]: _Node(node["name"], "drain") for node in nodes}
+    results = apply_plan(_Client(swarm.values()), plan, dry_run=False)
+
+    assert all(result["status"] == "success" for result in results)
+    for name in plan["active_nodes"]:
+        spec = swarm[name].attrs["Spec"]
+        assert spec["Availability"] == "active"
+        assert spec["Labels"][ACTIVE_POOL_LABEL] == ACTIVE_POOL_VALUE
+    for name in plan["drain_nodes"]:
+        assert swarm[name].attrs["Spec"]["Availability"] == "drain"
+    assert all("--availability active" in action["command"] for action in plan["actions"]
+               if action["action"] == "label")
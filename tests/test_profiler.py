@@ -0,0 +1,78 @@
+import marshal
+import pstats
+import threading
+import time
+
+from Profiler import ProfilingController
+
+TOKEN = {"X-Admin-Token": "secret"}
+
+
+def _busy(stop):
+    while not stop.is_set():
+        sum(i * i for i in range(1000))
+
+
+def test_token_gating():
+    controller = ProfilingController(admin_token="secret")
+    assert controller.handle("cpu", {"seconds": "0.1"}, {})[0] == 401
+    assert controller.handle("cpu", {"seconds": "0.1"}, {"X-Admin-Token": "wrong"})[0] == 403
+    assert ProfilingController(admin_token="").handle("cpu", {"seconds": "0.1"}, TOKEN)[0] == 404
+    assert controller.handle("cpu", {"seconds": "0.1"}, TOKEN)[0] == 200
+
+
+def test_second_profile_while_one_runs_is_a_409():
+    controller = ProfilingController(admin_token="secret")
+    results = []
+    first = threading.Thread(target=lambda: results.append(controller.handle("cpu", {"seconds": "0.5"}, TOKEN)))
+    first.start()
+    try:
+        while not controller.lock.locked():
+            time.sleep(0.001)
+        status, _, body, _ = controller.handle("memory", {"seconds": "0.1"}, TOKEN)
+        assert status == 409 and b"already running" in body
+    finally:
+        first.join()
+    assert results[0][0] == 200
+    assert controller.handle("memory", {"seconds": "0.1"}, TOKEN)[0] == 200
+
+
+def test_collapsed_output_has_weighted_stacks():
+    stop = threading.Event()
+    worker = threading.Thread(target=_busy, args=(stop,), name="busy-worker")
+    worker.start()
+    try:
+        status, content_type, body, headers = ProfilingController(admin_token="secret").handle(
+            "cpu", {"seconds": "0.1", "interval": "0.005"}, TOKEN)
+    finally:
+        stop.set()
+        worker.join()
+
+    assert status == 200 and content_type == "text/plain"
+    assert int(headers["X-Profile-Samples"]) > 0
+    lines = body.decode("utf-8").splitlines()
+    busy = [line for line in lines if line.startswith("busy-worker;")]
+    assert busy and any("_busy (" in line for line in busy)
+    for line in lines:
+        stack, _, weight = line.rpartition(" ")
+        assert stack and int(weight) >= 1
+
+
+def test_pstats_output_loads(tmp_path):
+    stop = threading.Event()
+    worker = threading.Thread(target=_busy, args=(stop,))
+    worker.start()
+    try:
+        status, content_type, body, headers = ProfilingController(admin_token="secret").handle(
+            "cpu", {"seconds": "0.1", "format": "pstats"}, TOKEN)
+    finally:
+        stop.set()
+        worker.join()
+
+    assert status == 200 and content_type == "application/octet-stream"
+    path = tmp_path / "profile.pstats"
+    path.write_bytes(body)
+    stats = pstats.Stats(str(path))
+    assert any(name == "_busy" for (_, _, name) in stats.stats)
+    assert stats.total_tt > 0
+    assert marshal.loads(body) == stats.stats
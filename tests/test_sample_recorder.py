@@ -0,0 +1,25 @@
+from SampleRecorder import SampleRecorder, read_records
+
+
+def _record(path, keys):
+    recorder = SampleRecorder(str(path), block_records=1)
+    for key in keys:
+        recorder.record("psutil", key, {"cpu": 1.0}, timestamp=1.0)
+    recorder.close()
+
+
+def test_reopening_after_a_torn_block_keeps_later_records_readable(tmp_path):
+    path = tmp_path / "samples.log"
+    _record(path, ["a", "b"])
+    with open(path, "ab") as f:
+        # A block header and half its payload, as left by a crash mid-write
+        f.write(b"\x00\x00\x00\x40\x12\x34\x56\x78partial")
+    _record(path, ["c"])
+    assert [key for _, _, key, _ in read_records(str(path))] == ["a", "b", "c"]
+
+
+def test_torn_magic_header_is_rewritten(tmp_path):
+    path = tmp_path / "samples.log"
+    path.write_bytes(b"SRE")
+    _record(path, ["a"])
+    assert [key for _, _, key, _ in read_records(str(path))] == ["a"]
@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+from aiohttp import ClientSession, web
+from aiohttp.test_utils import TestServer
+
+from BulkUpdate import BulkUpdater, current_replicas
+from fakes import FakeDockerClient
+from ScaleToZero import IdlePolicy, ScaleToZeroProxy, parse_routes
+
+
+def test_parse_routes_orders_longest_prefix_first():
+    routes = parse_routes(["/app/=svc@http://app:8000/", "/app/admin/=admin@http://admin:8001"])
+    assert [route["prefix"] for route in routes] == ["/app/admin/", "/app/"]
+    assert routes[1] == {"prefix": "/app/", "service": "svc", "upstream": "http://app:8000"}
+    with pytest.raises(ValueError):
+        parse_routes(["/app/=svc"])
+
+
+def test_idle_policy_counts_requests_and_busy_cpu_as_activity():
+    policy = IdlePolicy(idle_after=60, cpu_threshold=2.0)
+    policy.observe("svc", 0)
+    assert not policy.is_idle("svc", 59)
+    assert policy.is_idle("svc", 60)
+    policy.observe("svc", 60, cpu_percent=5.0)
+    assert not policy.is_idle("svc", 100)
+    policy.observe("svc", 110, cpu_percent=1.0)  # Under the threshold: not activity
+    assert policy.is_idle("svc", 120)
+    policy.note_request("svc", 120)
+    assert not policy.is_idle("svc", 150)
+
+
+def _proxy(upstream, idle_after=900.0):
+    client = FakeDockerClient(num_containers=1, num_services=1)
+    service = client.services.list()[0]
+    routes = parse_routes([f"/app/={service.name}@{upstream}"])
+    proxy = ScaleToZeroProxy(routes, client, BulkUpdater(client, daemon="scale-to-zero-test"),
+                             policy=IdlePolicy(idle_after=idle_after), health_interval=0.01, wake_timeout=5)
+    return proxy, service
+
+
+def test_held_requests_share_one_wake_up():
+    async def scenario():
+        async def ok(request):
+            return web.Response(text="ok")
+
+        upstream_app = web.Application()
+        upstream_app.router.add_get("/{tail:.*}", ok)
+        async with TestServer(upstream_app) as upstream:
+            proxy, service = _proxy(str(upstream.make_url("")).rstrip("/"))
+            service.attrs["Spec"]["Mode"] = {"Replicated": {"Replicas": 0}}
+            async with TestServer(proxy.make_app()) as server, ClientSession() as session:
+                state = proxy.states[service.name]
+                state.replicas = 3  # Restored on wake
+                updates_before = len(service.updates)
+
+                async def get():
+                    async with session.get(server.make_url("/app/hello")) as response:
+                        return response.status, await response.text()
+
+                results = await asyncio.gather(*(get() for _ in range(5)))
+            assert results == [(200, "ok")] * 5
+            assert len(service.updates) - updates_before == 1
+            assert current_replicas(service) == 3
+            assert state.scaled_down_at is None
+    asyncio.run(scenario())
+
+
+def test_request_arriving_before_the_scale_down_lock_keeps_the_service_up():
+    async def scenario():
+        proxy, service = _proxy("http://upstream.invalid", idle_after=0.0)
+        state = proxy.states[service.name]
+        replicas = current_replicas(service)
+        await state.lock.acquire()
+        check = asyncio.ensure_future(proxy.check_idle())
+        await asyncio.sleep(0.01)  # check_idle found the service idle and waits for the lock
+        state.in_flight += 1  # A request is being forwarded
+        state.lock.release()
+        await check
+        assert state.scaled_down_at is None
+        assert current_replicas(service) == replicas
+    asyncio.run(scenario())
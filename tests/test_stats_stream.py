@@ -0,0 +1,39 @@
+import threading
+import time
+
+from prometheus_client import CollectorRegistry
+
+from fakes import FakeDockerClient
+from StatsStream import StatsStreamPool, register_unsampled
+
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def test_containers_beyond_the_connection_limit_are_polled():
+    client = FakeDockerClient(num_containers=6, stream_interval=0.05)
+    pool = StatsStreamPool(client, max_connections=2)
+    registry = CollectorRegistry()
+    register_unsampled(pool, registry, max_age=30)
+    for container in client.containers.list():
+        pool.watch(container)
+    assert len(pool.waiting) == 4
+
+    # Streams never end, so without polling the waiting containers would never get a frame
+    assert _wait_for(lambda: len(pool.latest()) == 2)
+    assert registry.get_sample_value("docker_container_unsampled",
+                                     {"container": pool.waiting[0], "reason": "no_frame"}) == 1
+
+    threading.Thread(target=pool.run_poller, kwargs={"interval": 0.1}, daemon=True).start()
+    try:
+        assert _wait_for(lambda: len(pool.latest()) == 6)
+        assert pool.unsampled(max_age=30) == {}
+        assert not [m for m in registry.collect() if m.name == "docker_container_unsampled"][0].samples
+    finally:
+        pool.stop()
@@ -0,0 +1,75 @@
+from types import SimpleNamespace
+
+import pytest
+
+from app import MonitoringServices, create_app
+from StatusApi import ApiError, build_page, filter_status
+
+ENTRIES = [
+    {"name": f"service-{i:02d}", "cpu": i,
+     "cpu_recommendation": "⚠️ High CPU" if i % 3 == 0 else "✅ OK",
+     "memory_recommendation": "❌ Out of memory" if i == 7 else "✅ OK"}
+    for i in range(25)
+]
+
+
+def test_unknown_level_is_rejected():
+    with pytest.raises(ApiError, match="Unknown level: severe"):
+        filter_status(ENTRIES, {"level": "warning,severe"})
+
+
+def test_level_and_resource_filters():
+    warning = filter_status(ENTRIES, {"level": "warning"})
+    assert [entry["name"] for entry in warning] == [f"service-{i:02d}" for i in range(0, 25, 3)]
+    assert [entry["name"] for entry in filter_status(ENTRIES, {"level": "critical", "resource": "memory"})] == \
+        ["service-07"]
+    assert filter_status(ENTRIES, {"level": "critical", "resource": "cpu"}) == []
+
+
+def test_cursor_round_trip_visits_every_row_once():
+    names, args = [], {"limit": "10"}
+    while True:
+        page = build_page(ENTRIES, "name", args)
+        names += [item["name"] for item in page["items"]]
+        if page["next_cursor"] is None:
+            break
+        args = {"limit": "10", "cursor": page["next_cursor"]}
+    assert names == sorted(entry["name"] for entry in ENTRIES)
+    assert page["count"] == 5
+
+    with pytest.raises(ApiError):
+        build_page(ENTRIES, "name", {"cursor": "_w"})  # Not UTF-8
+
+
+def test_fields_selection_keeps_the_key():
+    page = build_page(ENTRIES, "name", {"fields": "cpu", "limit": "2"})
+    assert page["items"] == [{"name": "service-00", "cpu": 0}, {"name": "service-01", "cpu": 1}]
+
+
+def _client(entries):
+    services = MonitoringServices()
+    services._status_broadcaster = SimpleNamespace(snapshot=lambda: (1, list(entries), []))
+    return create_app(services, start_collectors=False).test_client()
+
+
+def test_status_etag_answers_304_until_the_page_changes():
+    entries = list(ENTRIES)
+    client = _client(entries)
+
+    first = client.get("/api/status?limit=5")
+    assert first.status_code == 200
+    etag = first.headers["ETag"]
+    assert client.get("/api/status?limit=5", headers={"If-None-Match": etag}).status_code == 304
+
+    # A row on a later page doesn't change this page's validator; one on it does
+    entries[20] = dict(entries[20], cpu=99)
+    assert client.get("/api/status?limit=5", headers={"If-None-Match": etag}).status_code == 304
+    entries[0] = dict(entries[0], cpu=99)
+    changed = client.get("/api/status?limit=5", headers={"If-None-Match": etag})
+    assert changed.status_code == 200 and changed.headers["ETag"] != etag
+
+
+def test_status_bad_query_is_a_400():
+    response = _client(ENTRIES).get("/api/status?level=severe")
+    assert response.status_code == 400
+    assert response.get_json()["message"] == "Unknown level: severe"
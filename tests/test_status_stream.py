@@ -0,0 +1,93 @@
+import json
+import queue
+import time
+
+from StatusStream import StatusBroadcaster, _diff_rows
+
+
+def _wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def _decode(event):
+    kind, data = event.rstrip("\n").split("\n")
+    return kind[len("event: "):], json.loads(data[len("data: "):])
+
+
+def _broadcaster(rows, **kwargs):
+    return StatusBroadcaster(lambda: [{"name": name, "cpu": cpu} for name, cpu in rows.items()], lambda: [], **kwargs)
+
+
+def test_diff_rows():
+    previous = {"a": {"v": 1}, "b": {"v": 2}, "c": {"v": 3}}
+    current = {"a": {"v": 1}, "b": {"v": 5}, "d": {"v": 4}}
+    assert _diff_rows(previous, current) == ([{"v": 5}, {"v": 4}], ["c"])
+    assert _diff_rows(current, dict(current)) == ([], [])
+
+
+def test_refresh_returns_only_the_changes():
+    rows = {"web": 1, "db": 2}
+    broadcaster = _broadcaster(rows)
+    first = broadcaster.refresh()
+    assert first["version"] == 1 and len(first["status"]["upsert"]) == 2
+    assert broadcaster.refresh() is None
+
+    rows["web"] = 3
+    del rows["db"]
+    diff = broadcaster.refresh()
+    assert diff["version"] == 2
+    assert diff["status"] == {"upsert": [{"name": "web", "cpu": 3}], "remove": ["db"]}
+
+
+def test_slow_subscriber_is_resynchronised_with_a_snapshot():
+    rows = {"web": 0}
+    broadcaster = _broadcaster(rows, max_pending=2)
+    slow = queue.Queue(maxsize=2)
+    broadcaster.subscribers.add(slow)  # Not via subscribe(): no background thread in this test
+
+    for cpu in range(1, 5):
+        rows["web"] = cpu
+        broadcaster._publish(broadcaster.refresh())
+
+    events = [_decode(slow.get_nowait()) for _ in range(slow.qsize())]
+    kinds = [kind for kind, _ in events]
+    assert kinds[0] == "snapshot" and len(kinds) <= 2
+    # Whatever it missed, replaying what is queued ends at the current state
+    state = {}
+    for kind, payload in events:
+        if kind == "snapshot":
+            state = {row["name"]: row for row in payload["status"]}
+        else:
+            state.update({row["name"]: row for row in payload["status"]["upsert"]})
+    assert state == {"web": {"name": "web", "cpu": 4}}
+    assert events[-1][1]["version"] == 4
+
+
+def test_thread_stops_when_the_last_subscriber_leaves():
+    rows = {"web": 0}
+    broadcaster = _broadcaster(rows, interval=0.05)
+    first, second = broadcaster.subscribe(), broadcaster.subscribe()
+    thread = broadcaster.thread
+    assert thread is not None and thread.is_alive()
+    assert _wait_for(lambda: first.qsize() > 0)
+
+    broadcaster.unsubscribe(first)
+    rows["web"] = 1
+    assert _wait_for(lambda: any(_decode(event)[1]["status"]["upsert"] == [{"name": "web", "cpu": 1}]
+                                 for event in list(second.queue)))
+    assert thread.is_alive()
+
+    broadcaster.unsubscribe(second)
+    thread.join(timeout=5)
+    assert not thread.is_alive()
+    assert broadcaster.thread is None
+
+    # A new subscriber starts a new thread
+    third = broadcaster.subscribe()
+    assert broadcaster.thread is not None and broadcaster.thread is not thread
+    broadcaster.unsubscribe(third)